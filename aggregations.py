@@ -0,0 +1,43 @@
+import pandas as pd
+
+# Columns charted in the dashboard tabs, in the order they appear in the GROUPING() bitmask
+CHART_COLUMNS = ["country_name", "violation", "stop_outcome", "is_arrested", "drugs_related_stop"]
+
+# One grouped round-trip for every tab chart and metric card: a grouping set per charted column plus the grand total
+DASHBOARD_AGGREGATE_QUERY = f"""SELECT {", ".join(CHART_COLUMNS)},
+    GROUPING({", ".join(CHART_COLUMNS)}) AS grouping_id,
+    COUNT(*) AS total
+    FROM "Policelog"
+    GROUP BY GROUPING SETS ({", ".join(f"({column})" for column in CHART_COLUMNS)}, ());"""
+
+ALL_ROLLED_UP = (1 << len(CHART_COLUMNS)) - 1
+
+
+# GROUPING() sets a bit for every column that was rolled up, the first column being the highest bit
+def grouping_id_for(column):
+    return ALL_ROLLED_UP & ~(1 << (len(CHART_COLUMNS) - 1 - CHART_COLUMNS.index(column)))
+
+
+# Split the grouped result into per-column value counts (like value_counts(), nulls dropped) and the metric totals
+def split_aggregates(aggregates):
+    counts = {}
+    for column in CHART_COLUMNS:
+        if aggregates.empty:
+            counts[column] = pd.Series(dtype="int64", name="count")
+            continue
+        rows = aggregates[(aggregates["grouping_id"] == grouping_id_for(column)) & aggregates[column].notna()]
+        counts[column] = (
+            rows.set_index(column)["total"].astype("int64").rename("count").sort_values(ascending=False, kind="stable")
+        )
+
+    outcomes = counts["stop_outcome"]
+    outcome_names = outcomes.index.to_series().astype(str)
+    drug_stops = counts["drugs_related_stop"]
+    grand_total = aggregates.loc[aggregates["grouping_id"] == ALL_ROLLED_UP, "total"] if not aggregates.empty else []
+    totals = {
+        "total_stops": int(grand_total.iloc[0]) if len(grand_total) else 0,
+        "total_arrests": int(outcomes[outcome_names.str.contains("arrest", case=False).values].sum()),
+        "total_warnings": int(outcomes[outcome_names.str.contains("warning", case=False).values].sum()),
+        "drug_related_stops": int(drug_stops[drug_stops.index == 1].sum()),
+    }
+    return counts, totals
@@ -0,0 +1,379 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+
+from aggregations import DASHBOARD_AGGREGATE_QUERY, split_aggregates
+from db import ConnectionPool, connect, fetch_frame, run_query
+from ingest import COLUMNS, CREATE_TABLE_SQL, copy_chunk, table_columns
+from predictor import PredictorIndex, PREDICTOR_INDEX_QUERY
+from preview import PAGE_SIZES, SORT_COLUMNS, build_page_query, split_page
+from queries import query_map
+from schema import migrate
+
+# Benchmarks run against their own database so the real register is never touched
+BENCH_DATABASE = "policelog_bench"
+SIZES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+DEFAULT_SEED = 42
+DEFAULT_REPEAT = 3
+
+# Rows are generated in fixed blocks, each from its own seeded generator, so the data for a given
+# (rows, seed) is identical whatever chunk size the load uses
+GENERATOR_BLOCK = 100_000
+START = pd.Timestamp("2020-01-01")
+SPAN_DAYS = 3 * 365
+
+# Value distributions, roughly shaped like the traffic_stops file the notebook cleans
+COUNTRIES = (["USA", "Canada", "India"], [0.45, 0.30, 0.25])
+GENDERS = (["M", "F"], [0.68, 0.32])
+RACES = (["White", "Black", "Hispanic", "Asian", "Other"], [0.45, 0.20, 0.15, 0.10, 0.10])
+VIOLATIONS = (["Speeding", "Other", "DUI", "Seatbelt", "Signal"], [0.50, 0.20, 0.10, 0.10, 0.10])
+RAW_VIOLATIONS = {"Speeding": "Speeding", "Other": "Other", "DUI": "Drunk Driving", "Seatbelt": "Seatbelt", "Signal": "Signal Violation"}
+DURATIONS = ["0-15 Min", "16-30 Min", "30+ Min"]
+STATES = ["UP", "RJ", "WB", "DL", "TN", "GJ", "KA", "MH"]
+
+# Share of stops per hour of day: quiet nights, busy commutes
+HOUR_WEIGHTS = np.array([1, 1, 1, 1, 1, 2, 4, 7, 9, 7, 6, 6, 6, 6, 6, 7, 9, 9, 7, 5, 4, 3, 2, 1], dtype=float)
+
+
+def parse_rows(value):
+    value = value.lower().replace("_", "")
+    if value in SIZES:
+        return SIZES[value]
+    return int(value)
+
+
+def _choice(rng, values, n):
+    return rng.choice(values[0], n, p=values[1])
+
+
+# Plate numbers of the vehicle fleet; a few vehicles are stopped very often (Zipf-like popularity)
+def _fleet(seed, rows):
+    rng = np.random.default_rng([seed, 0])
+    size = max(1000, rows // 4)
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"), dtype=object)
+    plates = (
+        rng.choice(STATES, size).astype(object)
+        + rng.integers(10, 100, size).astype(str).astype(object)
+        + letters[rng.integers(0, 26, size)] + letters[rng.integers(0, 26, size)]
+        + rng.integers(1000, 10000, size).astype(str).astype(object)
+    )
+    weights = 1.0 / np.arange(1, size + 1) ** 0.7
+    return plates, weights / weights.sum()
+
+
+def _block(seed, index, n, first_day, days, fleet):
+    rng = np.random.default_rng([seed, index + 1])
+    day = first_day + rng.random(n) * days
+    hours = rng.choice(24, n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = np.sort(np.floor(day).astype(np.int64) * 86400 + hours * 3600 + rng.integers(0, 3600, n))
+    timestamp = START + pd.to_timedelta(seconds, unit="s")
+
+    violation = _choice(rng, VIOLATIONS, n)
+    searched = rng.random(n) < np.where(violation == "DUI", 0.30, 0.06)
+    drugs = rng.random(n) < np.where(searched, 0.35, 0.02)
+    outcome = np.where(
+        drugs,
+        rng.choice(["Arrest", "Ticket", "Warning"], n, p=[0.6, 0.3, 0.1]),
+        rng.choice(["Ticket", "Warning", "Arrest"], n, p=[0.6, 0.3, 0.1]),
+    )
+    arrested = (outcome == "Arrest") | (rng.random(n) < 0.02)
+    duration = np.where(
+        arrested,
+        rng.choice(DURATIONS, n, p=[0.2, 0.4, 0.4]),
+        rng.choice(DURATIONS, n, p=[0.75, 0.2, 0.05]),
+    )
+    raw = np.where(rng.random(n) < 0.7, pd.Series(violation).map(RAW_VIOLATIONS).to_numpy(), rng.choice(list(RAW_VIOLATIONS.values()), n))
+    plates, weights = fleet
+
+    return pd.DataFrame({
+        "stop_date": timestamp.strftime("%Y-%m-%d"),
+        "stop_time": timestamp.strftime("%H:%M:%S"),
+        "country_name": _choice(rng, COUNTRIES, n),
+        "driver_gender": _choice(rng, GENDERS, n),
+        "driver_age_raw": np.clip(np.rint(rng.normal(40, 15, n)), 16, 90),
+        "driver_age": np.clip(np.rint(rng.gamma(6.0, 6.5, n)), 16, 90),
+        "driver_race": _choice(rng, RACES, n),
+        "violation_raw": raw,
+        "violation": violation,
+        "search_conducted": searched,
+        "search_type": np.where(searched, rng.choice(["Vehicle Search", "Frisk"], n, p=[0.6, 0.4]), "none"),
+        "stop_outcome": outcome,
+        "is_arrested": arrested,
+        "stop_duration": duration,
+        "drugs_related_stop": drugs,
+        "vehicle_number": plates[rng.choice(len(plates), n, p=weights)],
+        "timestamp": timestamp,
+    }, columns=COLUMNS)
+
+
+# Seeded synthetic traffic stops in the notebook's cleaned schema, in timestamp order, one block at a time
+def generate(rows, seed=DEFAULT_SEED):
+    fleet = _fleet(seed, rows)
+    blocks = -(-rows // GENERATOR_BLOCK)
+    for index in range(blocks):
+        n = min(GENERATOR_BLOCK, rows - index * GENERATOR_BLOCK)
+        yield _block(seed, index, n, SPAN_DAYS * index / blocks, SPAN_DAYS / blocks, fleet)
+
+
+def _bench_config(database):
+    return {"database": database}
+
+
+def create_database(database):
+    conn = connect(database="postgres")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database,))
+            if cursor.fetchone() is None:
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(database)))
+    finally:
+        conn.close()
+
+
+def _dataset_tag(rows, seed, migrated=False):
+    return f"bench rows={rows} seed={seed}" + (" migrated" if migrated else "")
+
+
+# Tag of the generated dataset currently loaded, or None when there is none
+def loaded_dataset(database):
+    try:
+        conn = connect(**_bench_config(database))
+    except psycopg2.OperationalError:    # the benchmark database does not exist yet
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT obj_description(to_regclass('\"Policelog\"'), 'pg_class')")
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+# (Re)create "Policelog" in the benchmark database and COPY the generated rows into it. With migrated=True
+# the table gets the typed schema and indexes from schema.py, so both layouts can be compared.
+def load(database, rows, seed=DEFAULT_SEED, migrated=False, report=print):
+    create_database(database)
+    conn = connect(autocommit=False, **_bench_config(database))
+    started = time.perf_counter()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS "Policelog" CASCADE;')
+                cursor.execute("DROP TABLE IF EXISTS policelog_schema_migrations;")
+                cursor.execute(CREATE_TABLE_SQL)
+                columns = [column for column in table_columns(cursor) if column in COLUMNS]
+                loaded = 0
+                for chunk in generate(rows, seed):
+                    copy_chunk(cursor, "Policelog", chunk, columns)
+                    loaded += len(chunk)
+                    report(f"loaded {loaded:,} of {rows:,} rows")
+                cursor.execute(sql.SQL('COMMENT ON TABLE "Policelog" IS {}').format(
+                    sql.Literal(_dataset_tag(rows, seed, migrated))
+                ))
+        if migrated:
+            migrate(conn, report=report)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE "Policelog";')
+    finally:
+        conn.close()
+    seconds = time.perf_counter() - started
+    report(f"{rows:,} rows in {seconds:.1f}s ({rows / seconds:,.0f} rows/sec)")
+    return seconds
+
+
+def _fetch_target(pool, query, params=None):
+    def run():
+        timings = {}
+        frame = fetch_frame(pool, query, params, timings=timings)
+        return len(frame), timings
+    return run
+
+
+def _overview_target(pool):
+    def run():
+        timings = {}
+        query, params = build_page_query(SORT_COLUMNS[0], False, {}, PAGE_SIZES[0], None)
+        page, next_key = split_page(fetch_frame(pool, query, params, timings=timings), SORT_COLUMNS[0], PAGE_SIZES[0])
+        return len(page), timings
+    return run
+
+
+def _aggregates_target(pool):
+    def run():
+        timings = {}
+        frame = fetch_frame(pool, DASHBOARD_AGGREGATE_QUERY, timings=timings)
+        started = time.perf_counter()
+        counts, totals = split_aggregates(frame)
+        timings["build"] += time.perf_counter() - started
+        return totals["total_stops"], timings
+    return run
+
+
+# Prediction path: build the lookup index from its grouped query, then answer a batch of form submissions
+def _prediction_targets(pool, samples=1000):
+    index = PredictorIndex()
+
+    def build():
+        started = time.perf_counter()
+        columns, rows = run_query(pool, PREDICTOR_INDEX_QUERY)
+        fetched = time.perf_counter()
+        index.load(columns, rows)
+        return len(rows), {"execute": fetched - started, "build": time.perf_counter() - fetched}
+
+    def predict():
+        rng = np.random.default_rng(DEFAULT_SEED)
+        inputs = list(zip(
+            rng.choice(GENDERS[0], samples), rng.integers(16, 90, samples).astype(float), rng.random(samples) < 0.1,
+            rng.choice(DURATIONS, samples), rng.random(samples) < 0.05,
+        ))
+        started = time.perf_counter()
+        for values in inputs:
+            index.predict(*[value.item() if hasattr(value, "item") else value for value in values])
+        return len(inputs), {"build": time.perf_counter() - started}
+
+    return [("prediction", "Predictor index build", build), ("prediction", f"Predict x{samples}", predict)]
+
+
+def targets(pool):
+    found = [("overview", "Overview page", _overview_target(pool)), ("charts", "Chart aggregates", _aggregates_target(pool))]
+    found += [("query_map", title, _fetch_target(pool, query)) for title, query in query_map.items()]
+    return found + _prediction_targets(pool)
+
+
+def _time(run, repeat, warmup):
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows, timings = run()
+        samples.append((time.perf_counter() - started, rows, timings))
+    seconds = [sample[0] for sample in samples]
+    median = sorted(samples, key=lambda sample: sample[0])[len(samples) // 2]
+    return {
+        "rows": median[1],
+        "seconds": {
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "mean": statistics.fmean(seconds),
+            "max": max(seconds),
+        },
+        "phases": {phase: value for phase, value in median[2].items() if phase not in ("rows", "bytes")},
+        "bytes": median[2].get("bytes"),
+    }
+
+
+def _git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+        return revision, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+# Time every benchmark target and return a JSON-serialisable result document
+def run(database, repeat=DEFAULT_REPEAT, warmup=1, only=None, report=print):
+    pool = ConnectionPool(1, 2, **_bench_config(database))
+    try:
+        server_version = run_query(pool, "SHOW server_version")[1][0][0]
+        table_rows = run_query(pool, 'SELECT COUNT(*) FROM "Policelog"')[1][0][0]
+        revision, dirty = _git_revision()
+        results = []
+        for group, name, target in targets(pool):
+            if only and not any(part.lower() in name.lower() for part in only):
+                continue
+            result = {"group": group, "name": name, **_time(target, repeat, warmup)}
+            results.append(result)
+            report(f"{result['seconds']['median'] * 1000:10.1f} ms  {group:<10} {name}")
+    finally:
+        pool.closeall()
+    return {
+        "meta": {
+            "commit": revision,
+            "dirty": dirty,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "dataset": loaded_dataset(database),
+            "table_rows": table_rows,
+            "repeat": repeat,
+            "warmup": warmup,
+            "postgres": server_version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+# Compare the median timings of two result files; returns the names that got slower by more than threshold
+def compare(baseline, current, threshold=0.10, report=print):
+    before = {(result["group"], result["name"]): result for result in baseline["results"]}
+    regressions = []
+    report(f"{'baseline ms':>12} {'current ms':>12} {'change':>8}  benchmark")
+    for result in current["results"]:
+        old = before.get((result["group"], result["name"]))
+        new_ms = result["seconds"]["median"] * 1000
+        if old is None:
+            report(f"{'-':>12} {new_ms:12.1f} {'new':>8}  {result['name']}")
+            continue
+        old_ms = old["seconds"]["median"] * 1000
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        flag = "  SLOWER" if change > threshold else ""
+        report(f"{old_ms:12.1f} {new_ms:12.1f} {change:+8.1%}  {result['name']}{flag}")
+        if change > threshold:
+            regressions.append(result["name"])
+    if baseline["meta"].get("dataset") != current["meta"].get("dataset"):
+        report(f"warning: datasets differ ({baseline['meta'].get('dataset')} vs {current['meta'].get('dataset')})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard queries on seeded synthetic traffic stops")
+    parser.add_argument("--database", default=BENCH_DATABASE, help=f"benchmark database (default: {BENCH_DATABASE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = commands.add_parser("load", help='generate rows and load them into "Policelog"')
+    load_parser.add_argument("--rows", type=parse_rows, default=SIZES["100k"], help="row count, e.g. 100k, 1m, 10m or a number")
+    load_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    load_parser.add_argument("--migrated", action="store_true", help="apply schema.py migrations (typed columns, indexes)")
+
+    run_parser = commands.add_parser("run", help="time every benchmark target and write JSON results")
+    run_parser.add_argument("--rows", type=parse_rows, help="(re)load this many rows first unless that dataset is already loaded")
+    run_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run_parser.add_argument("--migrated", action="store_true", help="load with the migrated schema (see load)")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per target")
+    run_parser.add_argument("--warmup", type=int, default=1, help="untimed runs per target")
+    run_parser.add_argument("--only", nargs="*", help="only targets whose name contains one of these")
+    run_parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+
+    args = parser.parse_args()
+    if args.command == "load":
+        load(args.database, args.rows, args.seed, args.migrated)
+    elif args.command == "run":
+        log = lambda line: print(line, file=sys.stderr)
+        if args.rows is not None and loaded_dataset(args.database) != _dataset_tag(args.rows, args.seed, args.migrated):
+            load(args.database, args.rows, args.seed, args.migrated, report=log)
+        results = run(args.database, args.repeat, args.warmup, args.only, report=log)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.baseline) as baseline, open(args.current) as current:
+            regressions = compare(json.load(baseline), json.load(current), args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Cache limits: entries expire after RESULT_TTL seconds and the least recently used ones are evicted first
+RESULT_TTL = 300.0
+MAX_ENTRIES = 128
+MAX_BYTES = 256 * 1024 * 1024
+
+# Data-version stamp for "Policelog": a single-row counter bumped by a statement-level trigger on every
+# insert/update/delete/truncate, so cached results from before a change can never be served after it.
+VERSION_SETUP_SQL = """
+CREATE TABLE IF NOT EXISTS policelog_version (
+    id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version bigint NOT NULL DEFAULT 0,
+    changed_at timestamptz NOT NULL DEFAULT now()
+);
+INSERT INTO policelog_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION policelog_bump_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE policelog_version SET version = version + 1, changed_at = now();
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER policelog_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "Policelog"
+    FOR EACH STATEMENT EXECUTE FUNCTION policelog_bump_version();
+"""
+
+DATA_VERSION_QUERY = "SELECT version FROM policelog_version;"
+
+
+def install_version_tracking(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(VERSION_SETUP_SQL)
+
+
+# String literals and quoted identifiers, whose whitespace is part of the query
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+# Same query text regardless of line breaks, indentation and trailing semicolons; whitespace inside quotes is kept
+def normalize_query(query):
+    parts = _QUOTED.split(query)
+    parts[::2] = [re.sub(r"\s+", " ", part) for part in parts[::2]]    # the text between the quoted parts
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _frame_size(result):
+    try:
+        return int(result.memory_usage(deep=True).sum())
+    except AttributeError:
+        return 0
+
+
+# Thread-safe TTL + LRU cache of query results, bounded by entry count and total size
+class ResultCache:
+    def __init__(self, ttl=RESULT_TTL, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()    # key -> (result, stored at, size in bytes)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(query, params=None, version=None):
+        return normalize_query(query), repr(params), version
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    # Drop every entry stamped with an older data version as soon as a newer one is seen. Versions only move
+    # forward, so a reader still seeing an older version does not flush the newer entries.
+    def _observe_version(self, version):
+        if version is None or (self._version is not None and version <= self._version):
+            return
+        if self._version is not None:
+            stale = [key for key in self._entries if key[2] != version]
+            for key in stale:
+                self._remove(key)
+            self._stats["invalidations"] += len(stale)
+        self._version = version
+
+    def get(self, key):
+        with self._lock:
+            self._observe_version(key[2])
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = _frame_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._observe_version(key[2])
+            if key[2] is not None and self._version is not None and key[2] < self._version:
+                return    # computed before the latest change; nobody will ask for it again
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, time.monotonic(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["data_version"] = self._version
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 2) if lookups else 0.0
+        return stats
@@ -0,0 +1,318 @@
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+
+# Connection details for the police post register database (overridable through environment variables)
+DB_CONFIG = {
+    "host": os.environ.get("POLICELOG_DB_HOST", "localhost"),
+    "user": os.environ.get("POLICELOG_DB_USER", "postgres"),
+    "password": os.environ.get("POLICELOG_DB_PASSWORD", "934446"),
+    "database": os.environ.get("POLICELOG_DB_NAME", "policepostregister"),
+    "port": int(os.environ.get("POLICELOG_DB_PORT", "5432")),
+}
+
+# Pool sizing, how long a caller waits for a free connection and how often idle connections are pinged
+POOL_MIN_CONN = int(os.environ.get("POLICELOG_POOL_MIN", "1"))
+POOL_MAX_CONN = int(os.environ.get("POLICELOG_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("POLICELOG_POOL_TIMEOUT", "10"))
+HEALTH_CHECK_INTERVAL = 30.0
+
+# Errors that mean the connection itself is gone and must be thrown away
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Bounded, thread-safe pool of autocommit connections shared by every rerun and session.
+# Idle connections are kept open (up to maxconn) so reruns reuse them instead of reconnecting.
+class ConnectionPool:
+    def __init__(self, minconn=POOL_MIN_CONN, maxconn=POOL_MAX_CONN, timeout=POOL_TIMEOUT, **config):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.config = {**DB_CONFIG, **config}
+        self._slots = threading.BoundedSemaphore(maxconn)    # callers block here when every connection is in use
+        self._lock = threading.Lock()
+        self._idle = []    # (connection, time it was returned) pairs, most recently used last
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "discarded": 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.config)
+        conn.autocommit = True    # for auto-comitting of values
+        self._count("connects")
+        return conn
+
+    # A connection is healthy if it is open and, when it has been idle for a while, answers a ping
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._count("discarded")
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            self._count("waits")
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            self._count("wait_seconds", time.monotonic() - started)
+            if not acquired:
+                self._count("timeouts")
+                raise PoolTimeout(f"No free database connection after {self.timeout}s (pool size {self.maxconn})")
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._connect()
+                elif self._healthy(*idle):
+                    conn = idle[0]
+                else:    # dropped by the server or network, throw it away and try the next one
+                    self._close(idle[0])
+                    self._count("reconnects")
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+        return conn
+
+    def putconn(self, conn, broken=False):
+        try:
+            if broken or conn.closed or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._count("in_use", -1)
+            self._slots.release()
+
+    # Borrow a connection for a with-block, dropping it from the pool if it broke while in use
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        stats["open"] = stats["idle"] + stats["in_use"]
+        stats["saturation"] = round(stats["in_use"] / self.maxconn, 2)
+        return stats
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+# Run a query on a pooled connection and return (columns, rows), retrying on a fresh connection if it had dropped
+def run_query(pool, query, params=None, retries=1):
+    for attempt in range(retries + 1):
+        with pool.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+                    columns = [desc[0] for desc in cursor.description]
+                    return columns, rows
+            except CONNECTION_ERRORS:
+                if not conn.closed or attempt == retries:    # a real query error, or still failing after a retry
+                    raise
+
+
+# Plain connection for command-line jobs (ingest, schema, rollups) that run outside the dashboard's pool
+def connect(autocommit=True, **config):
+    conn = psycopg2.connect(**{**DB_CONFIG, **config})
+    conn.autocommit = autocommit
+    return conn
+
+
+# Postgres type OIDs the typed fetch path maps to compact pandas dtypes
+BOOL_OID = 16
+INTEGER_OIDS = {20, 21, 23}
+TEXT_OIDS = {18, 19, 25, 1042, 1043}
+DATETIME_OIDS = {1082, 1114, 1184}
+
+# Text columns known to have few distinct values, and columns holding ages / birth years
+CATEGORY_COLUMNS = {
+    "country_name", "driver_gender", "driver_race", "violation_raw", "violation",
+    "search_type", "stop_outcome", "stop_duration", "age_group", "time_of_day",
+}
+AGE_COLUMNS = {"driver_age", "driver_age_raw"}
+
+# Other text columns become categorical when at most this share of their values is distinct
+CATEGORY_MAX_DISTINCT_RATIO = 0.1
+CATEGORY_MIN_ROWS = 1000
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:    # pyarrow is optional, pandas' own C parser is used without it
+    pa = None
+
+
+def _compact_flags(values):
+    missing = values.isna()
+    flags = values.astype(object).eq("t")
+    if not missing.any():
+        return flags.astype(bool)
+    return flags.astype("boolean").mask(missing)
+
+
+def _compact_integers(values, small):
+    if values.isna().all():
+        return values.astype("Int16" if small else "Int64")
+    integral = values.dropna()
+    if (integral != integral.round()).any():
+        return values.astype("float32") if small else values
+    return values.astype("Int16" if small else "Int64")
+
+
+# The typed fetch has COPY write NULL as NULL_MARKER, so an empty string stays an empty string and text such as
+# "NA" or "null" is left alone. COPY quotes a value that equals the marker, which pyarrow keeps apart; pandas
+# does not look at quotes, so without pyarrow a text value of exactly \N also reads as missing.
+NULL_MARKER = r"\N"
+
+
+def _read_with_arrow(buffer, types, categories):
+    text = [name for name, oid in types.items() if oid in TEXT_OIDS or oid == BOOL_OID]
+    options = pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in text},
+        null_values=[NULL_MARKER], strings_can_be_null=True, quoted_strings_can_be_null=False,
+    )
+    table = pa_csv.read_csv(buffer, convert_options=options)
+    for name in categories:
+        table = table.set_column(table.column_names.index(name), name, table.column(name).dictionary_encode())
+    return table.to_pandas()
+
+
+def _read_with_pandas(buffer, types, categories):
+    dtype = {name: "category" if name in categories else str for name, oid in types.items() if oid in TEXT_OIDS or oid == BOOL_OID}
+    dates = [name for name, oid in types.items() if oid in DATETIME_OIDS]
+    return pd.read_csv(buffer, dtype=dtype, parse_dates=dates, keep_default_na=False, na_values=[NULL_MARKER])
+
+
+# Build a DataFrame column by column from a CSV COPY stream, using the result's column types
+def build_frame(buffer, description):
+    types = {desc.name: desc.type_code for desc in description}
+    categories = [name for name, oid in types.items() if oid == BOOL_OID or (oid in TEXT_OIDS and name in CATEGORY_COLUMNS)]
+    frame = (_read_with_arrow if pa is not None else _read_with_pandas)(buffer, types, categories)
+
+    for name, oid in types.items():
+        values = frame[name]
+        if oid == BOOL_OID:
+            frame[name] = _compact_flags(values)
+        elif oid in DATETIME_OIDS and not pd.api.types.is_datetime64_any_dtype(values):
+            frame[name] = pd.to_datetime(values)
+        elif name in AGE_COLUMNS and pd.api.types.is_numeric_dtype(values):
+            frame[name] = _compact_integers(values, small=True)
+        elif oid in INTEGER_OIDS and values.dtype.kind == "f":    # NULLs made the integers fall back to float
+            frame[name] = _compact_integers(values, small=False)
+        elif oid in TEXT_OIDS and name not in categories and len(values) >= CATEGORY_MIN_ROWS:
+            if values.nunique() <= len(values) * CATEGORY_MAX_DISTINCT_RATIO:
+                frame[name] = values.astype("category")
+    return frame
+
+
+# Typed fetch: run the query through COPY ... TO STDOUT and build the DataFrame column-wise, instead of
+# materialising one Python tuple per row. A LIMIT 0 probe supplies the column types.
+# When a timings dict is passed it is filled with the phase split (see fetch_frame_on) plus "connect".
+def fetch_frame(pool, query, params=None, retries=1, timings=None):
+    for attempt in range(retries + 1):
+        started = time.perf_counter()
+        with pool.connection() as conn:
+            if timings is not None:
+                timings["connect"] = timings.get("connect", 0.0) + time.perf_counter() - started
+            try:
+                return fetch_frame_on(conn, query, params, timings)
+            except CONNECTION_ERRORS:
+                if not conn.closed or attempt == retries:
+                    raise
+
+
+# COPY target that notes when the first bytes arrive, which splits server execution from the transfer
+class _TimedBuffer(io.BytesIO):
+    first_write = None
+
+    def write(self, data):
+        if self.first_write is None:
+            self.first_write = time.perf_counter()
+        return super().write(data)
+
+
+# Typed fetch on a connection the caller already holds. timings, if given, receives the seconds spent in
+# "execute" (type probe + server time to the first row), "fetch" (rest of the COPY stream) and "build"
+# (DataFrame construction), the "rows" and "bytes" of the result, and the "statement" as sent, with its
+# parameters bound, so the profiler never renders the query again.
+def fetch_frame_on(conn, query, params=None, timings=None):
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        statement = cursor.mogrify(query, params).decode().strip().rstrip(";")
+        if timings is not None:
+            timings["statement"] = statement
+        cursor.execute(f"SELECT * FROM ({statement}) AS typed_fetch LIMIT 0")
+        description = cursor.description
+        buffer = _TimedBuffer()
+        cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '{NULL_MARKER}')", buffer)
+    fetched = time.perf_counter()
+    size = buffer.tell()
+    buffer.seek(0)
+    frame = build_frame(buffer, description)
+    if timings is not None:
+        first_write = buffer.first_write or fetched
+        timings["execute"] = first_write - started
+        timings["fetch"] = fetched - first_write
+        timings["build"] = time.perf_counter() - fetched
+        timings["rows"] = len(frame)
+        timings["bytes"] = size
+    return frame
@@ -0,0 +1,324 @@
+import argparse
+
+import pandas as pd
+
+from db import connect
+from queries import query_map
+
+# Space-Saving summaries of vehicle_number kept by statement-level triggers on "Policelog": the CAPACITY most
+# frequent vehicles of all time per scope, and BUCKET_CAPACITY per hour and per day of stop timestamp for the
+# time windows. A tracked vehicle's count never undercounts and overcounts by at most its error, and every vehicle
+# seen more than (stops in scope) / capacity times is tracked.
+CAPACITY = 1000
+BUCKET_CAPACITY = 100
+
+# Stops counted in each scope
+SCOPES = {
+    "all": "TRUE",
+    "searched": "search_conducted",
+    "drugs": "drugs_related_stop",
+}
+
+# Windows ending at the newest stop seen that is not in the future, as (bucket grain, number of buckets); buckets
+# older than the longest window of their grain are dropped
+WINDOWS = {
+    "24h": ("hour", 24),
+    "7d": ("day", 7),
+    "30d": ("day", 30),
+}
+RETENTION = {"hour": 48, "day": 31}
+
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS policelog_hitters (
+    scope text NOT NULL,
+    grain text NOT NULL,
+    bucket timestamp NOT NULL,
+    vehicle_number text NOT NULL,
+    count bigint NOT NULL,
+    error bigint NOT NULL,
+    PRIMARY KEY (scope, grain, bucket, vehicle_number)
+);
+CREATE INDEX IF NOT EXISTS policelog_hitters_bucket ON policelog_hitters (grain, bucket);
+CREATE INDEX IF NOT EXISTS policelog_hitters_lowest ON policelog_hitters (scope, grain, bucket, count);
+CREATE TABLE IF NOT EXISTS policelog_hitters_state (
+    id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+    newest timestamp
+);
+INSERT INTO policelog_hitters_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+"""
+
+
+# Exact per-vehicle counts of `source` for every scope and bucket; with newest, only the buckets still kept
+def _keyed_sql(source, newest=None):
+    scopes = ", ".join(f"('{scope}', {predicate})" for scope, predicate in SCOPES.items())
+    recent = ""
+    if newest is not None:
+        recent = " AND (g.grain = 'all' OR " + " OR ".join(
+            f"g.grain = '{grain}' AND g.bucket > date_trunc('{grain}', {newest}) - interval '{count} {grain}s' "
+            f"AND g.bucket <= {newest}"
+            for grain, count in RETENTION.items()
+        ) + ")"
+    return f"""SELECT s.scope, g.grain, g.bucket, r.vehicle_number, COUNT(*) AS amount
+        FROM {source} r
+        CROSS JOIN LATERAL (VALUES {scopes}) AS s(scope, included)
+        CROSS JOIN LATERAL (VALUES ('all', '-infinity'::timestamp), ('hour', date_trunc('hour', r.timestamp)),
+            ('day', date_trunc('day', r.timestamp))) AS g(grain, bucket)
+        WHERE s.included AND r.vehicle_number IS NOT NULL AND g.bucket IS NOT NULL{recent}
+        GROUP BY 1, 2, 3, 4"""
+
+
+# Take the rows of `source` out of the tracked counts. Space-Saving cannot forget exactly, so tracked vehicles
+# are decremented and untracked ones are left alone.
+def _subtract_sql(source):
+    return f"""UPDATE policelog_hitters h SET count = h.count - d.amount, error = LEAST(h.error, h.count - d.amount)
+        FROM ({_keyed_sql(source)}) AS d
+        WHERE h.scope = d.scope AND h.grain = d.grain AND h.bucket = d.bucket AND h.vehicle_number = d.vehicle_number;
+    DELETE FROM policelog_hitters WHERE count <= 0;"""
+
+
+def remove_rows_sql(source):
+    return _subtract_sql(source)
+
+
+# Weighted Space-Saving merge of one statement's exact counts into one summary: tracked vehicles add their
+# amount, new ones start from the summary's minimum when it is full (that minimum is their error), and only the
+# capacity largest are kept. A vehicle outside the n lowest entries can never be pushed out by n new ones, so
+# only those, found through policelog_hitters_lowest, are ranked against the new vehicles.
+FUNCTIONS_SQL = f"""
+CREATE OR REPLACE FUNCTION policelog_hitters_merge(target_scope text, target_grain text, target_bucket timestamp,
+    keys text[], amounts bigint[]) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    capacity integer := CASE WHEN target_grain = 'all' THEN {CAPACITY} ELSE {BUCKET_CAPACITY} END;
+    new_keys text[];
+    new_amounts bigint[];
+    tracked integer;
+    minimum bigint := 0;
+BEGIN
+    WITH batch AS (SELECT * FROM unnest(keys, amounts) AS b(vehicle_number, amount)),
+    updated AS (
+        UPDATE policelog_hitters h SET count = h.count + b.amount FROM batch b
+        WHERE h.scope = target_scope AND h.grain = target_grain AND h.bucket = target_bucket
+        AND h.vehicle_number = b.vehicle_number
+        RETURNING h.vehicle_number)
+    SELECT array_agg(vehicle_number), array_agg(amount) INTO new_keys, new_amounts
+    FROM batch WHERE vehicle_number NOT IN (SELECT vehicle_number FROM updated);
+    IF new_keys IS NULL THEN
+        RETURN;
+    END IF;
+
+    SELECT COUNT(*) INTO tracked FROM policelog_hitters
+    WHERE scope = target_scope AND grain = target_grain AND bucket = target_bucket;
+    IF tracked + cardinality(new_keys) <= capacity THEN
+        INSERT INTO policelog_hitters (scope, grain, bucket, vehicle_number, count, error)
+            SELECT target_scope, target_grain, target_bucket, vehicle_number, amount, 0
+            FROM unnest(new_keys, new_amounts) AS b(vehicle_number, amount);
+        RETURN;
+    END IF;
+    IF tracked >= capacity THEN
+        SELECT h.count INTO minimum FROM policelog_hitters h
+        WHERE scope = target_scope AND grain = target_grain AND bucket = target_bucket ORDER BY h.count LIMIT 1;
+    END IF;
+
+    WITH lowest AS (
+        SELECT vehicle_number, count, error FROM policelog_hitters
+        WHERE scope = target_scope AND grain = target_grain AND bucket = target_bucket
+        ORDER BY count LIMIT cardinality(new_keys)),
+    candidates AS (
+        SELECT vehicle_number, count, error, TRUE AS stored FROM lowest
+        UNION ALL
+        SELECT vehicle_number, minimum + amount, minimum, FALSE FROM unnest(new_keys, new_amounts) AS b(vehicle_number, amount)),
+    ranked AS (
+        SELECT *, row_number() OVER (ORDER BY count DESC, stored DESC, vehicle_number)
+            <= capacity - tracked + (SELECT COUNT(*) FROM lowest) AS kept
+        FROM candidates),
+    evicted AS (
+        DELETE FROM policelog_hitters h USING ranked r
+        WHERE h.scope = target_scope AND h.grain = target_grain AND h.bucket = target_bucket
+        AND h.vehicle_number = r.vehicle_number AND r.stored AND NOT r.kept)
+    INSERT INTO policelog_hitters (scope, grain, bucket, vehicle_number, count, error)
+        SELECT target_scope, target_grain, target_bucket, vehicle_number, count, error FROM ranked WHERE kept AND NOT stored;
+END $$;
+"""
+
+_EXPIRE_SQL = " OR ".join(
+    f"grain = '{grain}' AND bucket <= date_trunc('{grain}', latest) - interval '{count} {grain}s'"
+    for grain, count in RETENTION.items()
+)
+
+TRIGGERS_SQL = f"""
+{FUNCTIONS_SQL}
+CREATE OR REPLACE FUNCTION policelog_hitters_add() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    latest timestamp;
+    target record;
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        {_subtract_sql("old_rows")}
+    END IF;
+    SELECT newest INTO latest FROM policelog_hitters_state FOR UPDATE;    -- one statement merges at a time
+    SELECT GREATEST(latest, MAX(timestamp) FILTER (WHERE timestamp <= now())) INTO latest FROM new_rows;
+    UPDATE policelog_hitters_state SET newest = latest;
+    FOR target IN
+        SELECT scope, grain, bucket, array_agg(vehicle_number) AS keys, array_agg(amount) AS amounts
+        FROM ({_keyed_sql("new_rows", "latest")}) AS keyed
+        GROUP BY 1, 2, 3
+    LOOP
+        PERFORM policelog_hitters_merge(target.scope, target.grain, target.bucket, target.keys, target.amounts);
+    END LOOP;
+    DELETE FROM policelog_hitters WHERE {_EXPIRE_SQL};
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_hitters_remove() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    {_subtract_sql("old_rows")}
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_hitters_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE policelog_hitters;
+    UPDATE policelog_hitters_state SET newest = NULL;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER policelog_hitters_insert AFTER INSERT ON "Policelog"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_hitters_add();
+CREATE OR REPLACE TRIGGER policelog_hitters_update AFTER UPDATE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_hitters_add();
+CREATE OR REPLACE TRIGGER policelog_hitters_delete AFTER DELETE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_hitters_remove();
+CREATE OR REPLACE TRIGGER policelog_hitters_truncate AFTER TRUNCATE ON "Policelog"
+    FOR EACH STATEMENT EXECUTE FUNCTION policelog_hitters_truncate();
+"""
+
+# A rebuild sees every stop at once, so each summary is simply the exact top of its bucket (no error)
+REBUILD_SQL = f"""
+LOCK TABLE "Policelog" IN SHARE MODE;
+TRUNCATE policelog_hitters;
+UPDATE policelog_hitters_state SET newest = (SELECT MAX(timestamp) FROM "Policelog" WHERE timestamp <= now());
+INSERT INTO policelog_hitters (scope, grain, bucket, vehicle_number, count, error)
+    SELECT scope, grain, bucket, vehicle_number, amount, 0 FROM (
+        SELECT keyed.*, row_number() OVER (PARTITION BY scope, grain, bucket ORDER BY amount DESC, vehicle_number) AS position
+        FROM ({_keyed_sql('"Policelog"', "(SELECT newest FROM policelog_hitters_state)")}) AS keyed) AS ranked
+    WHERE position <= CASE WHEN grain = 'all' THEN {CAPACITY} ELSE {BUCKET_CAPACITY} END;
+"""
+
+READY_QUERY = """SELECT COUNT(*) = 4 FROM pg_trigger
+    WHERE tgrelid = to_regclass('"Policelog"') AND tgname LIKE 'policelog_hitters_%';"""
+
+
+# Top vehicles of a scope, over all time or a window, with count (an upper bound) and max_overcount.
+# A window adds up its buckets; a vehicle missing from a full bucket may have had up to that bucket's minimum
+# there, which is added to both its count and its max_overcount, so count - max_overcount stays a lower bound.
+def top_vehicles_query(scope, window=None, limit=10, count_column="count"):
+    if window is None:
+        return f"""SELECT vehicle_number, count AS {count_column}, error AS max_overcount FROM policelog_hitters
+    WHERE scope = '{scope}' AND grain = 'all'
+    ORDER BY count DESC, vehicle_number LIMIT {int(limit)};"""
+    grain, buckets = WINDOWS[window]
+    return f"""WITH summaries AS (
+        SELECT * FROM policelog_hitters WHERE scope = '{scope}' AND grain = '{grain}'
+        AND bucket > date_trunc('{grain}', (SELECT newest FROM policelog_hitters_state)) - interval '{buckets} {grain}s'
+        AND bucket <= (SELECT newest FROM policelog_hitters_state)),
+    floors AS (
+        SELECT bucket, CASE WHEN COUNT(*) >= {BUCKET_CAPACITY} THEN MIN(count) ELSE 0 END AS m FROM summaries GROUP BY bucket)
+    SELECT s.vehicle_number, SUM(s.count) + (SELECT COALESCE(SUM(m), 0) FROM floors) - SUM(f.m) AS {count_column},
+        SUM(s.error) + (SELECT COALESCE(SUM(m), 0) FROM floors) - SUM(f.m) AS max_overcount
+    FROM summaries s JOIN floors f USING (bucket)
+    GROUP BY s.vehicle_number
+    ORDER BY {count_column} DESC, s.vehicle_number LIMIT {int(limit)};"""
+
+
+# Canned vehicle queries answered from the summaries, with the same columns plus max_overcount
+HITTER_QUERIES = {
+    "Top 10 vehicle_Number involved in drug-related stops": top_vehicles_query("drugs", count_column="drug_stop_count"),
+    "Most frequently searched vehicles": top_vehicles_query("searched", count_column="search_count"),
+}
+
+# A vehicle's stop history for the checkpoint lookup, newest first (uses the vehicle_number index)
+VEHICLE_HISTORY_QUERY = """SELECT timestamp, country_name, violation, stop_outcome, search_conducted, search_type,
+    drugs_related_stop, is_arrested, stop_duration
+    FROM "Policelog" WHERE vehicle_number = %s
+    ORDER BY timestamp DESC NULLS LAST LIMIT %s;"""
+
+VEHICLE_SUMMARY_QUERY = """SELECT COUNT(*) AS stops, COUNT(*) FILTER (WHERE search_conducted) AS searched,
+    COUNT(*) FILTER (WHERE drugs_related_stop) AS drug_related, COUNT(*) FILTER (WHERE is_arrested) AS arrests,
+    MIN(timestamp) AS first_stop, MAX(timestamp) AS last_stop
+    FROM "Policelog" WHERE vehicle_number = %s;"""
+
+
+# Create the summary tables and triggers and fill them from the current table in one transaction
+def install(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(TABLES_SQL)
+            cursor.execute(TRIGGERS_SQL)
+            cursor.execute(REBUILD_SQL)
+
+
+# Recompute the summaries exactly (e.g. after many deletes, which Space-Saving only approximates)
+def rebuild(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+
+
+def uninstall(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            for trigger in ["insert", "update", "delete", "truncate"]:
+                cursor.execute(f'DROP TRIGGER IF EXISTS policelog_hitters_{trigger} ON "Policelog";')
+            cursor.execute("DROP TABLE IF EXISTS policelog_hitters, policelog_hitters_state;")
+
+
+def _fetch(conn, query):
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        return pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+
+
+# Check the summaries against the exact GROUP BY: every true top vehicle must be listed, with its exact count
+# between count - max_overcount and count
+def verify(conn):
+    mismatches = []
+    for title, query in HITTER_QUERIES.items():
+        exact = _fetch(conn, query_map[title])
+        approximate = _fetch(conn, query).set_index("vehicle_number")
+        count_column = exact.columns[1]
+        ok = True
+        for vehicle, count in zip(exact["vehicle_number"], exact[count_column]):
+            tracked = approximate[count_column].get(vehicle)
+            overcount = approximate["max_overcount"].get(vehicle, 0)
+            if tracked is None:
+                ok = ok and count <= exact[count_column].min()    # a tie with the last listed vehicle
+            else:
+                ok = ok and tracked - overcount <= count <= tracked
+        if not ok:
+            mismatches.append(title)
+        print(f"{'ok      ' if ok else 'MISMATCH'}  {title}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the heavy-hitter summaries of vehicle_number in "Policelog"')
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ["install", "rebuild", "verify", "uninstall"]:
+        commands.add_parser(command)
+    top_parser = commands.add_parser("top", help="print the most frequent vehicles of a scope")
+    top_parser.add_argument("scope", choices=list(SCOPES))
+    top_parser.add_argument("--window", choices=list(WINDOWS), help="only stops in this window before the newest")
+    top_parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        if args.command == "top":
+            print(_fetch(connection, top_vehicles_query(args.scope, args.window, args.limit)).to_string(index=False))
+        elif args.command == "verify":
+            raise SystemExit(1 if verify(connection) else 0)
+        else:
+            {"install": install, "rebuild": rebuild, "uninstall": uninstall}[args.command](connection)
+            print(f"Heavy hitters {args.command} done")
+    finally:
+        connection.close()
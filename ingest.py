@@ -0,0 +1,252 @@
+import argparse
+import io
+import sys
+import time
+import warnings
+
+import pandas as pd
+from psycopg2 import sql
+
+from db import connect
+from partitions import ensure_partitions
+
+# Columns of the cleaned "Policelog" table, in the order the notebook's to_sql() created them
+COLUMNS = [
+    "stop_date", "stop_time", "country_name", "driver_gender", "driver_age_raw", "driver_age", "driver_race",
+    "violation_raw", "violation", "search_conducted", "search_type", "stop_outcome", "is_arrested",
+    "stop_duration", "drugs_related_stop", "vehicle_number", "timestamp",
+]
+
+# Table created when it does not exist yet: dates and times as text like the notebook's to_sql() leaves them,
+# ages as double precision so a median fill such as 37.5 and missing raw ages load as they are (schema.py's
+# typed_columns migration turns them into smallint)
+CREATE_TABLE_SQL = """CREATE TABLE IF NOT EXISTS "Policelog" (
+    stop_date text,
+    stop_time text,
+    country_name text,
+    driver_gender text,
+    driver_age_raw double precision,
+    driver_age double precision,
+    driver_race text,
+    violation_raw text,
+    violation text,
+    search_conducted boolean,
+    search_type text,
+    stop_outcome text,
+    is_arrested boolean,
+    stop_duration text,
+    drugs_related_stop boolean,
+    vehicle_number text,
+    timestamp timestamp
+);"""
+
+# Fill values used by the notebook for missing text fields
+FILL_VALUES = {
+    "country_name": "unknown",
+    "violation": "unknown",
+    "search_type": "none",
+    "stop_outcome": "unknown",
+    "stop_duration": "unknown",
+    "vehicle_number": "unknown",
+}
+
+MODES = ["append", "upsert", "replace"]
+INTEGER_TYPES = {"smallint", "integer", "bigint"}
+DEFAULT_CHUNKSIZE = 50000
+DEFAULT_KEY = ["vehicle_number", "timestamp"]
+
+
+# Exact median of driver_age over the whole file, streamed as a histogram so the file is never held in memory
+def age_median(path, chunksize=DEFAULT_CHUNKSIZE):
+    histogram = pd.Series(dtype="int64")
+    for chunk in pd.read_csv(path, usecols=["driver_age"], chunksize=chunksize):
+        histogram = histogram.add(chunk["driver_age"].value_counts(), fill_value=0)
+    if histogram.empty:
+        return None
+    histogram = histogram.sort_index().cumsum()
+    total = histogram.iloc[-1]
+    lower = histogram.index[histogram.searchsorted((total + 1) // 2)]
+    upper = histogram.index[histogram.searchsorted(total // 2 + 1)]
+    return (lower + upper) / 2
+
+
+# Parse stop times with the common fixed formats first; only the leftovers go through slow per-value parsing
+def _parse_times(values):
+    parsed = pd.to_datetime(values, format="%H:%M:%S", errors="coerce")
+    for time_format in ["%H:%M", None]:
+        leftover = parsed.isna() & values.notna()
+        if not leftover.any():
+            break
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            parsed[leftover] = pd.to_datetime(values[leftover], format=time_format, errors="coerce")
+    return parsed
+
+
+# The notebook's cleaning rules, applied to one chunk
+def clean_chunk(chunk, age_fill=None):
+    chunk = chunk.copy()
+    fill = dict(FILL_VALUES)
+    if age_fill is not None:
+        fill["driver_age"] = age_fill
+    chunk.fillna({column: value for column, value in fill.items() if column in chunk.columns}, inplace=True)
+
+    # converting the rows into corrected date and time formats and combining them to a timestamp
+    chunk["stop_date"] = pd.to_datetime(chunk["stop_date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    chunk["stop_time"] = _parse_times(chunk["stop_time"]).dt.strftime("%H:%M:%S")
+    chunk["timestamp"] = pd.to_datetime(chunk["stop_date"] + " " + chunk["stop_time"], errors="coerce")
+    return chunk
+
+
+def table_columns(cursor, table="Policelog"):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s AND is_generated = 'NEVER' "
+        "AND identity_generation IS NULL ORDER BY ordinal_position;",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Columns with an integer type (ages once the table has been migrated by schema.py)
+def integer_columns(cursor, table="Policelog"):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s AND data_type = ANY(%s);",
+        (table, list(INTEGER_TYPES)),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+# COPY rejects "37.0" or a median of 37.5 for an integer column, so round those columns first
+def coerce_integers(chunk, columns):
+    for column in columns:
+        if column in chunk.columns:
+            chunk[column] = pd.to_numeric(chunk[column], errors="coerce").round().astype("Int64")
+    return chunk
+
+
+# Bulk-load a cleaned chunk with COPY FROM STDIN (CSV, empty unquoted fields are NULL)
+def copy_chunk(cursor, table, chunk, columns):
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, columns=columns, header=False, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    buffer.seek(0)
+    statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    cursor.copy_expert(statement.as_string(cursor), buffer)
+
+
+# Rows of a chunk that can be upserted on key: a row with a missing key part can never match an existing row, so
+# re-ingesting it would duplicate it, and rows repeating a key are collapsed to the last one in the file.
+# missing marks the rows whose key was missing in the file before clean_chunk() filled it; otherwise every stop
+# without a vehicle number in the same minute would share the key ("unknown", timestamp) and collapse into one.
+# Returns the rows to upsert, the number of collapsed rows and the number of rejected missing-key rows.
+def deduplicate(chunk, key, missing=None):
+    rejected = chunk[key].isna().any(axis=1)
+    if missing is not None:
+        rejected |= missing.reindex(chunk.index, fill_value=False)
+    keyed = chunk[~rejected]
+    collapsed = keyed.duplicated(subset=key, keep="last")
+    return keyed[~collapsed], int(collapsed.sum()), int(rejected.sum())
+
+
+# Upsert a chunk, already deduplicated on key, through a staging table: update rows whose key already exists,
+# insert the rest. Both look rows up by key, so the key needs an index (schema.py's policelog_vehicle_timestamp
+# covers the default key); without one every chunk joins the whole table.
+def upsert_chunk(cursor, chunk, columns, key):
+    column_ids = sql.SQL(", ").join(map(sql.Identifier, columns))
+    cursor.execute(sql.SQL(
+        'CREATE TEMP TABLE IF NOT EXISTS policelog_staging ON COMMIT DROP AS SELECT {} FROM "Policelog" WITH NO DATA;'
+    ).format(column_ids))
+    cursor.execute("TRUNCATE policelog_staging;")
+    copy_chunk(cursor, "policelog_staging", chunk, columns)
+
+    matches = sql.SQL(" AND ").join(sql.SQL("p.{0} = s.{0}").format(sql.Identifier(column)) for column in key)
+    updates = sql.SQL(", ").join(
+        sql.SQL("{0} = s.{0}").format(sql.Identifier(column)) for column in columns if column not in key
+    )
+    cursor.execute(sql.SQL('UPDATE "Policelog" AS p SET {updates} FROM policelog_staging AS s WHERE {matches};').format(
+        updates=updates, matches=matches
+    ))
+    updated = cursor.rowcount
+    cursor.execute(sql.SQL(
+        'INSERT INTO "Policelog" ({columns}) SELECT {columns} FROM policelog_staging AS s '
+        'WHERE NOT EXISTS (SELECT 1 FROM "Policelog" AS p WHERE {matches});'
+    ).format(columns=column_ids, matches=matches))
+    return updated, cursor.rowcount
+
+
+# Stream a traffic-stops CSV into "Policelog" chunk by chunk in one transaction, reporting throughput as it goes
+def ingest(conn, path, mode="append", chunksize=DEFAULT_CHUNKSIZE, key=DEFAULT_KEY, age_fill=None, report=print):
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+    if age_fill is None and path != "-":
+        age_fill = age_median(path, chunksize)
+    source = sys.stdin if path == "-" else path
+
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "collapsed": 0, "rejected": 0, "chunks": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_TABLE_SQL)
+            if mode == "replace":
+                cursor.execute('TRUNCATE "Policelog";')
+            columns = [column for column in table_columns(cursor) if column in COLUMNS]
+            integers = integer_columns(cursor)
+            missing = [column for column in key if column not in columns]
+            if mode == "upsert" and missing:
+                raise ValueError(f"Upsert key columns not in table: {missing}")
+
+            for chunk in pd.read_csv(source, chunksize=chunksize):
+                chunk_started = time.perf_counter()
+                missing_key = chunk.reindex(columns=[column for column in key if column in chunk.columns]).isna().any(axis=1)
+                chunk = coerce_integers(clean_chunk(chunk, age_fill).reindex(columns=columns), integers)
+                # monthly partitions for the chunk's stops must exist before they are copied in
+                ensure_partitions(cursor, chunk["timestamp"].dropna().dt.to_period("M").unique().to_timestamp())
+                if mode == "upsert":
+                    upserted, collapsed, rejected = deduplicate(chunk, key, missing_key)
+                    updated, inserted = upsert_chunk(cursor, upserted, columns, key)
+                    stats["collapsed"] += collapsed
+                    stats["rejected"] += rejected
+                else:
+                    copy_chunk(cursor, "Policelog", chunk, columns)
+                    updated, inserted = 0, len(chunk)
+
+                elapsed = time.perf_counter() - chunk_started
+                stats["chunks"] += 1
+                stats["rows"] += len(chunk)
+                stats["inserted"] += inserted
+                stats["updated"] += updated
+                report(
+                    f"chunk {stats['chunks']}: {len(chunk)} rows in {elapsed:.2f}s "
+                    f"({len(chunk) / elapsed if elapsed else 0:,.0f} rows/sec), {stats['rows']} rows so far"
+                )
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    report(
+        f"{mode}: {stats['rows']} rows ({stats['inserted']} inserted, {stats['updated']} updated) "
+        f"in {stats['seconds']:.2f}s, {stats['rows_per_sec']:,.0f} rows/sec"
+    )
+    if stats["collapsed"] or stats["rejected"]:
+        report(
+            f"{stats['collapsed']} rows repeating a key were collapsed to the last one, "
+            f"{stats['rejected']} rows with a missing {'/'.join(key)} were rejected"
+        )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stream a traffic-stops CSV into "Policelog" with COPY')
+    parser.add_argument("csv", help='path of the traffic_stops CSV, or "-" for stdin')
+    parser.add_argument("--mode", choices=MODES, default="append",
+                        help="append new rows, upsert on --key, or replace the whole table (default: append)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="rows per chunk")
+    parser.add_argument("--key", default=",".join(DEFAULT_KEY),
+                        help="comma separated upsert key columns; index them, or every chunk scans the table")
+    parser.add_argument("--age-fill", type=float, help="value for missing driver_age (default: median of the file)")
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        ingest(connection, args.csv, args.mode, args.chunksize, args.key.split(","), args.age_fill)
+    finally:
+        connection.close()
@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from collections import deque
+
+from db import run_query
+
+# Phases every fetch is split into, upper bounds (ms) of the latency histogram buckets, and how many
+# recent timings per label are kept for percentiles
+PHASES = ["connect", "execute", "fetch", "build"]
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf")]
+RECENT_SAMPLES = 500
+
+# Queries slower than SLOW_QUERY_MS end up in the slow-query log, which keeps the latest SLOW_LOG_SIZE entries
+SLOW_QUERY_MS = 500.0
+SLOW_LOG_SIZE = 100
+
+# Only plain reads are re-run under EXPLAIN ANALYZE
+EXPLAINABLE = ("select", "with")
+
+
+def _bucket_label(bound):
+    return f"<= {bound:g} ms" if bound != float("inf") else f"> {HISTOGRAM_BUCKETS_MS[-2]:g} ms"
+
+
+def _percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+# Thread-safe per-label query statistics: phase timings, rows, payload bytes, latency histogram and a
+# slow-query log. With capture_plans on, slow queries are re-run under EXPLAIN (ANALYZE, BUFFERS) in a
+# background thread so the plan is attached to their log entry without delaying the page. pool is the
+# connection pool for those re-runs, or a function returning it, so creating the profiler does not connect.
+class QueryProfiler:
+    def __init__(self, pool=None, slow_ms=SLOW_QUERY_MS, capture_plans=False):
+        self.pool = pool
+        self.slow_ms = slow_ms
+        self.capture_plans = capture_plans
+        self._labels = {}
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def _stats(self, label):
+        if label not in self._labels:
+            self._labels[label] = {
+                "calls": 0,
+                "errors": 0,
+                "cache_hits": 0,
+                "rows": 0,
+                "bytes": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "phases_ms": {phase: 0.0 for phase in PHASES},
+                "histogram": [0] * len(HISTOGRAM_BUCKETS_MS),
+                "recent_ms": deque(maxlen=RECENT_SAMPLES),
+            }
+        return self._labels[label]
+
+    def _pool(self):
+        return self.pool() if callable(self.pool) else self.pool
+
+    # Record one fetch. timings is the dict filled by db.fetch_frame (seconds per phase, rows, bytes and the
+    # statement it sent). That statement, rendered with its parameters on the fetch's own connection, is what
+    # is matched, explained and stored; a query that failed before it was rendered is kept as given.
+    def record(self, label, query, timings, params=None, error=None):
+        if "statement" in timings:
+            query, params = timings["statement"], None
+        elif not isinstance(query, str):    # composed (psycopg2.sql), e.g. the overview page
+            query = str(query)
+        phases_ms = {phase: timings.get(phase, 0.0) * 1000 for phase in PHASES}
+        elapsed_ms = sum(phases_ms.values())
+        with self._lock:
+            stats = self._stats(label)
+            stats["calls"] += 1
+            stats["errors"] += error is not None
+            stats["rows"] += timings.get("rows", 0)
+            stats["bytes"] += timings.get("bytes", 0)
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            for phase, value in phases_ms.items():
+                stats["phases_ms"][phase] += value
+            stats["histogram"][next(i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if elapsed_ms <= bound)] += 1
+            stats["recent_ms"].append(elapsed_ms)
+
+            entry = None
+            if elapsed_ms >= self.slow_ms:
+                entry = {
+                    "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "label": label,
+                    "ms": round(elapsed_ms, 1),
+                    "phases_ms": {phase: round(value, 1) for phase, value in phases_ms.items()},
+                    "rows": timings.get("rows", 0),
+                    "bytes": timings.get("bytes", 0),
+                    "error": error,
+                    "query": query,
+                    "plan": None,
+                }
+                self._slow.append(entry)
+        if entry is not None and error is None and self.capture_plans and self.pool is not None:
+            if query.lstrip().lower().startswith(EXPLAINABLE):
+                threading.Thread(target=self._explain, args=(entry, query, params), daemon=True).start()
+
+    # Results served from the result cache never reach the database but are still worth counting
+    def record_cache_hit(self, label):
+        with self._lock:
+            self._stats(label)["cache_hits"] += 1
+
+    def _explain(self, entry, query, params):
+        try:
+            columns, rows = run_query(self._pool(), "EXPLAIN (ANALYZE, BUFFERS) " + query.strip().rstrip(";"), params)
+            plan = "\n".join(row[0] for row in rows)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        with self._lock:
+            entry["plan"] = plan
+
+    # One row per label, slowest on average first
+    def summary(self):
+        with self._lock:
+            labels = {label: (dict(stats), list(stats["recent_ms"])) for label, stats in self._labels.items()}
+        rows = []
+        for label, (stats, recent) in labels.items():
+            calls = stats["calls"]
+            row = {
+                "label": label,
+                "calls": calls,
+                "cache_hits": stats["cache_hits"],
+                "errors": stats["errors"],
+                "avg_ms": round(stats["total_ms"] / calls, 1) if calls else None,
+                "p50_ms": _percentile(recent, 0.5),
+                "p95_ms": _percentile(recent, 0.95),
+                "max_ms": round(stats["max_ms"], 1),
+                "rows": stats["rows"],
+                "bytes": stats["bytes"],
+            }
+            for phase, value in stats["phases_ms"].items():
+                row[f"{phase}_ms"] = round(value / calls, 1) if calls else None
+            for key in ["p50_ms", "p95_ms"]:
+                if row[key] is not None:
+                    row[key] = round(row[key], 1)
+            rows.append(row)
+        return sorted(rows, key=lambda row: -(row["avg_ms"] or 0))
+
+    def histograms(self):
+        with self._lock:
+            return {
+                label: dict(zip(map(_bucket_label, HISTOGRAM_BUCKETS_MS), stats["histogram"]))
+                for label, stats in self._labels.items()
+            }
+
+    def slow_queries(self):
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._slow)]
+
+    def reset(self):
+        with self._lock:
+            self._labels.clear()
+            self._slow.clear()
+
+    def to_json(self):
+        return json.dumps({
+            "generated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "slow_ms": self.slow_ms,
+            "summary": self.summary(),
+            "histograms": self.histograms(),
+            "slow_queries": self.slow_queries(),
+        }, indent=2, default=str)
@@ -0,0 +1,237 @@
+import argparse
+import json
+import select
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+
+from aggregations import ALL_ROLLED_UP, CHART_COLUMNS, DASHBOARD_AGGREGATE_QUERY, grouping_id_for, split_aggregates
+from cache import VERSION_SETUP_SQL
+from db import CONNECTION_ERRORS, connect
+
+CHANNEL = "policelog_changes"
+
+# NOTIFY payloads are limited to 8000 bytes; bigger deltas only ask listeners to reload
+MAX_PAYLOAD = 7900
+
+# How long the listener waits for notifications per poll, and before reconnecting after losing its connection
+POLL_SECONDS = 0.5
+RECONNECT_SECONDS = 2.0
+
+# Default refresh cadence of the live charts in the dashboard
+REFRESH_SECONDS = 1.0
+
+
+def _changes(sources):
+    selects = [f"SELECT {sign} AS sign, {', '.join(CHART_COLUMNS)} FROM {table}" for table, sign in sources]
+    return " UNION ALL ".join(selects)
+
+
+# JSON delta of one statement: net row count and net count change per charted value, stamped with the data
+# version the statement bumped policelog_version to (the version trigger fires first, alphabetically)
+def _delta_sql(sources):
+    counts = ", ".join(
+        f"""'{column}', (SELECT json_object_agg(value, n) FROM (SELECT {column}::text AS value, SUM(sign) AS n
+            FROM changes WHERE {column} IS NOT NULL GROUP BY 1 HAVING SUM(sign) <> 0) AS c)"""
+        for column in CHART_COLUMNS
+    )
+    return f"""WITH changes AS ({_changes(sources)})
+        SELECT json_build_object('version', (SELECT version FROM policelog_version), 'rows', COALESCE(SUM(sign), 0),
+            'counts', json_build_object({counts}))::text
+        FROM changes"""
+
+
+TRIGGERS_SQL = f"""
+CREATE OR REPLACE FUNCTION policelog_notify_delta() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_delta_sql([("new_rows", 1)])} INTO payload;
+    ELSIF TG_OP = 'DELETE' THEN
+        {_delta_sql([("old_rows", -1)])} INTO payload;
+    ELSE
+        {_delta_sql([("new_rows", 1), ("old_rows", -1)])} INTO payload;
+    END IF;
+    IF octet_length(payload) > {MAX_PAYLOAD} THEN
+        payload := json_build_object('version', (SELECT version FROM policelog_version), 'resync', true)::text;
+    END IF;
+    PERFORM pg_notify('{CHANNEL}', payload);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_notify_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', json_build_object('version', (SELECT version FROM policelog_version), 'resync', true)::text);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER policelog_notify_insert AFTER INSERT ON "Policelog"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_notify_delta();
+CREATE OR REPLACE TRIGGER policelog_notify_update AFTER UPDATE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_notify_delta();
+CREATE OR REPLACE TRIGGER policelog_notify_delete AFTER DELETE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_notify_delta();
+CREATE OR REPLACE TRIGGER policelog_notify_truncate AFTER TRUNCATE ON "Policelog"
+    FOR EACH STATEMENT EXECUTE FUNCTION policelog_notify_truncate();
+"""
+
+READY_QUERY = """SELECT COUNT(*) = 4 FROM pg_trigger
+    WHERE tgrelid = to_regclass('"Policelog"') AND tgname LIKE 'policelog_notify_%';"""
+
+
+# The notify triggers need the data version, so version tracking is installed with them
+def install(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(VERSION_SETUP_SQL)
+        cursor.execute(TRIGGERS_SQL)
+
+
+def uninstall(conn):
+    with conn.cursor() as cursor:
+        for trigger in ["insert", "update", "delete", "truncate"]:
+            cursor.execute(f'DROP TRIGGER IF EXISTS policelog_notify_{trigger} ON "Policelog";')
+
+
+# Chart and metric counters kept current by a background thread that LISTENs for the deltas. It starts from a
+# snapshot of DASHBOARD_AGGREGATE_QUERY read together with the data version, then applies every delta with the
+# next version. A missing version (a change that sent no delta, e.g. a migration) or an oversized delta makes
+# it reload the snapshot instead.
+class LiveCounters:
+    def __init__(self, pool, **config):
+        self.pool = pool
+        self.config = config
+        self.version = None
+        self.updated_at = None
+        self._counts = {column: Counter() for column in CHART_COLUMNS}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._stats = {"deltas": 0, "rows": 0, "resyncs": 0, "reconnects": 0, "last_error": None}
+        self._thread = threading.Thread(target=self._listen, name="policelog-live", daemon=True)
+        self._thread.start()
+
+    def _resync(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+                try:
+                    cursor.execute("SELECT version FROM policelog_version;")
+                    version = cursor.fetchone()[0]
+                    cursor.execute(DASHBOARD_AGGREGATE_QUERY)
+                    columns = [desc[0] for desc in cursor.description]
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.execute("COMMIT;")
+        counts = {column: Counter() for column in CHART_COLUMNS}
+        total = 0
+        position = {column: index for index, column in enumerate(columns)}
+        for row in rows:
+            grouping_id = row[position["grouping_id"]]
+            if grouping_id == ALL_ROLLED_UP:
+                total = row[position["total"]]
+                continue
+            for column in CHART_COLUMNS:
+                if grouping_id == grouping_id_for(column) and row[position[column]] is not None:
+                    counts[column][row[position[column]]] = row[position["total"]]
+        with self._lock:
+            self._counts, self._total, self.version = counts, total, version
+            self.updated_at = time.time()
+            self._stats["resyncs"] += 1
+        self._ready.set()
+
+    # Values arrive as text; flags come back as the booleans the snapshot query returns
+    @staticmethod
+    def _value(column, value):
+        if column in ("is_arrested", "drugs_related_stop"):
+            return value == "true"
+        return value
+
+    def _apply(self, payload):
+        delta = json.loads(payload)
+        with self._lock:
+            if self.version is not None and delta["version"] <= self.version:
+                return    # already part of the snapshot
+            in_order = self.version is not None and delta["version"] == self.version + 1
+            if in_order and not delta.get("resync"):
+                for column, changes in delta["counts"].items():
+                    for value, amount in (changes or {}).items():
+                        counter = self._counts[column]
+                        key = self._value(column, value)
+                        counter[key] += amount
+                        if counter[key] <= 0:
+                            del counter[key]
+                self._total += delta["rows"]
+                self.version = delta["version"]
+                self.updated_at = time.time()
+                self._stats["deltas"] += 1
+                self._stats["rows"] += delta["rows"]
+                return
+        self._resync()
+
+    def _listen(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = connect(**self.config)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL};")
+                self._resync()    # after LISTEN, so nothing committed in between is missed
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._apply(conn.notifies.pop(0).payload)
+            except CONNECTION_ERRORS as e:
+                self._stats["reconnects"] += 1
+                self._stats["last_error"] = str(e).strip()
+                self._stop.wait(RECONNECT_SECONDS)
+            except Exception as e:    # e.g. the version table is missing; retry rather than let the thread die
+                self._stats["last_error"] = str(e).strip()
+                self._stop.wait(RECONNECT_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    # The counters in the shape of DASHBOARD_AGGREGATE_QUERY's result, for split_aggregates()
+    def aggregates(self):
+        with self._lock:
+            rows = [{"grouping_id": ALL_ROLLED_UP, "total": self._total}]
+            for column, counter in self._counts.items():
+                rows.extend({column: value, "grouping_id": grouping_id_for(column), "total": count} for value, count in counter.items())
+        return pd.DataFrame(rows, columns=CHART_COLUMNS + ["grouping_id", "total"])
+
+    # True once the first snapshot is loaded; until then the counters are empty
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def snapshot(self):
+        return split_aggregates(self.aggregates())
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["version"] = self.version
+            stats["seconds_since_update"] = round(time.time() - self.updated_at, 1) if self.updated_at else None
+        stats["listening"] = self._thread.is_alive()
+        return stats
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the NOTIFY triggers behind the dashboard\'s live mode')
+    parser.add_argument("command", choices=["install", "uninstall"])
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        (install if args.command == "install" else uninstall)(connection)
+        print(f"Live updates {args.command} done")
+    finally:
+        connection.close()
@@ -0,0 +1,180 @@
+import argparse
+import gzip
+import os
+import re
+import time
+from datetime import datetime
+
+from psycopg2 import sql
+
+from db import connect
+from rollups import READY_QUERY, remove_rows_sql
+from sample import READY_QUERY as SAMPLE_READY_QUERY, remove_rows_sql as remove_sampled_rows_sql
+from hitters import READY_QUERY as HITTERS_READY_QUERY, remove_rows_sql as remove_hitters_rows_sql
+
+# "Policelog" is range-partitioned by month on timestamp (see the partition_by_month migration in schema.py).
+# Monthly partitions are named policelog_pYYYY_MM; rows without a timestamp live in policelog_default.
+PARTITION_NAME = re.compile(r"^policelog_p(\d{4})_(\d{2})$")
+DEFAULT_PARTITION = "policelog_default"
+ARCHIVE_DIRECTORY = "archive"
+
+# Creates the monthly partitions of the given months, only those: one stray timestamp in a chunk must not create
+# every month between it and the rest. Rows that went to the default partition before their month existed are
+# moved into the new partition, so the default only ever keeps rows without a timestamp. The (first, last)
+# variant covers every month in between, for python partitions.py ensure.
+FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION policelog_ensure_partitions(months timestamp[]) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start timestamp;
+    month_end timestamp;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    IF COALESCE(cardinality(months), 0) = 0 THEN
+        RETURN 0;
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('policelog_ensure_partitions'));    -- concurrent ingests
+    FOR month_start IN SELECT DISTINCT date_trunc('month', month) FROM unnest(months) AS month WHERE month IS NOT NULL ORDER BY 1 LOOP
+        month_end := month_start + interval '1 month';
+        partition_name := 'policelog_p' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(quote_ident(partition_name)) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM policelog_default WHERE timestamp >= month_start AND timestamp < month_end) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE "Policelog" INCLUDING DEFAULTS)', partition_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM policelog_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+                EXECUTE format('ALTER TABLE "Policelog" ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF "Policelog" FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end);
+            END IF;
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_ensure_partitions(first timestamp, last timestamp) RETURNS integer
+LANGUAGE sql AS $$
+    SELECT policelog_ensure_partitions(ARRAY(SELECT generate_series(date_trunc('month', first), last, interval '1 month')));
+$$;
+"""
+
+PARTITIONED_QUERY = """SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('"Policelog"'));"""
+
+PARTITIONS_QUERY = """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, pg_total_relation_size(c.oid)
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('"Policelog"')
+    ORDER BY c.relname;"""
+
+
+def is_partitioned(cursor):
+    cursor.execute(PARTITIONED_QUERY)
+    return cursor.fetchone()[0]
+
+
+# Make sure partitions exist for the months of the given timestamps; a no-op on an unpartitioned table
+def ensure_partitions(cursor, timestamps):
+    months = sorted({datetime(value.year, value.month, 1) for value in timestamps})
+    if not months or not is_partitioned(cursor):
+        return 0
+    cursor.execute("SELECT policelog_ensure_partitions(%s::timestamp[]);", (months,))
+    return cursor.fetchone()[0]
+
+
+# Make sure partitions exist for every month between first and last
+def ensure_partition_range(cursor, first, last):
+    if not is_partitioned(cursor):
+        return 0
+    cursor.execute("SELECT policelog_ensure_partitions(%s::timestamp, %s::timestamp);", (first, last))
+    return cursor.fetchone()[0]
+
+
+def partition_month(name):
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def list_partitions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(PARTITIONS_QUERY)
+        return [
+            {"name": name, "bounds": bounds, "rows": max(rows, 0), "bytes": size}
+            for name, bounds, rows, size in cursor.fetchall()
+        ]
+
+
+def _export(conn, name, directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    with conn.cursor() as cursor, gzip.open(path, "wb") as output:
+        cursor.copy_expert(sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(name)).as_string(cursor), output)
+    return path
+
+
+# Detach every monthly partition that ends on or before `before`, after exporting it to a gzipped CSV in
+# directory. Detaching fires no delete triggers, so the partition's rows are taken out of the rollups, the
+# sample and the vehicle summaries and the cache data version is bumped by hand. The detached tables are kept (re-attachable) unless drop is set.
+def archive(conn, before, directory=ARCHIVE_DIRECTORY, drop=False, report=print):
+    archived = []
+    for partition in list_partitions(conn):
+        month = partition_month(partition["name"])
+        if month is None or (month.year, month.month) >= (before.year, before.month):
+            continue
+        name = partition["name"]
+        started = time.perf_counter()
+        path = _export(conn, name, directory)
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute(READY_QUERY)
+                if cursor.fetchone()[0]:
+                    cursor.execute(remove_rows_sql(sql.Identifier(name).as_string(cursor)))
+                cursor.execute(SAMPLE_READY_QUERY)
+                if cursor.fetchone()[0]:
+                    cursor.execute(remove_sampled_rows_sql(sql.Identifier(name).as_string(cursor)))
+                cursor.execute(HITTERS_READY_QUERY)
+                if cursor.fetchone()[0]:
+                    cursor.execute(remove_hitters_rows_sql(sql.Identifier(name).as_string(cursor)))
+                cursor.execute(sql.SQL('ALTER TABLE "Policelog" DETACH PARTITION {};').format(sql.Identifier(name)))
+                if drop:
+                    cursor.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(name)))
+                cursor.execute("SELECT to_regclass('policelog_version') IS NOT NULL;")
+                if cursor.fetchone()[0]:
+                    cursor.execute("UPDATE policelog_version SET version = version + 1, changed_at = now();")
+        report(f"{'dropped' if drop else 'detached'} {name} ({partition['rows']:,} rows) -> {path} in {time.perf_counter() - started:.1f}s")
+        archived.append(name)
+    return archived
+
+
+def _month(value):
+    return datetime.strptime(value, "%Y-%m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the monthly partitions of "Policelog"')
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list partitions with their bounds, estimated rows and size")
+    ensure_parser = commands.add_parser("ensure", help="create the partitions for a range of months")
+    ensure_parser.add_argument("first", type=_month, help="first month, YYYY-MM")
+    ensure_parser.add_argument("last", type=_month, help="last month, YYYY-MM")
+    archive_parser = commands.add_parser("archive", help="export and detach partitions older than a month")
+    archive_parser.add_argument("before", type=_month, help="archive every month before this one, YYYY-MM")
+    archive_parser.add_argument("--directory", default=ARCHIVE_DIRECTORY, help="where the gzipped CSV exports go")
+    archive_parser.add_argument("--drop", action="store_true", help="drop the detached partitions instead of keeping them")
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        if args.command == "list":
+            for partition in list_partitions(connection):
+                print(f"{partition['name']:<22} {partition['rows']:>12,} rows {partition['bytes'] / 2 ** 20:9.1f} MB  {partition['bounds']}")
+        elif args.command == "ensure":
+            with connection:
+                with connection.cursor() as cursor:
+                    print(f"created {ensure_partition_range(cursor, args.first, args.last)} partitions")
+        else:
+            archive(connection, args.before, args.directory, args.drop)
+    finally:
+        connection.close()
@@ -1,43 +1,116 @@
 import streamlit as st
-import psycopg2
 import pandas as pd
 import plotly.express as px
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT   #for auto-comitting of values
-
-# Function to connect to the PostgreSQL database
-def connection():
+import time
+from datetime import timedelta
+from db import POOL_MAX_CONN, ConnectionPool, run_query, fetch_frame
+from aggregations import DASHBOARD_AGGREGATE_QUERY, split_aggregates
+from cache import ResultCache, DATA_VERSION_QUERY, install_version_tracking
+from queries import query_map, in_date_range
+from rollups import ROLLUP_QUERIES, READY_QUERY
+from predictor import PredictorIndex, PREDICTOR_INDEX_QUERY
+from report import ReportRun, REPORT_WORKERS, QUERY_TIMEOUT, build_report
+from instrumentation import QueryProfiler, SLOW_QUERY_MS
+from live import LiveCounters, REFRESH_SECONDS, install as install_live_updates
+from writer import BatchWriter, BufferFull, JournalBusy, read_records
+from sample import RATE_QUERIES, sample_source, on_sample, estimate_aggregates, estimate_rates, rate_sample_query
+from hitters import (HITTER_QUERIES, SCOPES, WINDOWS, READY_QUERY as HITTERS_READY_QUERY, top_vehicles_query,
+    VEHICLE_HISTORY_QUERY, VEHICLE_SUMMARY_QUERY)
+from snapshot import SnapshotEngine
+from preview import PAGE_SIZES, SORT_COLUMNS, TEXT_FILTER_COLUMNS, FLAG_FILTER_COLUMNS, build_page_query, split_page
+
+# Connection pool shared across reruns and sessions, so a rerun does not pay a new connect + auth handshake
+@st.cache_resource
+def connection_pool():
+    return ConnectionPool()
+
+# Per-label query timings and the slow-query log, shared by all sessions and shown in the admin tab
+@st.cache_resource
+def query_profiler():
+    return QueryProfiler(connection_pool)
+
+# Function to fetch data and return a DataFrame with column names; timings are recorded under label
+def fetchdata(query, params=None, label="Ad hoc query"):
     try:
-        conn = psycopg2.connect(    #connection statement for posgres to VS Code
-            host="localhost",
-            user="postgres",
-            password="934446",
-            database="policepostregister",
-            port=5432
-        )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)    #for auto-comitting of values
-        return conn
+        pool = connection_pool()
     except Exception as e:    # exception handling
         st.error(f"Database connection error: {e}")
+        return pd.DataFrame()
+    timings = {}
+    started = time.perf_counter()
+    try:
+        df = fetch_frame(pool, query, params, timings=timings)    # streaming the result with COPY into compact, typed columns
+    except Exception as e:      # exception handling
+        timings.setdefault("execute", time.perf_counter() - started - timings.get("connect", 0.0))
+        query_profiler().record(label, query, timings, params, error=str(e))
+        st.error(f"Query execution error: {e}")
+        return pd.DataFrame()
+    query_profiler().record(label, query, timings, params)    # outside the try, so a fetched page is never lost to it
+    return df
+
+# Result cache shared across reruns and sessions; installs the data-version trigger on "Policelog" once per process
+@st.cache_resource
+def result_cache():
+    try:
+        with connection_pool().connection() as conn:
+            install_version_tracking(conn)
+    except Exception as e:    # without the trigger the cache still works, entries then only expire by TTL
+        st.warning(f"Data version tracking unavailable, cached results expire by TTL only: {e}")
+    return ResultCache()
+
+# Chart and metric counters shared by all sessions, kept current by a LISTEN/NOTIFY background thread;
+# installs the notify triggers on "Policelog" once per process
+@st.cache_resource
+def live_counters():
+    with connection_pool().connection() as conn:
+        install_live_updates(conn)
+    return LiveCounters(connection_pool())
+
+# Prediction lookup shared by all sessions: built from one grouped query on first use or an explicit rebuild,
+# and kept current by folding in every log the batch writer commits
+@st.cache_resource
+def predictor_index():
+    return PredictorIndex()
+
+# Batched writer for new logs shared by all sessions: submits only journal and buffer the logs, a background
+# thread writes them to "Policelog" and adds them to the prediction lookup
+@st.cache_resource
+def batch_writer():
+    return BatchWriter(on_written=predictor_index().add_many)
+
+# DuckDB engine over the columnar snapshot written by python snapshot.py export, shared by all sessions
+@st.cache_resource
+def snapshot_engine():
+    return SnapshotEngine()
+
+# Same as fetchdata, but answered from the snapshot for the selected stop dates
+def fetch_snapshot(query):
+    try:
+        return snapshot_engine().query(query, *date_range)
+    except Exception as e:
+        st.error(f"Snapshot query error: {e}")
+        return pd.DataFrame()
+
+# Current data version of "Policelog", or None if it cannot be read
+def data_version():
+    try:
+        columns, rows = run_query(connection_pool(), DATA_VERSION_QUERY)
+        return rows[0][0] if rows else None
+    except Exception:
         return None
 
-# Function to fetch data and return a DataFrame with column names
-def fetchdata(query):
-    connect_with = connection()
-    if connect_with:
-        try:
-            cursor = connect_with.cursor()    # making connection with query
-            cursor.execute(query)      # for executing the query
-            rows = cursor.fetchall()    # fetching all the datas from 
-            columns = [desc[0] for desc in cursor.description]  # to get column names
-            df = pd.DataFrame(rows, columns=columns)
-            return df
-        except Exception as e:      # exception handling
-            st.error(f"Query execution error: {e}")
-            return pd.DataFrame()
-        finally:
-            connect_with.close()    # for closing the connection after execution of query and fetching all the data
+# Same as fetchdata, but answered from the result cache while "Policelog" has not changed
+def fetch_cached(query, label="Ad hoc query"):
+    cache = result_cache()
+    key = cache.key(query, version=data_version())
+    result = cache.get(key)
+    if result is None:
+        result = fetchdata(query, label=label)
+        if not result.empty:
+            cache.put(key, result)
     else:
-        return pd.DataFrame()
+        query_profiler().record_cache_hit(label)
+    return result
 
 # Streamlit app visuals
 st.set_page_config(page_title="Securecheck Police Dashboard", layout="wide")
@@ -45,358 +118,460 @@ st.title("🚓Secure Check Police Post Log🚨")
 st.markdown("Real-time tracking of checkpost ledger")
 st.header("Policelogs Overview")
 
-# Initial preview query of table of log data
-query = """SELECT * FROM "Policelog";"""
-data = fetchdata(query)
-st.dataframe(data, use_container_width=True)
-
-#For creating chart tabs
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
-    "Country","Violation","Stop Outcome","Arrested or not","Drug Related Stops"
-])
-
-with tab1:
-    if not data.empty and "country_name" in data.columns:
-        country_chart = data["country_name"].value_counts().nlargest(5).reset_index()
-        country_chart.columns = ["Country Name", "Count"]
-
-        Chart = px.bar(
-            country_chart,
-            x="Country Name",
-            y="Count",
-            title="Top Countries",
-            color="Country Name",
-            width=500,
-            height=500
-        )
-        st.plotly_chart(Chart)
-    else:
-        st.warning("No data found or 'country_name' column not found.")
-
-with tab2:
-    if not data.empty and "violation" in data.columns:
-        violation_chart = data["violation"].value_counts().nlargest(5).reset_index()
-        violation_chart.columns = ["Violation", "Count"]
-
-        Chart = px.bar(
-            violation_chart,
-            x="Violation",
-            y="Count",
-            title="Top Violations",
-            color="Violation",
-            width=500,
-            height=500
-        )
-        st.plotly_chart(Chart)
-    else:
-        st.warning("No data found or 'violation' column not found.")
-
-with tab3:
-    if not data.empty and "stop_outcome" in data.columns:
-        outcome_chart = data["stop_outcome"].value_counts().nlargest(5).reset_index()
-        outcome_chart.columns = ["Stop outcome", "Count"]
-
-        Chart = px.bar(
-            outcome_chart,
-            x="Stop outcome",
-            y="Count",
-            title="Stop Outcome",
-            color="Stop outcome",
-            width=500,
-            height=500
-        )
-        st.plotly_chart(Chart)
-    else:
-        st.warning("No data found or 'stop_outcome' column not found.")
-
-with tab4:
-    if not data.empty and "is_arrested" in data.columns:
-        arrest_chart = data["is_arrested"].value_counts().reset_index()
-        arrest_chart.columns = ["Arrested", "Count"]
-
-        Chart = px.bar(
-            arrest_chart,
-            x="Arrested",
-            y="Count",
-            title="Arrested",
-            color="Arrested",
-            width=500,
-            height=500
-        )
-        st.plotly_chart(Chart)
-    else:
-        st.warning("No data found or 'is_arrested' column not found.")
-
-with tab5:
-    if not data.empty and "drugs_related_stop" in data.columns:
-        stop_chart = data["drugs_related_stop"].value_counts().reset_index()
-        stop_chart.columns = ["Is Drug Related", "Count"]
-
-        chart = px.bar(
-            stop_chart,
-            x="Is Drug Related",
-            y="Count",
-            title="Drugs Related Stops",
-            color="Is Drug Related",
-            width=500,
-            height=500
+# Pool saturation metrics for the connections shared by all sessions
+with st.sidebar.expander("Connection pool"):
+    try:
+        st.json(connection_pool().metrics())
+    except Exception as e:
+        st.error(f"Database connection error: {e}")
+
+# Hit/miss counters of the query result cache
+with st.sidebar.expander("Result cache"):
+    st.json(result_cache().metrics())
+    if st.button("Clear result cache"):
+        result_cache().clear()
+
+# Logs buffered, written and waiting for a retry by the batched writer
+with st.sidebar.expander("Write buffer"):
+    try:
+        st.json(batch_writer().metrics())
+    except JournalBusy as e:
+        st.error(f"Batched writer unavailable: {e}")
+
+# First and last stop date, to bound the date-range filter (two index lookups once timestamp is indexed). Cached
+# per data version, so reruns only read them again after a write; the ttl bounds how stale they get when the
+# version cannot be read. Errors are not cached.
+@st.cache_data(ttl=600, show_spinner=False)
+def date_bounds(version):
+    columns, rows = run_query(connection_pool(), 'SELECT MIN(timestamp)::date, MAX(timestamp)::date FROM "Policelog";')
+    return tuple(rows[0]) if rows and rows[0][0] is not None else (None, None)
+
+# Tie-breaker for the paged preview: the id key once the schema has been migrated, else the physical row id
+def row_key_column():
+    try:
+        columns, rows = run_query(
+            connection_pool(),
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'Policelog' AND column_name = 'id';",
         )
-        st.plotly_chart(chart)
+        return "id" if rows else "ctid"
+    except Exception:
+        return "ctid"
+
+# Date-range filter for the overview, charts, metrics and analytics. On a partitioned "Policelog" only the
+# months inside the range are read; the full range means no filter, so rollups and cached results still apply.
+try:
+    first_date, last_date = date_bounds(data_version())
+except Exception:
+    first_date, last_date = None, None
+date_range = (None, None)
+if first_date is not None:
+    picked = st.sidebar.date_input("Stop dates", value=(first_date, last_date), min_value=first_date, max_value=last_date)
+    if isinstance(picked, (tuple, list)) and len(picked) == 2 and tuple(picked) != (first_date, last_date):
+        date_range = (picked[0], picked[1] + timedelta(days=1))
+filtered_by_date = date_range != (None, None)
+
+# Paged preview of the log table: only the visible page is fetched, positioned after the previous page's last row
+sort_col, order_col, size_col = st.columns(3)
+with sort_col:
+    sort_column = st.selectbox("Sort by", SORT_COLUMNS)
+with order_col:
+    descending = st.selectbox("Order", ["Ascending", "Descending"]) == "Descending"
+with size_col:
+    page_size = st.selectbox("Rows per page", PAGE_SIZES)
+
+filters = {}
+for column in st.multiselect("Filter columns", TEXT_FILTER_COLUMNS + FLAG_FILTER_COLUMNS):
+    if column in FLAG_FILTER_COLUMNS:
+        filters[column] = st.selectbox(column, [True, False], key=f"filter_{column}")
     else:
-        st.warning("No data found or 'drugs_related_stop' column not found.")
+        value = st.text_input(f"{column} contains", key=f"filter_{column}")
+        if value:
+            filters[column] = value
+
+# Start over from the first page whenever the sort, page size or filters change
+preview_state = (sort_column, descending, page_size, tuple(sorted(filters.items())), date_range)
+if st.session_state.get("preview_state") != preview_state:
+    st.session_state.preview_state = preview_state
+    st.session_state.preview_keys = [None]    # key to start after, for every page visited so far
+
+def next_page(key):
+    st.session_state.preview_keys.append(key)
+
+def previous_page():
+    st.session_state.preview_keys.pop()
+
+page_query, page_params = build_page_query(
+    sort_column, descending, filters, page_size, st.session_state.preview_keys[-1], date_range, row_key_column()
+)
+page, next_key = split_page(fetchdata(page_query, page_params, label="Overview page"), sort_column, page_size)
+st.dataframe(page, use_container_width=True)
+
+prev_col, page_col, next_col = st.columns([1, 2, 1])
+with prev_col:
+    st.button("Previous page", on_click=previous_page, disabled=len(st.session_state.preview_keys) == 1)
+with page_col:
+    st.caption(f"Page {len(st.session_state.preview_keys)}")
+with next_col:
+    st.button("Next page", on_click=next_page, args=(next_key,), disabled=next_key is None)
+
+# Error bars for a chart of approximate counts: adds the 95% margins to the chart's frame and returns the column
+def error_bars(chart_frame, column, margins):
+    if margins is None:
+        return None
+    chart_frame["Margin"] = margins["counts"][column].reindex(chart_frame.iloc[:, 0]).values
+    return "Margin"
 
-col1, col2, col3, col4 = st.columns(4)
+# Hover text of a metric card with its 95% margin, for approximate totals
+def metric_margin(margins, key):
+    if margins is None:
+        return None
+    return f"Approximate: ± {margins['totals'][key]:,} (95% confidence)"
+
+# Tab charts and metric cards for a set of value counts and totals (see split_aggregates); margins are given
+# when the counts are estimated from a sample (see sample.estimate_aggregates)
+def render_charts(counts, totals, margins=None):
+    #For creating chart tabs
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "Country","Violation","Stop Outcome","Arrested or not","Drug Related Stops"
+    ])
+
+    with tab1:
+        if not counts["country_name"].empty:
+            country_chart = counts["country_name"].nlargest(5).reset_index()
+            country_chart.columns = ["Country Name", "Count"]
+
+            Chart = px.bar(
+                country_chart,
+                x="Country Name",
+                y="Count",
+                title="Top Countries",
+                error_y=error_bars(country_chart, "country_name", margins),
+                color="Country Name",
+                width=500,
+                height=500
+            )
+            st.plotly_chart(Chart)
+        else:
+            st.warning("No data found or 'country_name' column not found.")
+
+    with tab2:
+        if not counts["violation"].empty:
+            violation_chart = counts["violation"].nlargest(5).reset_index()
+            violation_chart.columns = ["Violation", "Count"]
+
+            Chart = px.bar(
+                violation_chart,
+                x="Violation",
+                y="Count",
+                title="Top Violations",
+                error_y=error_bars(violation_chart, "violation", margins),
+                color="Violation",
+                width=500,
+                height=500
+            )
+            st.plotly_chart(Chart)
+        else:
+            st.warning("No data found or 'violation' column not found.")
+
+    with tab3:
+        if not counts["stop_outcome"].empty:
+            outcome_chart = counts["stop_outcome"].nlargest(5).reset_index()
+            outcome_chart.columns = ["Stop outcome", "Count"]
+
+            Chart = px.bar(
+                outcome_chart,
+                x="Stop outcome",
+                y="Count",
+                title="Stop Outcome",
+                error_y=error_bars(outcome_chart, "stop_outcome", margins),
+                color="Stop outcome",
+                width=500,
+                height=500
+            )
+            st.plotly_chart(Chart)
+        else:
+            st.warning("No data found or 'stop_outcome' column not found.")
+
+    with tab4:
+        if not counts["is_arrested"].empty:
+            arrest_chart = counts["is_arrested"].reset_index()
+            arrest_chart.columns = ["Arrested", "Count"]
+
+            Chart = px.bar(
+                arrest_chart,
+                x="Arrested",
+                y="Count",
+                title="Arrested",
+                error_y=error_bars(arrest_chart, "is_arrested", margins),
+                color="Arrested",
+                width=500,
+                height=500
+            )
+            st.plotly_chart(Chart)
+        else:
+            st.warning("No data found or 'is_arrested' column not found.")
+
+    with tab5:
+        if not counts["drugs_related_stop"].empty:
+            stop_chart = counts["drugs_related_stop"].reset_index()
+            stop_chart.columns = ["Is Drug Related", "Count"]
+
+            chart = px.bar(
+                stop_chart,
+                x="Is Drug Related",
+                y="Count",
+                title="Drugs Related Stops",
+                error_y=error_bars(stop_chart, "drugs_related_stop", margins),
+                color="Is Drug Related",
+                width=500,
+                height=500
+            )
+            st.plotly_chart(chart)
+        else:
+            st.warning("No data found or 'drugs_related_stop' column not found.")
+
+    col1, col2, col3, col4 = st.columns(4)
 
-with col1:
-    total_stops = data.shape[0]
-    st.metric("Total Police Stops", total_stops)
+    with col1:
+        st.metric("Total Police Stops", totals["total_stops"], help=metric_margin(margins, "total_stops"))
 
-with col2:
-    total_arrest = data[data["stop_outcome"].str.contains("arrest", case=False, na=False)].shape[0]
-    st.metric("Total Arrests", total_arrest)
+    with col2:
+        st.metric("Total Arrests", totals["total_arrests"], help=metric_margin(margins, "total_arrests"))
 
-with col3:
-    total_warning = data[data["stop_outcome"].str.contains("warning", case=False, na=False)].shape[0]
-    st.metric("Total Warning", total_warning)
+    with col3:
+        st.metric("Total Warning", totals["total_warnings"], help=metric_margin(margins, "total_warnings"))
 
-with col4:
-    Drug_related = data[data["drugs_related_stop"]==1].shape[0]
-    st.metric("Drug Related Stop", Drug_related)
+    with col4:
+        st.metric("Drug Related Stop", totals["drug_related_stops"], help=metric_margin(margins, "drug_related_stops"))
+
+# Snapshot mode answers the charts, metric cards and canned analytics from the offline snapshot instead of
+# Postgres, so heavy analysis does not compete with checkpoint writes; the paged overview, repeat offenders and
+# new logs stay on the live table
+with st.sidebar.expander("Data source"):
+    snapshot_mode = st.radio("Answer analytics from", ["Live", "Snapshot"], horizontal=True) == "Snapshot"
+    if snapshot_mode:
+        try:
+            engine = snapshot_engine()
+            engine.refresh()    # picks up a newer export
+            if engine.manifest is None:
+                st.warning("No snapshot yet, using live data: run python snapshot.py export.")
+                snapshot_mode = False
+            else:
+                st.json(engine.metrics())
+        except Exception as e:
+            st.error(f"Snapshot unavailable, using live data: {e}")
+            snapshot_mode = False
+
+# Live mode keeps the charts and metric cards current from the deltas NOTIFYed by every write to "Policelog";
+# only this fragment reruns at the refresh cadence, the rest of the page is left alone
+with st.sidebar.expander("Live updates"):
+    live_mode = st.toggle("Live mode", help="Update the charts and metric cards as new stops are logged")
+    refresh_seconds = st.number_input("Refresh every (seconds)", min_value=0.5, max_value=60.0, value=REFRESH_SECONDS, step=0.5)
+    if live_mode:
+        try:
+            st.json(live_counters().metrics())
+        except Exception as e:
+            st.error(f"Live updates unavailable, using exact answers: {e}")
+            live_mode = False
+
+# Approximate mode answers the charts, metric cards and rate queries from a random sample of "Policelog" (the
+# maintained sample from python sample.py install, else TABLESAMPLE), with 95% intervals. The source is cached
+# per data version, which is also the TABLESAMPLE seed; the ttl picks up a sample installed since.
+@st.cache_data(ttl=600, show_spinner=False)
+def sample_source_at(version):
+    with connection_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            return sample_source(cursor, seed=version or 0)
+
+def approximate_source():
+    try:
+        return sample_source_at(data_version())
+    except Exception as e:
+        st.error(f"Sample unavailable, using exact answers: {e}")
+        return None
+
+with st.sidebar.expander("Approximate answers"):
+    approximate_mode = st.toggle("Approximate mode", help="Answer charts, metrics and rate queries from a random sample")
+    source = approximate_source() if approximate_mode else None
+    if source is not None:
+        st.json({key: source[key] for key in ["method", "population", "sampled", "fraction"]})
+
+if snapshot_mode:
+    render_charts(*split_aggregates(fetch_snapshot(DASHBOARD_AGGREGATE_QUERY)))
+    manifest = snapshot_engine().manifest
+    st.caption(f"Snapshot of {manifest['created_at']} (data version {manifest['data_version']}).")
+elif live_mode and not filtered_by_date:
+    @st.fragment(run_every=refresh_seconds)
+    def live_charts():
+        try:
+            live = live_counters()
+            ready = live.wait_ready(timeout=5)
+        except Exception as e:
+            st.error(f"Live updates unavailable, using exact answers: {e}")
+            ready = False
+        else:
+            if not ready:
+                st.caption("Live counters are still loading; showing the last computed counts.")
+        if not ready:
+            render_charts(*split_aggregates(
+                fetch_cached(in_date_range(DASHBOARD_AGGREGATE_QUERY, *date_range), label="Chart aggregates")
+            ))
+            return
+        render_charts(*live.snapshot())
+        st.caption(f"Live: data version {live.version}, {live.metrics()['deltas']} updates applied")
+
+    live_charts()
+elif source is not None:
+    sample_aggregates = fetch_cached(
+        on_sample(in_date_range(DASHBOARD_AGGREGATE_QUERY, *date_range), source), label="Chart aggregates (approximate)"
+    )
+    render_charts(*estimate_aggregates(sample_aggregates, source, filtered_by_date))
+    st.caption(f"Approximate: estimated from {source['sampled']:,} sampled stops, error bars show 95% intervals.")
+else:
+    if live_mode:
+        st.caption("Live mode covers all dates; clear the date filter to use it.")
+    # Chart and metric counts are computed in Postgres in one grouped query, so only the small result sets are fetched
+    aggregates = fetch_cached(in_date_range(DASHBOARD_AGGREGATE_QUERY, *date_range), label="Chart aggregates")
+    render_charts(*split_aggregates(aggregates))
 
 # Creating dropdown for queries
 st.header("Project Queries")
-select_query = st.selectbox("Select query to run", [
-    "Top 10 vehicle_Number involved in drug-related stops",
-    "Most frequently searched vehicles",
-    "Highest arrest rate according to driver age group",
-    "Gender distribution of drivers stopped in each country",
-    "Race and gender combination having the highest search rate",
-    "Time of day sees the most traffic stops",
-    "Average stop duration for different violations",
-    "Are stops during the night more likely to lead to arrests",
-    "Violations that are most associated with searches or arrests",
-    "Violations are most common among younger drivers (<25)",
-    "Violation that rarely results in search or arrest",
-    "Countries report the highest rate of drug-related stop",
-    "Arrest rate by country and violation",
-    "Country having the most stops with search conducted",
-    "Yearly Breakdown of Stops and Arrests by Country",
-    "Driver Violation Trends Based on Age and Race",
-    "Time Period Analysis of Stops, Number of Stops by Year,Month, Hour of the Day",
-    "Violations with High Search and Arrest Rates",
-    "Driver Demographics by Country",
-    "Top 5 Violations with Highest Arrest Rates"
-])
-
-# Mapping queries with select_query
-query_map = {
-    "Top 10 vehicle_Number involved in drug-related stops": """select vehicle_number, count(*) as drug_stop_count from "Policelog" 
-    where drugs_related_stop = true and vehicle_number is not null 
-    group by vehicle_number 
-    order by drug_stop_count desc limit 10;""",
-    "Most frequently searched vehicles": """select vehicle_number, count(*) as search_count from "Policelog" 
-    where search_conducted = true and vehicle_number is not null 
-    group by vehicle_number 
-    order by search_count desc limit 10;""",
-    "Highest arrest rate according to driver age group": """select age_group, count (*) as total_stops, 
-    sum(case when is_arrested = true then 1 else 0 end) as total_arrests, 
-    round(100.0*sum(case when is_arrested = true then 1 else 0 end)/count(*),2) as arrest_rate 
-    from (select *,case 
-    when driver_age<18 then 'under 18'
-    when driver_age between 18 and 25 then '18-25'
-    when driver_age between 26 and 40 then '26-40'
-    when driver_age between 41 and 60 then '41-60'
-    when driver_age between 61 and 80 then '61-80'
-    else 'unknown' end as age_group
-    from "Policelog"
-    where driver_age is not null
-    )as grouped_data group by age_group 
-    order by arrest_rate desc limit 1;""",
-    "Gender distribution of drivers stopped in each country": """select country_name,
-    sum(case when driver_gender = 'M' then 1 else 0 end) as Male_count,
-    sum(case when driver_gender = 'F' then 1 else 0 end) as Female_count from "Policelog" 
-    where driver_gender is not null group by country_name""",
-    "Race and gender combination having the highest search rate": """SELECT driver_race, driver_gender,COUNT(*) AS total_stops, 
-    SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS total_searches,
-    ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*),2) AS search_rate_percent
-    FROM Policelog WHERE driver_race IS NOT NULL AND driver_gender IS NOT NULL
-    GROUP BY driver_race, driver_gender 
-    ORDER BY search_rate_percent DESC LIMIT 1;""",
-    "Time of day sees the most traffic stops": """SELECT EXTRACT(HOUR FROM timestamp) AS stop_hour,
-    COUNT(*) AS total_stops FROM "Policelog"
-    WHERE timestamp IS NOT NULL
-    GROUP BY stop_hour ORDER BY total_stops DESC LIMIT 1;""",
-    "Average stop duration for different violations": """SELECT violation, ROUND(AVG(CASE 
-    WHEN stop_duration = '0-15 Min' THEN 7.5
-    WHEN stop_duration = '16-30 Min' THEN 23
-    WHEN stop_duration = '30+ Min' THEN 35
-    ELSE NULL END), 2) AS avg_stop_duration_minutes
-    FROM "Policelog"
-    WHERE stop_duration IS NOT NULL AND violation IS NOT NULL
-    GROUP BY violation ORDER BY avg_stop_duration_minutes DESC;""",
-    "Are stops during the night more likely to lead to arrests": """WITH time_classified AS (SELECT *,
-    CASE WHEN EXTRACT(HOUR FROM timestamp) BETWEEN 6 AND 17 THEN 'Day'
-    ELSE 'Night' END AS time_of_day
-    FROM "Policelog" WHERE timestamp IS NOT NULL),
-    arrest_summary AS (SELECT time_of_day,COUNT(*) AS total_stops,
-    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
-    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
-    FROM time_classified GROUP BY time_of_day)
-    SELECT * FROM arrest_summary
-    ORDER BY time_of_day;
-    ""","Violations that are most associated with searches or arrests": """SELECT violation, COUNT(*) AS total_stops,
-    SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS total_searches,
-    ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS search_rate_percent,
-    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
-    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
-    FROM "Policelog" WHERE violation IS NOT NULL GROUP BY violation
-    ORDER BY total_searches DESC, total_arrests DESC;""",
-    "Violations are most common among younger drivers (<25)": """SELECT violation,COUNT(*) AS stop_count FROM Policelog
-    WHERE driver_age < 25 AND violation IS NOT NULL GROUP BY violation ORDER BY stop_count DESC;""",
-    "Violation that rarely results in search or arrest": """SELECT violation,COUNT(*) AS total_stops,
-    COUNT(CASE WHEN search_conducted = TRUE OR is_arrested = TRUE THEN 1 END) AS stops_with_search_or_arrest,
-    (CAST(COUNT(CASE WHEN search_conducted = TRUE OR is_arrested = TRUE THEN 1 END) AS NUMERIC) * 100.0 / COUNT(*)) AS search_or_arrest_percentage
-    FROM Policelog GROUP BY violation
-    HAVING COUNT(*) > 0
-    ORDER BY search_or_arrest_percentage ASC,
-    total_stops DESC LIMIT 1;""",
-    "Countries report the highest rate of drug-related stop": """SELECT country_name,
-    COUNT(*) AS total_stops,
-    COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS drug_related_stops,
-    (CAST(COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS NUMERIC) * 100.0 / COUNT(*)) AS drug_related_percentage
-    FROM Policelog
-    WHERE country_name IS NOT NULL
-    GROUP BY country_name
-    HAVING COUNT(*) > 0
-    ORDER BY drug_related_percentage DESC limit 1;""",
-    "Arrest rate by country and violation": """SELECT country_name,violation,COUNT(*) AS total_stops,
-    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
-    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
-    FROM "Policelog" WHERE country_name IS NOT NULL AND violation IS NOT NULL
-    GROUP BY country_name, violation
-    ORDER BY arrest_rate_percent DESC;""",
-    "Country having the most stops with search conducted": """SELECT country_name,COUNT(*) AS total_stops_with_search
-    FROM "Policelog"
-    WHERE search_conducted = TRUE AND country_name IS NOT NULL
-    GROUP BY country_name
-    ORDER BY total_stops_with_search DESC
-    LIMIT 1;""",
-    "Yearly Breakdown of Stops and Arrests by Country": """SELECT year,country_name,total_stops,total_arrests,
-    ROUND(100.0 * total_arrests / total_stops, 2) AS arrest_rate_percent,
-    RANK() OVER (PARTITION BY year ORDER BY total_arrests DESC) AS country_rank_by_arrests
-    FROM (SELECT EXTRACT(YEAR FROM timestamp) AS year,
-        country_name,
-        COUNT(*) AS total_stops,
-        SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests
-    FROM "Policelog"
-    WHERE timestamp IS NOT NULL AND country_name IS NOT NULL
-    GROUP BY EXTRACT(YEAR FROM timestamp), country_name
-    ) AS yearly_stats
-    ORDER BY year, country_rank_by_arrests;""",
-    "Driver Violation Trends Based on Age and Race": """WITH age_grouped AS (SELECT driver_race,
-    CASE
-	WHEN driver_age IS NULL THEN 'Unknown'
-    WHEN driver_age < 18 THEN 'Under 18'
-    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-    WHEN driver_age > 60 THEN '60+'
-    ELSE 'Unknown' END AS age_group,
-    violation,COUNT(*) AS violation_count FROM "Policelog"
-    WHERE driver_race IS NOT NULL AND violation IS NOT NULL
-    GROUP BY driver_race, age_group, violation),
-    top_violations AS (SELECT driver_race,age_group,violation,violation_count,
-    RANK() OVER (PARTITION BY driver_race, age_group ORDER BY violation_count DESC) AS rank
-    FROM age_grouped)
-    SELECT 
-    t.driver_race,
-    t.age_group,
-    t.violation,
-    t.violation_count,
-    totals.total_stops
-    FROM top_violations t
-    JOIN (
-    SELECT driver_race,
-    CASE
-    WHEN driver_age IS NULL THEN 'Unknown'
-    WHEN driver_age < 18 THEN 'Under 18'
-    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-    WHEN driver_age > 60 THEN '60+'
-    ELSE 'Unknown'
-    END AS age_group,
-    COUNT(*) AS total_stops
-    FROM "Policelog"
-    WHERE driver_race IS NOT NULL
-    GROUP BY driver_race, age_group
-    ) totals
-    ON t.driver_race = totals.driver_race AND t.age_group = totals.age_group
-    WHERE t.rank = 1
-    ORDER BY t.driver_race, t.age_group;""",
-    "Time Period Analysis of Stops, Number of Stops by Year,Month, Hour of the Day": """SELECT
-    EXTRACT(YEAR FROM timestamp) AS stop_year,
-    EXTRACT(MONTH FROM timestamp) AS stop_month,
-    EXTRACT(HOUR FROM timestamp) AS stop_hour,
-    COUNT(*) AS total_stops
-    FROM "Policelog"
-    WHERE timestamp IS NOT NULL
-    GROUP BY stop_year, stop_month, stop_hour
-    ORDER BY stop_year, stop_month, stop_hour;""",
-    "Violations with High Search and Arrest Rates": """WITH violation_stats AS (
-    SELECT violation,COUNT(*) AS total_stops,SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS search_count,
-        SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS arrest_count,
-        ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS search_rate_percent,
-        ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
-    FROM "Policelog" WHERE violation IS NOT NULL GROUP BY violation),
-    ranked_violations AS (
-    SELECT *,RANK() OVER (ORDER BY search_rate_percent DESC) AS search_rank,
-    RANK() OVER (ORDER BY arrest_rate_percent DESC) AS arrest_rank
-    FROM violation_stats)
-    SELECT violation,total_stops,search_count,search_rate_percent,search_rank,arrest_count,arrest_rate_percent,arrest_rank
-    FROM ranked_violations
-    WHERE search_rank <= 5 OR arrest_rank <= 5
-    ORDER BY search_rank, arrest_rank;""",
-    "Driver Demographics by Country": """WITH driver_data AS (
-    SELECT country_name,driver_gender,driver_race,
-    CASE
-    WHEN driver_age IS NULL THEN 'Unknown'
-    WHEN driver_age < 18 THEN 'Under 18'
-    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-    WHEN driver_age > 60 THEN '60+'
-    ELSE 'Unknown' END AS age_group
-    FROM "Policelog"
-    WHERE country_name IS NOT NULL
-        AND driver_gender IS NOT NULL
-        AND driver_race IS NOT NULL
-        AND driver_age IS NOT NULL)
-    SELECT country_name,age_group,driver_gender,driver_race,
-    COUNT(*) AS total_stops
-    FROM driver_data
-    GROUP BY country_name, age_group, driver_gender, driver_race
-    ORDER BY country_name, age_group, driver_gender, driver_race;""",
-    "Top 5 Violations with Highest Arrest Rates": """WITH violation_stats AS (
-    SELECT violation,COUNT(*) AS total_stops,
-    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
-    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
-    FROM "Policelog" WHERE violation IS NOT NULL
-    GROUP BY violation)
-    SELECT violation,total_stops,total_arrests,arrest_rate_percent
-    FROM violation_stats
-    ORDER BY arrest_rate_percent DESC
-    LIMIT 5;"""
-}
+select_query = st.selectbox("Select query to run", list(query_map))
+
+# Whether a summary's tables and maintenance triggers are installed, from its READY_QUERY
+def installed(ready_query):
+    try:
+        columns, rows = run_query(connection_pool(), ready_query)
+        return bool(rows and rows[0][0])
+    except Exception:
+        return False
+
+# The rollups (python rollups.py install) and the vehicle summaries (python hitters.py install)
+def rollups_ready():
+    return installed(READY_QUERY)
+
+def hitters_ready():
+    return installed(HITTERS_READY_QUERY)
+
+# Answer canned analytics from the rollup tables or the vehicle summaries when they are available; both cover
+# all dates, so a date-range filter goes to "Policelog" with the range pushed down to the partitions
+def analytics_query(title, use_rollups, use_hitters=False):
+    if use_rollups and title in ROLLUP_QUERIES and not filtered_by_date:
+        return ROLLUP_QUERIES[title]
+    if use_hitters and title in HITTER_QUERIES and not filtered_by_date:
+        return HITTER_QUERIES[title]
+    return in_date_range(query_map[title], *date_range)
+
+# Answers from the vehicle summaries are upper bounds even outside approximate mode, so they are labelled as such
+HITTER_CAPTION = "Approximate: counts from the vehicle summaries are upper bounds; the true count is at most max_overcount lower."
+
+def from_hitters(title, query):
+    return query == HITTER_QUERIES.get(title)
 
 # Button to run selected query
 if st.button("Run Query"):
-    result = fetchdata(query_map[select_query])
+    if snapshot_mode:
+        result = fetch_snapshot(query_map[select_query])
+    elif source is not None and select_query in RATE_QUERIES:
+        sample_counts = fetch_cached(
+            on_sample(in_date_range(rate_sample_query(select_query), *date_range), source), label=f"{select_query} (approximate)"
+        )
+        result = estimate_rates(select_query, sample_counts, source["fraction"])
+        st.caption(f"Approximate: rates from {source['sampled']:,} sampled stops with 95% intervals (_low / _high).")
+    else:
+        query = analytics_query(select_query, rollups_ready(), hitters_ready())
+        result = fetch_cached(query, label=select_query)
+        if from_hitters(select_query, query):
+            st.caption(HITTER_CAPTION)
     if not result.empty:
         st.dataframe(result, use_container_width=True)
     else:
         st.warning("No results found for the selected query.")
 
+# Report mode: run all (or some) canned queries concurrently and show each result as soon as it is ready
+st.subheader("Run all analytics")
+report_titles = st.multiselect("Queries in the report", list(query_map), default=list(query_map))
+workers_col, timeout_col = st.columns(2)
+with workers_col:
+    report_workers = st.number_input("Parallel queries", min_value=1, max_value=POOL_MAX_CONN, value=REPORT_WORKERS)
+with timeout_col:
+    report_timeout = st.number_input("Timeout per query (seconds)", min_value=1, value=int(QUERY_TIMEOUT))
+
+run_col, cancel_col = st.columns(2)
+with run_col:
+    run_report = st.button("Run report", disabled=not report_titles)
+with cancel_col:
+    if st.button("Cancel report") and st.session_state.get("report_run") is not None:
+        st.session_state.report_run.cancel()
+
+if run_report:
+    if snapshot_mode:
+        engine, report_range = snapshot_engine(), date_range
+        report_queries = {title: query_map[title] for title in report_titles}
+    else:
+        use_rollups, use_hitters = rollups_ready(), hitters_ready()
+        report_queries = {title: analytics_query(title, use_rollups, use_hitters) for title in report_titles}
+    st.session_state.report_run = ReportRun(
+        connection_pool(),
+        report_queries,
+        workers=report_workers,
+        timeout=report_timeout,
+        cache=None if snapshot_mode else result_cache(),
+        version=data_version(),
+        profiler=query_profiler(),
+        runner=(lambda query: engine.query(query, *report_range)) if snapshot_mode else None,
+    )
+    st.session_state.report_order = report_titles
+    st.session_state.report_results = []
+    progress = st.progress(0.0, text="Running report")
+    slots = {title: st.empty() for title in report_titles}    # results fill in as they finish, in the chosen order
+    for done, report_result in enumerate(st.session_state.report_run.results(), start=1):
+        st.session_state.report_results.append(report_result)
+        progress.progress(done / len(report_titles), text=f"{done} of {len(report_titles)} queries finished")
+        with slots[report_result.title].container():
+            st.markdown(f"**{report_result.title}** ({report_result.seconds:.2f}s{', cached' if report_result.cached else ''})")
+            if report_result.error:
+                st.error(report_result.error)
+            else:
+                st.dataframe(report_result.frame, use_container_width=True)
+                if from_hitters(report_result.title, report_queries[report_result.title]):
+                    st.caption(HITTER_CAPTION)
+    st.session_state.report_run = None
+
+if st.session_state.get("report_results"):
+    st.download_button(
+        "Download report",
+        build_report(st.session_state.report_results, st.session_state.report_order),
+        file_name="securecheck_report.html",
+        mime="text/html",
+    )
+
+# Repeat offenders: the most frequent vehicles per scope and window from the Space-Saving summaries kept at
+# ingest time, and a stop-history lookup for one vehicle at the checkpoint
+st.header("🚗 Repeat offenders")
+scope_labels = {"all": "All stops", "searched": "Searched", "drugs": "Drug-related"}
+if hitters_ready():
+    scope_col, window_col, limit_col = st.columns(3)
+    with scope_col:
+        hitter_scope = st.selectbox("Stops", list(SCOPES), format_func=scope_labels.get)
+    with window_col:
+        hitter_window = st.selectbox("Window", [None] + list(WINDOWS), format_func=lambda window: f"Last {window}" if window else "All time")
+    with limit_col:
+        hitter_limit = st.number_input("Vehicles", min_value=1, max_value=100, value=10)
+    offenders = fetch_cached(top_vehicles_query(hitter_scope, hitter_window, hitter_limit), label="Repeat offenders")
+    st.dataframe(offenders, use_container_width=True)
+    st.caption("Counts are upper bounds; the true count is at most max_overcount lower. Windows end at the newest logged stop.")
+else:
+    st.caption("Install the vehicle summaries with python hitters.py install to list repeat offenders.")
+
+lookup_vehicle = st.text_input("Look up a vehicle number").strip()
+if lookup_vehicle:
+    vehicle_summary = fetchdata(VEHICLE_SUMMARY_QUERY, (lookup_vehicle,), label="Vehicle summary")
+    if vehicle_summary.empty or vehicle_summary["stops"].iloc[0] == 0:
+        st.info(f"No stops logged for {lookup_vehicle}.")
+    else:
+        st.dataframe(vehicle_summary, use_container_width=True)
+        st.dataframe(fetchdata(VEHICLE_HISTORY_QUERY, (lookup_vehicle, 50), label="Vehicle history"), use_container_width=True)
 
 st.markdown("---")
 st.markdown("Built with ❤️ for law Enforcement by Securecheck")
@@ -407,7 +582,15 @@ st.markdown("Fill in the details below to get the Natural language prediction of
 
 st.header("📖 Add new police log & Predict outcome and violation")
 
-unique_durations = data["stop_duration"].dropna().unique()
+predictor = predictor_index()
+rebuild_predictor = st.button("Rebuild prediction index", help="Re-read every stop, e.g. after logs were loaded outside the dashboard")
+if rebuild_predictor or predictor.needs_refresh():
+    try:
+        predictor.load(*run_query(connection_pool(), PREDICTOR_INDEX_QUERY), version=data_version())
+    except Exception as e:
+        st.error(f"Query execution error: {e}")
+
+unique_durations = predictor.durations()
 
 with st.form("New Log Form"):
     stop_date = st.date_input("Stop Date")
@@ -421,26 +604,35 @@ with st.form("New Log Form"):
     drugs_related_stop = st.selectbox("Was it a drug-related stop", [True, False])
     stop_duration = st.selectbox("Stop Duration", unique_durations)
     vehicle_number = st.text_input("Vehicle Number")
+    # Only needed to record the log; the prediction is made from the fields above
+    violation = st.selectbox("Violation", predictor.values("violation"), index=None, accept_new_options=True)
+    stop_outcome = st.selectbox("Stop Outcome", predictor.values("stop_outcome"), index=None, accept_new_options=True)
+    is_arrested = st.selectbox("Was the driver arrested", [False, True])
     timestamp = pd.Timestamp.now()
 
     submitted = st.form_submit_button("Predict the Outcome")
+    recorded = st.form_submit_button("Record the log")
+
+    if recorded and (violation is None or stop_outcome is None):
+        st.error("Log not recorded: pick the violation and the stop outcome.")
+    elif recorded:
+        try:
+            batch_writer().submit({
+                "stop_date": stop_date, "stop_time": stop_time, "country_name": country_name,
+                "driver_gender": driver_gender, "driver_age": driver_age, "driver_race": driver_race,
+                "violation": violation, "search_conducted": search_conducted, "search_type": search_type,
+                "stop_outcome": stop_outcome, "is_arrested": is_arrested, "drugs_related_stop": drugs_related_stop,
+                "stop_duration": stop_duration, "vehicle_number": vehicle_number,
+            })
+            st.success("Log recorded; it is written to the register within a few seconds.")
+        except (ValueError, BufferFull, JournalBusy) as e:
+            st.error(f"Log not recorded: {e}")
 
     if submitted:
-        # Filter based on selected inputs
-        filtered_data = data[
-            (data['driver_gender'] == driver_gender) &
-            (data['driver_age'] == driver_age) &
-            (data['search_conducted'] == search_conducted) &
-            (data['stop_duration'] == stop_duration) &
-            (data['drugs_related_stop'] == drugs_related_stop)
-        ]
-
-        if not filtered_data.empty:
-            predicted_outcome = filtered_data['stop_outcome'].mode()[0]
-            predicted_violation = filtered_data['violation'].mode()[0]
-        else:
-            predicted_outcome = "warning"
-            predicted_violation = "speeding"
+        # Look up the most common outcome and violation for the selected inputs, backing off to fewer fields if needed
+        prediction = predictor.predict(driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop)
+        predicted_outcome = prediction["stop_outcome"]["value"]
+        predicted_violation = prediction["violation"]["value"]
 
         # Construct narrative components
         search_text = "A search was conducted" if search_conducted else "No search was conducted"
@@ -458,3 +650,62 @@ with st.form("New Log Form"):
 {search_text}, and {pronoun} received a {predicted_outcome}.  
 The stop lasted {stop_duration} and {drug_text}.
         """)
+        for target, label in [("violation", "Violation"), ("stop_outcome", "Stop outcome")]:
+            matched_on = prediction[target]["matched_on"]
+            if matched_on is None:
+                st.caption(f"{label}: no matching stops, using the default.")
+            else:
+                st.caption(
+                    f"{label}: seen {prediction[target]['count']} times in {prediction[target]['matches']} stops "
+                    f"matching on {', '.join(matched_on) if matched_on else 'all stops'}."
+                )
+
+# Bulk upload of logs from many checkpoints, one log per JSON line or CSV row with "Policelog" column names
+uploaded = st.file_uploader("Upload police logs (JSONL or CSV)", type=["jsonl", "json", "csv"])
+if uploaded is not None and st.button("Record uploaded logs"):
+    try:
+        accepted, rejected = batch_writer().submit_many(read_records(uploaded, uploaded.name))
+        st.success(f"{accepted} logs recorded, {len(rejected)} rejected.")
+        if rejected:
+            st.dataframe(pd.DataFrame(
+                [{"log": position + 1, "problem": problem} for position, record, problem in rejected[:100]]
+            ), use_container_width=True)
+    except (ValueError, BufferFull, JournalBusy) as e:
+        st.error(f"Upload not recorded: {e}")
+
+# Admin: where query time goes, per label, and the slowest recent queries with their plans
+st.header("🛠 Admin")
+profiler = query_profiler()
+perf_tab, slow_tab = st.tabs(["Query performance", "Slow queries"])
+
+with perf_tab:
+    summary = profiler.summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary), use_container_width=True)
+        histograms = profiler.histograms()
+        histogram_label = st.selectbox("Latency histogram for", list(histograms))
+        histogram = pd.Series(histograms[histogram_label]).rename_axis("Latency").reset_index(name="Queries")
+        st.plotly_chart(px.bar(histogram, x="Latency", y="Queries", title=f"Latency of {histogram_label}"))
+    else:
+        st.info("No queries recorded yet.")
+
+with slow_tab:
+    profiler.slow_ms = st.number_input("Slow query threshold (ms)", min_value=1.0, value=SLOW_QUERY_MS, step=50.0)
+    profiler.capture_plans = st.checkbox(
+        "Capture EXPLAIN (ANALYZE, BUFFERS) for slow queries (re-runs them once)", value=profiler.capture_plans
+    )
+    for entry in profiler.slow_queries():
+        with st.expander(f"{entry['at']}  {entry['label']}  {entry['ms']} ms"):
+            st.json({key: entry[key] for key in ["phases_ms", "rows", "bytes", "error"]})
+            st.code(entry["query"], language="sql")
+            if entry["plan"]:
+                st.code(entry["plan"])
+    if not profiler.slow_queries():
+        st.info("No slow queries recorded.")
+
+export_col, reset_col = st.columns(2)
+with export_col:
+    st.download_button("Export timings as JSON", profiler.to_json(), file_name="query_timings.json", mime="application/json")
+with reset_col:
+    if st.button("Reset timings"):
+        profiler.reset()
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import Counter
+
+from ingest import FILL_VALUES
+
+# Form fields the prediction is keyed on, and the coarser keys tried when there is no exact match
+PREDICTION_KEYS = ["driver_gender", "driver_age", "search_conducted", "stop_duration", "drugs_related_stop"]
+BACKOFF_LEVELS = [
+    PREDICTION_KEYS,
+    ["driver_gender", "search_conducted", "stop_duration", "drugs_related_stop"],
+    ["search_conducted", "drugs_related_stop"],
+    ["drugs_related_stop"],
+    [],
+]
+TARGETS = ["stop_outcome", "violation"]
+
+# The notebook's fill values ("unknown") say nothing about a stop, so they are never counted as an outcome,
+# violation or duration; otherwise logs recorded without them would teach the index to predict "unknown"
+PLACEHOLDERS = {column: FILL_VALUES[column] for column in TARGETS + ["stop_duration"]}
+
+# Used only when the table is empty
+DEFAULT_PREDICTION = {"stop_outcome": "warning", "violation": "speeding"}
+
+_GROUPED = PREDICTION_KEYS + TARGETS
+
+# Counts of every outcome and violation for every backoff key, in one grouped query
+PREDICTOR_INDEX_QUERY = f"""SELECT {", ".join(_GROUPED)},
+    GROUPING({", ".join(_GROUPED)}) AS grouping_id,
+    COUNT(*) AS total
+    FROM "Policelog"
+    GROUP BY GROUPING SETS ({", ".join(
+        "(" + ", ".join(level + [target]) + ")" for level in BACKOFF_LEVELS for target in TARGETS
+    )});"""
+
+
+def _grouped_columns(grouping_id):
+    return [column for position, column in enumerate(_GROUPED) if not grouping_id >> (len(_GROUPED) - 1 - position) & 1]
+
+
+# Lookup table from the form's 5-tuple (and its backoff keys) to the modal stop outcome and violation.
+# Keeps full counters so new logs update the modes in O(1); ties go to the smallest value, like Series.mode()[0].
+class PredictorIndex:
+    def __init__(self):
+        self._levels = [{} for _ in BACKOFF_LEVELS]    # key tuple -> {target: [Counter, best value, best count]}
+        self._durations = set()
+        self._lock = threading.Lock()
+        self.built_version = None
+        self.built_at = None
+
+    def _entry(self, level, key):
+        entries = self._levels[level]
+        if key not in entries:
+            entries[key] = {target: [Counter(), None, 0] for target in TARGETS}
+        return entries[key]
+
+    def _count(self, level, key, target, value, amount):
+        slot = self._entry(level, key)[target]
+        counter = slot[0]
+        counter[value] += amount
+        count = counter[value]
+        if count > slot[2] or (count == slot[2] and value < slot[1]):
+            slot[1], slot[2] = value, count
+
+    # Replace the contents with the result of PREDICTOR_INDEX_QUERY
+    def load(self, columns, rows, version=None):
+        levels = [{} for _ in BACKOFF_LEVELS]
+        durations = set()
+        position = {column: index for index, column in enumerate(columns)}
+        level_of = {tuple(level): index for index, level in enumerate(BACKOFF_LEVELS)}
+        for row in rows:
+            grouped = _grouped_columns(row[position["grouping_id"]])
+            target = grouped[-1]
+            value = row[position[target]]
+            if value is None or value == PLACEHOLDERS[target]:
+                continue
+            level = level_of[tuple(grouped[:-1])]
+            key = tuple(row[position[column]] for column in grouped[:-1])
+            entry = levels[level].setdefault(key, {name: [Counter(), None, 0] for name in TARGETS})
+            entry[target][0][value] += row[position["total"]]
+            duration = key[PREDICTION_KEYS.index("stop_duration")] if level == 0 else None
+            if duration is not None and duration != PLACEHOLDERS["stop_duration"]:
+                durations.add(duration)
+        for entries in levels:
+            for entry in entries.values():
+                for slot in entry.values():
+                    if slot[0]:
+                        slot[1], slot[2] = min(slot[0].items(), key=lambda item: (-item[1], item[0]))
+        with self._lock:
+            self._levels = levels
+            self._durations = durations
+            self.built_version = version
+            self.built_at = time.monotonic()
+
+    # Only the first build reads the table; afterwards new logs are folded in with add() as they are written,
+    # and a full rebuild is left to an explicit refresh
+    def needs_refresh(self):
+        return self.built_at is None
+
+    # Fold one new log (a dict with the prediction keys and targets) into every level
+    def add(self, log):
+        with self._lock:
+            for level, columns in enumerate(BACKOFF_LEVELS):
+                key = tuple(log.get(column) for column in columns)
+                for target in TARGETS:
+                    if log.get(target) is not None and log[target] != PLACEHOLDERS[target]:
+                        self._count(level, key, target, log[target], 1)
+            if log.get("stop_duration") is not None and log["stop_duration"] != PLACEHOLDERS["stop_duration"]:
+                self._durations.add(log["stop_duration"])
+
+    def add_many(self, logs):
+        for log in logs:
+            self.add(log)
+
+    def durations(self):
+        with self._lock:
+            return sorted(self._durations)
+
+    # Every outcome or violation seen, for the new-log form
+    def values(self, target):
+        with self._lock:
+            entry = self._levels[-1].get(())
+            return sorted(entry[target][0]) if entry is not None else []
+
+    # Modal outcome and violation for the most specific key that has data, with the counts behind them
+    def predict(self, driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop):
+        values = dict(zip(PREDICTION_KEYS, [driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop]))
+        prediction = {}
+        with self._lock:
+            for target in TARGETS:
+                prediction[target] = {"value": DEFAULT_PREDICTION[target], "count": 0, "matches": 0, "matched_on": None}
+                for level, columns in enumerate(BACKOFF_LEVELS):
+                    entry = self._levels[level].get(tuple(values[column] for column in columns))
+                    if entry is not None and entry[target][1] is not None:
+                        counter, best, count = entry[target]
+                        prediction[target] = {
+                            "value": best,
+                            "count": count,
+                            "matches": sum(counter.values()),
+                            "matched_on": columns,
+                        }
+                        break
+        return prediction
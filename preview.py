@@ -0,0 +1,101 @@
+import pandas as pd
+from psycopg2 import sql
+
+# Page sizes offered in the overview, and the columns it can be sorted or filtered on
+PAGE_SIZES = [25, 50, 100, 250]
+SORT_COLUMNS = [
+    "timestamp", "country_name", "driver_gender", "driver_age", "driver_race", "violation",
+    "stop_outcome", "stop_duration", "vehicle_number",
+]
+TEXT_FILTER_COLUMNS = ["country_name", "driver_gender", "driver_race", "violation", "stop_outcome", "stop_duration", "search_type", "vehicle_number"]
+FLAG_FILTER_COLUMNS = ["search_conducted", "is_arrested", "drugs_related_stop"]
+
+# Row id used to break ties between rows with the same sort value: the physical ctid, or the id column once
+# schema.py has added one (ctid is only unique within one partition of a partitioned table)
+ROW_KEY = "_row_key"
+KEY_COLUMNS = ["ctid", "id"]
+
+
+def _filter_conditions(filters, date_range=None):
+    conditions, params = [], []
+    start, end = date_range or (None, None)
+    if start is not None:
+        conditions.append(sql.SQL("timestamp >= %s"))
+        params.append(start)
+    if end is not None:
+        conditions.append(sql.SQL("timestamp < %s"))
+        params.append(end)
+    for column, value in (filters or {}).items():
+        if column in TEXT_FILTER_COLUMNS:
+            conditions.append(sql.SQL("{} ILIKE %s").format(sql.Identifier(column)))
+            params.append(f"%{value}%")
+        elif column in FLAG_FILTER_COLUMNS:
+            conditions.append(sql.SQL("{} = %s").format(sql.Identifier(column)))
+            params.append(bool(value))
+        else:
+            raise ValueError(f"Column cannot be filtered: {column}")
+    return conditions, params
+
+
+# Keyset condition for "rows after (value, row key)" in ORDER BY column [DESC] NULLS LAST, row key
+def _after_condition(column, descending, after, key_column="ctid"):
+    value, row_key = after
+    column = sql.Identifier(column)
+    key = sql.SQL("ctid > %s::tid" if key_column == "ctid" else "id > %s")
+    if value is None:
+        return sql.SQL("({col} IS NULL AND {key})").format(col=column, key=key), [row_key]
+    beyond = sql.SQL("<" if descending else ">")
+    condition = sql.SQL("({col} {beyond} %s OR ({col} = %s AND {key}) OR {col} IS NULL)").format(
+        col=column, beyond=beyond, key=key
+    )
+    return condition, [value, value, row_key]
+
+
+# Build the query for one page of the overview. Only page_size + 1 rows are fetched (the extra row tells
+# whether there is a next page), and the position is carried by the last row's key instead of an OFFSET.
+# date_range is a (start, end) pair of stop timestamps, end exclusive, either side may be None.
+def build_page_query(sort_column="timestamp", descending=False, filters=None, page_size=PAGE_SIZES[0], after=None,
+                     date_range=None, key_column="ctid"):
+    if sort_column not in SORT_COLUMNS:
+        raise ValueError(f"Column cannot be sorted on: {sort_column}")
+    if key_column not in KEY_COLUMNS:
+        raise ValueError(f"Unknown row key: {key_column}")
+    conditions, params = _filter_conditions(filters, date_range)
+    if after is not None:
+        condition, after_params = _after_condition(sort_column, descending, after, key_column)
+        conditions.append(condition)
+        params.extend(after_params)
+    where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    query = sql.SQL(
+        'SELECT *, {key}::text AS {row_key} FROM "Policelog" {where} ORDER BY {col} {direction} NULLS LAST, {key} LIMIT %s'
+    ).format(
+        key=sql.SQL(key_column),
+        row_key=sql.Identifier(ROW_KEY),
+        where=where,
+        col=sql.Identifier(sort_column),
+        direction=sql.SQL("DESC" if descending else "ASC"),
+    )
+    params.append(page_size + 1)
+    return query, params
+
+
+# Turn a pandas/numpy cell back into a plain Python value psycopg2 can adapt
+def _plain(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):    # numpy scalars
+        return value.item()
+    return value
+
+
+# Split a fetched page into the visible rows and the key to continue after (None on the last page)
+def split_page(page, sort_column, page_size):
+    has_next = len(page) > page_size
+    page = page.iloc[:page_size]
+    next_key = None
+    if has_next:
+        last = page.iloc[-1]
+        next_key = (_plain(last[sort_column]), last[ROW_KEY])
+    return page.drop(columns=[ROW_KEY], errors="ignore"), next_key
@@ -0,0 +1,223 @@
+import re
+
+# Canned analytics shown under "Project Queries", keyed by the title shown in the dropdown
+query_map = {
+    "Top 10 vehicle_Number involved in drug-related stops": """select vehicle_number, count(*) as drug_stop_count from "Policelog" 
+    where drugs_related_stop = true and vehicle_number is not null 
+    group by vehicle_number 
+    order by drug_stop_count desc limit 10;""",
+    "Most frequently searched vehicles": """select vehicle_number, count(*) as search_count from "Policelog" 
+    where search_conducted = true and vehicle_number is not null 
+    group by vehicle_number 
+    order by search_count desc limit 10;""",
+    "Highest arrest rate according to driver age group": """select age_group, count (*) as total_stops, 
+    sum(case when is_arrested = true then 1 else 0 end) as total_arrests, 
+    round(100.0*sum(case when is_arrested = true then 1 else 0 end)/count(*),2) as arrest_rate 
+    from (select *,case 
+    when driver_age<18 then 'under 18'
+    when driver_age between 18 and 25 then '18-25'
+    when driver_age between 26 and 40 then '26-40'
+    when driver_age between 41 and 60 then '41-60'
+    when driver_age between 61 and 80 then '61-80'
+    else 'unknown' end as age_group
+    from "Policelog"
+    where driver_age is not null
+    )as grouped_data group by age_group 
+    order by arrest_rate desc limit 1;""",
+    "Gender distribution of drivers stopped in each country": """select country_name,
+    sum(case when driver_gender = 'M' then 1 else 0 end) as Male_count,
+    sum(case when driver_gender = 'F' then 1 else 0 end) as Female_count from "Policelog" 
+    where driver_gender is not null group by country_name""",
+    "Race and gender combination having the highest search rate": """SELECT driver_race, driver_gender,COUNT(*) AS total_stops, 
+    SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS total_searches,
+    ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*),2) AS search_rate_percent
+    FROM "Policelog" WHERE driver_race IS NOT NULL AND driver_gender IS NOT NULL
+    GROUP BY driver_race, driver_gender 
+    ORDER BY search_rate_percent DESC LIMIT 1;""",
+    "Time of day sees the most traffic stops": """SELECT EXTRACT(HOUR FROM timestamp) AS stop_hour,
+    COUNT(*) AS total_stops FROM "Policelog"
+    WHERE timestamp IS NOT NULL
+    GROUP BY stop_hour ORDER BY total_stops DESC LIMIT 1;""",
+    "Average stop duration for different violations": """SELECT violation, ROUND(AVG(CASE 
+    WHEN stop_duration = '0-15 Min' THEN 7.5
+    WHEN stop_duration = '16-30 Min' THEN 23
+    WHEN stop_duration = '30+ Min' THEN 35
+    ELSE NULL END), 2) AS avg_stop_duration_minutes
+    FROM "Policelog"
+    WHERE stop_duration IS NOT NULL AND violation IS NOT NULL
+    GROUP BY violation ORDER BY avg_stop_duration_minutes DESC;""",
+    "Are stops during the night more likely to lead to arrests": """WITH time_classified AS (SELECT *,
+    CASE WHEN EXTRACT(HOUR FROM timestamp) BETWEEN 6 AND 17 THEN 'Day'
+    ELSE 'Night' END AS time_of_day
+    FROM "Policelog" WHERE timestamp IS NOT NULL),
+    arrest_summary AS (SELECT time_of_day,COUNT(*) AS total_stops,
+    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
+    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
+    FROM time_classified GROUP BY time_of_day)
+    SELECT * FROM arrest_summary
+    ORDER BY time_of_day;
+    ""","Violations that are most associated with searches or arrests": """SELECT violation, COUNT(*) AS total_stops,
+    SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS total_searches,
+    ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS search_rate_percent,
+    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
+    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
+    FROM "Policelog" WHERE violation IS NOT NULL GROUP BY violation
+    ORDER BY total_searches DESC, total_arrests DESC;""",
+    "Violations are most common among younger drivers (<25)": """SELECT violation,COUNT(*) AS stop_count FROM "Policelog"
+    WHERE driver_age < 25 AND violation IS NOT NULL GROUP BY violation ORDER BY stop_count DESC;""",
+    "Violation that rarely results in search or arrest": """SELECT violation,COUNT(*) AS total_stops,
+    COUNT(CASE WHEN search_conducted = TRUE OR is_arrested = TRUE THEN 1 END) AS stops_with_search_or_arrest,
+    (CAST(COUNT(CASE WHEN search_conducted = TRUE OR is_arrested = TRUE THEN 1 END) AS NUMERIC) * 100.0 / COUNT(*)) AS search_or_arrest_percentage
+    FROM "Policelog" GROUP BY violation
+    HAVING COUNT(*) > 0
+    ORDER BY search_or_arrest_percentage ASC,
+    total_stops DESC LIMIT 1;""",
+    "Countries report the highest rate of drug-related stop": """SELECT country_name,
+    COUNT(*) AS total_stops,
+    COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS drug_related_stops,
+    (CAST(COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS NUMERIC) * 100.0 / COUNT(*)) AS drug_related_percentage
+    FROM "Policelog"
+    WHERE country_name IS NOT NULL
+    GROUP BY country_name
+    HAVING COUNT(*) > 0
+    ORDER BY drug_related_percentage DESC limit 1;""",
+    "Arrest rate by country and violation": """SELECT country_name,violation,COUNT(*) AS total_stops,
+    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
+    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
+    FROM "Policelog" WHERE country_name IS NOT NULL AND violation IS NOT NULL
+    GROUP BY country_name, violation
+    ORDER BY arrest_rate_percent DESC;""",
+    "Country having the most stops with search conducted": """SELECT country_name,COUNT(*) AS total_stops_with_search
+    FROM "Policelog"
+    WHERE search_conducted = TRUE AND country_name IS NOT NULL
+    GROUP BY country_name
+    ORDER BY total_stops_with_search DESC
+    LIMIT 1;""",
+    "Yearly Breakdown of Stops and Arrests by Country": """SELECT year,country_name,total_stops,total_arrests,
+    ROUND(100.0 * total_arrests / total_stops, 2) AS arrest_rate_percent,
+    RANK() OVER (PARTITION BY year ORDER BY total_arrests DESC) AS country_rank_by_arrests
+    FROM (SELECT EXTRACT(YEAR FROM timestamp) AS year,
+        country_name,
+        COUNT(*) AS total_stops,
+        SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests
+    FROM "Policelog"
+    WHERE timestamp IS NOT NULL AND country_name IS NOT NULL
+    GROUP BY EXTRACT(YEAR FROM timestamp), country_name
+    ) AS yearly_stats
+    ORDER BY year, country_rank_by_arrests;""",
+    "Driver Violation Trends Based on Age and Race": """WITH age_grouped AS (SELECT driver_race,
+    CASE
+	WHEN driver_age IS NULL THEN 'Unknown'
+    WHEN driver_age < 18 THEN 'Under 18'
+    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+    WHEN driver_age > 60 THEN '60+'
+    ELSE 'Unknown' END AS age_group,
+    violation,COUNT(*) AS violation_count FROM "Policelog"
+    WHERE driver_race IS NOT NULL AND violation IS NOT NULL
+    GROUP BY driver_race, age_group, violation),
+    top_violations AS (SELECT driver_race,age_group,violation,violation_count,
+    RANK() OVER (PARTITION BY driver_race, age_group ORDER BY violation_count DESC) AS rank
+    FROM age_grouped)
+    SELECT 
+    t.driver_race,
+    t.age_group,
+    t.violation,
+    t.violation_count,
+    totals.total_stops
+    FROM top_violations t
+    JOIN (
+    SELECT driver_race,
+    CASE
+    WHEN driver_age IS NULL THEN 'Unknown'
+    WHEN driver_age < 18 THEN 'Under 18'
+    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+    WHEN driver_age > 60 THEN '60+'
+    ELSE 'Unknown'
+    END AS age_group,
+    COUNT(*) AS total_stops
+    FROM "Policelog"
+    WHERE driver_race IS NOT NULL
+    GROUP BY driver_race, age_group
+    ) totals
+    ON t.driver_race = totals.driver_race AND t.age_group = totals.age_group
+    WHERE t.rank = 1
+    ORDER BY t.driver_race, t.age_group;""",
+    "Time Period Analysis of Stops, Number of Stops by Year,Month, Hour of the Day": """SELECT
+    EXTRACT(YEAR FROM timestamp) AS stop_year,
+    EXTRACT(MONTH FROM timestamp) AS stop_month,
+    EXTRACT(HOUR FROM timestamp) AS stop_hour,
+    COUNT(*) AS total_stops
+    FROM "Policelog"
+    WHERE timestamp IS NOT NULL
+    GROUP BY stop_year, stop_month, stop_hour
+    ORDER BY stop_year, stop_month, stop_hour;""",
+    "Violations with High Search and Arrest Rates": """WITH violation_stats AS (
+    SELECT violation,COUNT(*) AS total_stops,SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS search_count,
+        SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS arrest_count,
+        ROUND(100.0 * SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS search_rate_percent,
+        ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
+    FROM "Policelog" WHERE violation IS NOT NULL GROUP BY violation),
+    ranked_violations AS (
+    SELECT *,RANK() OVER (ORDER BY search_rate_percent DESC) AS search_rank,
+    RANK() OVER (ORDER BY arrest_rate_percent DESC) AS arrest_rank
+    FROM violation_stats)
+    SELECT violation,total_stops,search_count,search_rate_percent,search_rank,arrest_count,arrest_rate_percent,arrest_rank
+    FROM ranked_violations
+    WHERE search_rank <= 5 OR arrest_rank <= 5
+    ORDER BY search_rank, arrest_rank;""",
+    "Driver Demographics by Country": """WITH driver_data AS (
+    SELECT country_name,driver_gender,driver_race,
+    CASE
+    WHEN driver_age IS NULL THEN 'Unknown'
+    WHEN driver_age < 18 THEN 'Under 18'
+    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+    WHEN driver_age > 60 THEN '60+'
+    ELSE 'Unknown' END AS age_group
+    FROM "Policelog"
+    WHERE country_name IS NOT NULL
+        AND driver_gender IS NOT NULL
+        AND driver_race IS NOT NULL
+        AND driver_age IS NOT NULL)
+    SELECT country_name,age_group,driver_gender,driver_race,
+    COUNT(*) AS total_stops
+    FROM driver_data
+    GROUP BY country_name, age_group, driver_gender, driver_race
+    ORDER BY country_name, age_group, driver_gender, driver_race;""",
+    "Top 5 Violations with Highest Arrest Rates": """WITH violation_stats AS (
+    SELECT violation,COUNT(*) AS total_stops,
+    SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests,
+    ROUND(100.0 * SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) / COUNT(*), 2) AS arrest_rate_percent
+    FROM "Policelog" WHERE violation IS NOT NULL
+    GROUP BY violation)
+    SELECT violation,total_stops,total_arrests,arrest_rate_percent
+    FROM violation_stats
+    ORDER BY arrest_rate_percent DESC
+    LIMIT 5;"""
+}
+
+_FROM_POLICELOG = re.compile(r'\bFROM\s+"Policelog"', re.IGNORECASE)
+
+
+# Run a query over "Policelog" on another row source (a subquery, a sample table) aliased as "Policelog"
+def with_source(query, source):
+    return _FROM_POLICELOG.sub(lambda match: f'FROM {source} AS "Policelog"', query)
+
+
+# Restrict a query over "Policelog" to stops in [start, end). Every FROM "Policelog" is swapped for a subquery
+# with a plain range predicate on timestamp, the partition key, so Postgres prunes the months outside the range
+# (EXTRACT(...) expressions on timestamp cannot be used for pruning).
+def in_date_range(query, start=None, end=None):
+    conditions = []
+    if start is not None:
+        conditions.append(f"timestamp >= '{start.isoformat()}'::timestamp")
+    if end is not None:
+        conditions.append(f"timestamp < '{end.isoformat()}'::timestamp")
+    if not conditions:
+        return query
+    return with_source(query, f'(SELECT * FROM "Policelog" WHERE {" AND ".join(conditions)})')
@@ -0,0 +1,144 @@
+import html
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db import fetch_frame_on
+
+# Worker threads used for a report run, and the per-query statement timeout in seconds
+REPORT_WORKERS = 4
+QUERY_TIMEOUT = 60.0
+
+
+class ReportResult:
+    def __init__(self, title, frame=None, error=None, seconds=0.0, cached=False):
+        self.title = title
+        self.frame = frame
+        self.error = error
+        self.seconds = seconds
+        self.cached = cached
+
+
+# Runs a set of canned queries concurrently on pooled connections. Each query gets a server-side
+# statement_timeout, and cancel() stops queued queries and interrupts the ones in flight.
+# With a runner (a function of the SQL returning its DataFrame, e.g. the snapshot engine's query) the queries
+# are run by it instead of Postgres, without timeout or caching.
+class ReportRun:
+    def __init__(self, pool, queries, workers=REPORT_WORKERS, timeout=QUERY_TIMEOUT, cache=None, version=None, profiler=None,
+                 runner=None):
+        self.pool = pool
+        self.queries = queries    # title -> SQL
+        self.workers = max(1, min(workers, pool.maxconn, len(queries) or 1))
+        self.timeout = timeout
+        self.cache = cache
+        self.version = version
+        self.profiler = profiler
+        self.runner = runner
+        self._cancelled = threading.Event()
+        self._active = {}    # title -> connection currently running it
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()    # queued queries see this and return straight away
+        with self._lock:    # held so a connection cannot be handed back to the pool while it is being cancelled
+            for conn in self._active.values():
+                try:
+                    conn.cancel()    # asks the server to abort the statement running on that connection
+                except Exception:
+                    pass
+
+    def _run_one(self, title, query):
+        if self.cancelled:
+            return ReportResult(title, error="Cancelled")
+        started = time.perf_counter()
+        if self.runner is not None:
+            try:
+                return ReportResult(title, self.runner(query), seconds=time.perf_counter() - started)
+            except Exception as e:
+                return ReportResult(title, error=str(e).strip(), seconds=time.perf_counter() - started)
+        key = self.cache.key(query, version=self.version) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if self.profiler is not None:
+                    self.profiler.record_cache_hit(title)
+                return ReportResult(title, cached, seconds=time.perf_counter() - started, cached=True)
+
+        try:
+            conn = self.pool.getconn()
+        except Exception as e:
+            return ReportResult(title, error=str(e), seconds=time.perf_counter() - started)
+        timings = {"connect": time.perf_counter() - started}
+        with self._lock:
+            self._active[title] = conn
+        try:
+            if self.cancelled:
+                return ReportResult(title, error="Cancelled")
+            with conn.cursor() as cursor:
+                cursor.execute("SET statement_timeout = %s", (int(self.timeout * 1000),))
+            frame = fetch_frame_on(conn, query, timings=timings)
+            if key is not None and not frame.empty:
+                self.cache.put(key, frame)
+            if self.profiler is not None:
+                self.profiler.record(title, query, timings)
+            return ReportResult(title, frame, seconds=time.perf_counter() - started)
+        except Exception as e:
+            error = "Cancelled" if self.cancelled else str(e).strip()
+            if self.profiler is not None and not self.cancelled:
+                timings.setdefault("execute", time.perf_counter() - started - timings["connect"])
+                self.profiler.record(title, query, timings, error=error)
+            return ReportResult(title, error=error, seconds=time.perf_counter() - started)
+        finally:
+            with self._lock:
+                self._active.pop(title, None)
+            try:
+                if not conn.closed:
+                    with conn.cursor() as cursor:
+                        cursor.execute("RESET statement_timeout")
+            except Exception:
+                pass
+            self.pool.putconn(conn)
+
+    # Yield a ReportResult for every query as soon as it finishes; anything still running is cancelled
+    # if the caller stops early (e.g. a Streamlit rerun interrupts the page).
+    def results(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report")
+        futures = [executor.submit(self._run_one, title, query) for title, query in self.queries.items()]
+        finished = False
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+            finished = True
+        finally:
+            if not finished:
+                self.cancel()
+            executor.shutdown(wait=False)
+
+
+# A single self-contained HTML document with every result of a run, in the order they were requested
+def build_report(results, order):
+    by_title = {result.title: result for result in results}
+    sections = []
+    for title in order:
+        result = by_title.get(title)
+        if result is None:
+            body = "<p><em>Not run</em></p>"
+        elif result.error:
+            body = f"<p><strong>Error:</strong> {html.escape(result.error)}</p>"
+        else:
+            body = f"<p>{len(result.frame)} rows in {result.seconds:.2f}s</p>" + result.frame.to_html(index=False, border=0)
+        sections.append(f"<h2>{html.escape(title)}</h2>\n{body}")
+    generated = time.strftime("%Y-%m-%d %H:%M:%S")
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Securecheck analytics report</title>
+<style>body{{font-family:sans-serif}} table{{border-collapse:collapse}} td,th{{padding:2px 8px;border:1px solid #ccc}}</style>
+</head><body>
+<h1>Securecheck analytics report</h1>
+<p>Generated {generated}</p>
+{chr(10).join(sections)}
+</body></html>
+"""
@@ -0,0 +1,386 @@
+import argparse
+
+import pandas as pd
+
+from db import connect
+from queries import query_map
+
+# Summary tables kept up to date by statement-level triggers on "Policelog".
+# Two grains keep them small: driver/violation attributes (exact driver_age, so both age-group ladders and the
+# "<25" filter can be derived) and time buckets (year/month/hour per country).
+DRIVER_KEYS = ["country_name", "violation", "driver_gender", "driver_race", "driver_age"]
+TIME_KEYS = ["stop_year", "stop_month", "stop_hour", "country_name"]
+
+DURATION_MINUTES = "CASE stop_duration WHEN '0-15 Min' THEN 7.5 WHEN '16-30 Min' THEN 23 WHEN '30+ Min' THEN 35 END"
+
+# Measure column -> aggregate over "Policelog" rows
+DRIVER_MEASURES = {
+    "stops": "COUNT(*)",
+    "searches": "COUNT(*) FILTER (WHERE search_conducted)",
+    "arrests": "COUNT(*) FILTER (WHERE is_arrested)",
+    "drug_stops": "COUNT(*) FILTER (WHERE drugs_related_stop)",
+    "searches_or_arrests": "COUNT(*) FILTER (WHERE search_conducted OR is_arrested)",
+    "duration_stops": "COUNT(stop_duration)",    # stops with any stop_duration
+    "duration_mapped": f"COUNT({DURATION_MINUTES})",    # stops whose duration maps to minutes
+    "duration_minutes": f"COALESCE(SUM({DURATION_MINUTES}), 0)",
+}
+TIME_MEASURES = {
+    "stops": "COUNT(*)",
+    "arrests": "COUNT(*) FILTER (WHERE is_arrested)",
+}
+TIME_KEY_EXPRESSIONS = {
+    "stop_year": "EXTRACT(YEAR FROM timestamp)",
+    "stop_month": "EXTRACT(MONTH FROM timestamp)",
+    "stop_hour": "EXTRACT(HOUR FROM timestamp)",
+    "country_name": "country_name",
+}
+
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS policelog_rollup_driver (
+    country_name text,
+    violation text,
+    driver_gender text,
+    driver_race text,
+    driver_age numeric,
+    stops bigint NOT NULL,
+    searches bigint NOT NULL,
+    arrests bigint NOT NULL,
+    drug_stops bigint NOT NULL,
+    searches_or_arrests bigint NOT NULL,
+    duration_stops bigint NOT NULL,
+    duration_mapped bigint NOT NULL,
+    duration_minutes numeric NOT NULL,
+    UNIQUE NULLS NOT DISTINCT (country_name, violation, driver_gender, driver_race, driver_age)
+);
+CREATE TABLE IF NOT EXISTS policelog_rollup_time (
+    stop_year numeric NOT NULL,
+    stop_month numeric NOT NULL,
+    stop_hour numeric NOT NULL,
+    country_name text,
+    stops bigint NOT NULL,
+    arrests bigint NOT NULL,
+    UNIQUE NULLS NOT DISTINCT (stop_year, stop_month, stop_hour, country_name)
+);
+"""
+
+
+# INSERT ... SELECT that folds the rows of `source` into a rollup table, added (sign 1) or subtracted (sign -1)
+def _fold_sql(table, keys, key_expressions, measures, source, sign, where=""):
+    select_keys = ", ".join(f"{key_expressions.get(key, key)} AS {key}" for key in keys)
+    select_measures = ", ".join(f"{sign} * {expression}" for expression in measures.values())
+    updates = ", ".join(f"{column} = r.{column} + EXCLUDED.{column}" for column in measures)
+    return f"""INSERT INTO {table} AS r ({", ".join(keys)}, {", ".join(measures)})
+        SELECT {select_keys}, {select_measures} FROM {source} {where}
+        GROUP BY {", ".join(str(position) for position in range(1, len(keys) + 1))}
+        ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates};"""
+
+
+def _fold_all(source, sign):
+    return "\n".join([
+        _fold_sql("policelog_rollup_driver", DRIVER_KEYS, {}, DRIVER_MEASURES, source, sign),
+        _fold_sql("policelog_rollup_time", TIME_KEYS, TIME_KEY_EXPRESSIONS, TIME_MEASURES, source, sign,
+                  "WHERE timestamp IS NOT NULL"),
+    ])
+
+
+# Take the rows of `source` out of the rollups, e.g. a partition that is about to be detached from "Policelog"
+def remove_rows_sql(source):
+    return "\n".join([
+        _fold_all(source, -1),
+        "DELETE FROM policelog_rollup_driver WHERE stops = 0;",
+        "DELETE FROM policelog_rollup_time WHERE stops = 0;",
+    ])
+
+
+TRIGGERS_SQL = f"""
+CREATE OR REPLACE FUNCTION policelog_rollup_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        {_fold_all("old_rows", -1)}
+        DELETE FROM policelog_rollup_driver WHERE stops = 0;
+        DELETE FROM policelog_rollup_time WHERE stops = 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {_fold_all("new_rows", 1)}
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_rollup_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE policelog_rollup_driver, policelog_rollup_time;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER policelog_rollup_insert AFTER INSERT ON "Policelog"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_rollup_apply();
+CREATE OR REPLACE TRIGGER policelog_rollup_update AFTER UPDATE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_rollup_apply();
+CREATE OR REPLACE TRIGGER policelog_rollup_delete AFTER DELETE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_rollup_apply();
+CREATE OR REPLACE TRIGGER policelog_rollup_truncate AFTER TRUNCATE ON "Policelog"
+    FOR EACH STATEMENT EXECUTE FUNCTION policelog_rollup_truncate();
+"""
+
+REBUILD_SQL = f"""
+LOCK TABLE "Policelog" IN SHARE MODE;
+TRUNCATE policelog_rollup_driver, policelog_rollup_time;
+{_fold_all('"Policelog"', 1)}
+"""
+
+READY_QUERY = """SELECT COUNT(*) = 4 FROM pg_trigger
+    WHERE tgrelid = to_regclass('"Policelog"') AND tgname LIKE 'policelog_rollup_%';"""
+
+# Age-group ladders used by the canned queries, applied to the exact driver_age kept in the rollup
+AGE_GROUP_18_80 = """case
+    when driver_age<18 then 'under 18'
+    when driver_age between 18 and 25 then '18-25'
+    when driver_age between 26 and 40 then '26-40'
+    when driver_age between 41 and 60 then '41-60'
+    when driver_age between 61 and 80 then '61-80'
+    else 'unknown' end"""
+AGE_GROUP_60_PLUS = """CASE
+    WHEN driver_age IS NULL THEN 'Unknown'
+    WHEN driver_age < 18 THEN 'Under 18'
+    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+    WHEN driver_age > 60 THEN '60+'
+    ELSE 'Unknown' END"""
+
+# query_map entries answered from the rollups; each returns the same columns, types and rows as the original
+ROLLUP_QUERIES = {
+    "Highest arrest rate according to driver age group": f"""select age_group, sum(stops)::bigint as total_stops,
+    sum(arrests)::bigint as total_arrests,
+    round(100.0*sum(arrests)/sum(stops),2) as arrest_rate
+    from (select *,{AGE_GROUP_18_80} as age_group
+    from policelog_rollup_driver
+    where driver_age is not null
+    )as grouped_data group by age_group
+    order by arrest_rate desc limit 1;""",
+    "Gender distribution of drivers stopped in each country": """select country_name,
+    sum(case when driver_gender = 'M' then stops else 0 end)::bigint as Male_count,
+    sum(case when driver_gender = 'F' then stops else 0 end)::bigint as Female_count from policelog_rollup_driver
+    where driver_gender is not null group by country_name""",
+    "Race and gender combination having the highest search rate": """SELECT driver_race, driver_gender, SUM(stops)::bigint AS total_stops,
+    SUM(searches)::bigint AS total_searches,
+    ROUND(100.0 * SUM(searches) / SUM(stops),2) AS search_rate_percent
+    FROM policelog_rollup_driver WHERE driver_race IS NOT NULL AND driver_gender IS NOT NULL
+    GROUP BY driver_race, driver_gender
+    ORDER BY search_rate_percent DESC LIMIT 1;""",
+    "Time of day sees the most traffic stops": """SELECT stop_hour, SUM(stops)::bigint AS total_stops
+    FROM policelog_rollup_time
+    GROUP BY stop_hour ORDER BY total_stops DESC LIMIT 1;""",
+    "Average stop duration for different violations": """SELECT violation,
+    ROUND(SUM(duration_minutes) / NULLIF(SUM(duration_mapped), 0), 2) AS avg_stop_duration_minutes
+    FROM policelog_rollup_driver
+    WHERE violation IS NOT NULL
+    GROUP BY violation HAVING SUM(duration_stops) > 0
+    ORDER BY avg_stop_duration_minutes DESC;""",
+    "Are stops during the night more likely to lead to arrests": """WITH arrest_summary AS (SELECT
+    CASE WHEN stop_hour BETWEEN 6 AND 17 THEN 'Day' ELSE 'Night' END AS time_of_day,
+    SUM(stops)::bigint AS total_stops,
+    SUM(arrests)::bigint AS total_arrests,
+    ROUND(100.0 * SUM(arrests) / SUM(stops), 2) AS arrest_rate_percent
+    FROM policelog_rollup_time GROUP BY 1)
+    SELECT * FROM arrest_summary
+    ORDER BY time_of_day;""",
+    "Violations that are most associated with searches or arrests": """SELECT violation, SUM(stops)::bigint AS total_stops,
+    SUM(searches)::bigint AS total_searches,
+    ROUND(100.0 * SUM(searches) / SUM(stops), 2) AS search_rate_percent,
+    SUM(arrests)::bigint AS total_arrests,
+    ROUND(100.0 * SUM(arrests) / SUM(stops), 2) AS arrest_rate_percent
+    FROM policelog_rollup_driver WHERE violation IS NOT NULL GROUP BY violation
+    ORDER BY total_searches DESC, total_arrests DESC;""",
+    "Violations are most common among younger drivers (<25)": """SELECT violation, SUM(stops)::bigint AS stop_count
+    FROM policelog_rollup_driver
+    WHERE driver_age < 25 AND violation IS NOT NULL GROUP BY violation ORDER BY stop_count DESC;""",
+    "Violation that rarely results in search or arrest": """SELECT violation, SUM(stops)::bigint AS total_stops,
+    SUM(searches_or_arrests)::bigint AS stops_with_search_or_arrest,
+    (CAST(SUM(searches_or_arrests) AS NUMERIC) * 100.0 / SUM(stops)) AS search_or_arrest_percentage
+    FROM policelog_rollup_driver GROUP BY violation
+    HAVING SUM(stops) > 0
+    ORDER BY search_or_arrest_percentage ASC,
+    total_stops DESC LIMIT 1;""",
+    "Countries report the highest rate of drug-related stop": """SELECT country_name,
+    SUM(stops)::bigint AS total_stops,
+    SUM(drug_stops)::bigint AS drug_related_stops,
+    (CAST(SUM(drug_stops) AS NUMERIC) * 100.0 / SUM(stops)) AS drug_related_percentage
+    FROM policelog_rollup_driver
+    WHERE country_name IS NOT NULL
+    GROUP BY country_name
+    HAVING SUM(stops) > 0
+    ORDER BY drug_related_percentage DESC limit 1;""",
+    "Arrest rate by country and violation": """SELECT country_name, violation, SUM(stops)::bigint AS total_stops,
+    SUM(arrests)::bigint AS total_arrests,
+    ROUND(100.0 * SUM(arrests) / SUM(stops), 2) AS arrest_rate_percent
+    FROM policelog_rollup_driver WHERE country_name IS NOT NULL AND violation IS NOT NULL
+    GROUP BY country_name, violation
+    ORDER BY arrest_rate_percent DESC;""",
+    "Country having the most stops with search conducted": """SELECT country_name, SUM(searches)::bigint AS total_stops_with_search
+    FROM policelog_rollup_driver
+    WHERE country_name IS NOT NULL
+    GROUP BY country_name
+    HAVING SUM(searches) > 0
+    ORDER BY total_stops_with_search DESC
+    LIMIT 1;""",
+    "Yearly Breakdown of Stops and Arrests by Country": """SELECT year,country_name,total_stops,total_arrests,
+    ROUND(100.0 * total_arrests / total_stops, 2) AS arrest_rate_percent,
+    RANK() OVER (PARTITION BY year ORDER BY total_arrests DESC) AS country_rank_by_arrests
+    FROM (SELECT stop_year AS year,
+        country_name,
+        SUM(stops)::bigint AS total_stops,
+        SUM(arrests)::bigint AS total_arrests
+    FROM policelog_rollup_time
+    WHERE country_name IS NOT NULL
+    GROUP BY stop_year, country_name
+    ) AS yearly_stats
+    ORDER BY year, country_rank_by_arrests;""",
+    "Driver Violation Trends Based on Age and Race": f"""WITH age_grouped AS (SELECT driver_race,
+    {AGE_GROUP_60_PLUS} AS age_group,
+    violation, SUM(stops)::bigint AS violation_count FROM policelog_rollup_driver
+    WHERE driver_race IS NOT NULL AND violation IS NOT NULL
+    GROUP BY driver_race, age_group, violation),
+    top_violations AS (SELECT driver_race,age_group,violation,violation_count,
+    RANK() OVER (PARTITION BY driver_race, age_group ORDER BY violation_count DESC) AS rank
+    FROM age_grouped)
+    SELECT
+    t.driver_race,
+    t.age_group,
+    t.violation,
+    t.violation_count,
+    totals.total_stops
+    FROM top_violations t
+    JOIN (
+    SELECT driver_race,
+    {AGE_GROUP_60_PLUS} AS age_group,
+    SUM(stops)::bigint AS total_stops
+    FROM policelog_rollup_driver
+    WHERE driver_race IS NOT NULL
+    GROUP BY driver_race, age_group
+    ) totals
+    ON t.driver_race = totals.driver_race AND t.age_group = totals.age_group
+    WHERE t.rank = 1
+    ORDER BY t.driver_race, t.age_group;""",
+    "Time Period Analysis of Stops, Number of Stops by Year,Month, Hour of the Day": """SELECT
+    stop_year,
+    stop_month,
+    stop_hour,
+    SUM(stops)::bigint AS total_stops
+    FROM policelog_rollup_time
+    GROUP BY stop_year, stop_month, stop_hour
+    ORDER BY stop_year, stop_month, stop_hour;""",
+    "Violations with High Search and Arrest Rates": """WITH violation_stats AS (
+    SELECT violation, SUM(stops)::bigint AS total_stops, SUM(searches)::bigint AS search_count,
+        SUM(arrests)::bigint AS arrest_count,
+        ROUND(100.0 * SUM(searches) / SUM(stops), 2) AS search_rate_percent,
+        ROUND(100.0 * SUM(arrests) / SUM(stops), 2) AS arrest_rate_percent
+    FROM policelog_rollup_driver WHERE violation IS NOT NULL GROUP BY violation),
+    ranked_violations AS (
+    SELECT *,RANK() OVER (ORDER BY search_rate_percent DESC) AS search_rank,
+    RANK() OVER (ORDER BY arrest_rate_percent DESC) AS arrest_rank
+    FROM violation_stats)
+    SELECT violation,total_stops,search_count,search_rate_percent,search_rank,arrest_count,arrest_rate_percent,arrest_rank
+    FROM ranked_violations
+    WHERE search_rank <= 5 OR arrest_rank <= 5
+    ORDER BY search_rank, arrest_rank;""",
+    "Driver Demographics by Country": f"""SELECT country_name,
+    {AGE_GROUP_60_PLUS} AS age_group,
+    driver_gender, driver_race,
+    SUM(stops)::bigint AS total_stops
+    FROM policelog_rollup_driver
+    WHERE country_name IS NOT NULL
+        AND driver_gender IS NOT NULL
+        AND driver_race IS NOT NULL
+        AND driver_age IS NOT NULL
+    GROUP BY country_name, age_group, driver_gender, driver_race
+    ORDER BY country_name, age_group, driver_gender, driver_race;""",
+    "Top 5 Violations with Highest Arrest Rates": """WITH violation_stats AS (
+    SELECT violation, SUM(stops)::bigint AS total_stops,
+    SUM(arrests)::bigint AS total_arrests,
+    ROUND(100.0 * SUM(arrests) / SUM(stops), 2) AS arrest_rate_percent
+    FROM policelog_rollup_driver WHERE violation IS NOT NULL
+    GROUP BY violation)
+    SELECT violation,total_stops,total_arrests,arrest_rate_percent
+    FROM violation_stats
+    ORDER BY arrest_rate_percent DESC
+    LIMIT 5;""",
+}
+
+
+# Create the rollup tables and triggers and fill them from the current table in one transaction
+def install(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(TABLES_SQL)
+            cursor.execute(TRIGGERS_SQL)
+            cursor.execute(REBUILD_SQL)
+
+
+# Recompute the rollups from scratch (e.g. after bulk edits made with the triggers disabled)
+def rebuild(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+
+
+def uninstall(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            for trigger in ["insert", "update", "delete", "truncate"]:
+                cursor.execute(f'DROP TRIGGER IF EXISTS policelog_rollup_{trigger} ON "Policelog";')
+            cursor.execute("DROP TABLE IF EXISTS policelog_rollup_driver, policelog_rollup_time;")
+
+
+def ready(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(READY_QUERY)
+        return bool(cursor.fetchone()[0])
+
+
+def _fetch(conn, query):
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        return pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+
+
+# Same rows; queries without a total ORDER BY may return them in any order
+def _same_rows(expected, actual):
+    if expected.equals(actual):
+        return True
+    if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+        return False
+    columns = list(expected.columns)
+    return expected.sort_values(columns).reset_index(drop=True).equals(actual.sort_values(columns).reset_index(drop=True))
+
+
+# Run every rollup query next to its original and report the ones whose results differ
+def verify(conn):
+    mismatches = []
+    for title, rollup_query in ROLLUP_QUERIES.items():
+        expected = _fetch(conn, query_map[title])
+        actual = _fetch(conn, rollup_query)
+        if not _same_rows(expected, actual):
+            mismatches.append(title)
+        print(f"{'ok      ' if title not in mismatches else 'MISMATCH'}  {title}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the incrementally maintained rollups of "Policelog"')
+    parser.add_argument("command", choices=["install", "rebuild", "verify", "uninstall"])
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        if args.command == "install":
+            install(connection)
+        elif args.command == "rebuild":
+            rebuild(connection)
+        elif args.command == "uninstall":
+            uninstall(connection)
+        else:
+            raise SystemExit(1 if verify(connection) else 0)
+        print(f"Rollups {args.command} done")
+    finally:
+        connection.close()
@@ -0,0 +1,323 @@
+import argparse
+import math
+import re
+
+import pandas as pd
+
+from aggregations import CHART_COLUMNS, DASHBOARD_AGGREGATE_QUERY, split_aggregates
+from db import connect
+from queries import query_map, with_source
+
+# Rows kept in the maintained sample, and the z value of the reported intervals (95% confidence)
+SAMPLE_SIZE = 100000
+Z = 1.96
+
+# A uniform random sample of "Policelog" kept by statement-level triggers. Every row is in the sample with the same
+# probability (sampled / population): an insert thins the sample to a common rate that keeps it within
+# SAMPLE_SIZE and adds the new rows at that rate, deletes and updates follow the sampled rows by id.
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS policelog_sample (LIKE "Policelog");
+CREATE INDEX IF NOT EXISTS policelog_sample_id ON policelog_sample (id);
+CREATE TABLE IF NOT EXISTS policelog_sample_state (
+    id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+    population bigint NOT NULL DEFAULT 0,
+    sampled bigint NOT NULL DEFAULT 0,
+    target integer NOT NULL
+);
+"""
+
+TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION policelog_sample_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    state policelog_sample_state%ROWTYPE;
+    added bigint;
+    rate double precision;
+    kept bigint;
+    taken bigint;
+BEGIN
+    SELECT * INTO state FROM policelog_sample_state FOR UPDATE;
+    SELECT COUNT(*) INTO added FROM new_rows;
+    rate := CASE WHEN state.population = 0 THEN 1 ELSE state.sampled::double precision / state.population END;
+    rate := LEAST(rate, state.target::double precision / (state.population + added));
+    kept := LEAST(state.sampled, floor(rate * state.population + random())::bigint);    -- randomized rounding
+    IF kept < state.sampled THEN
+        DELETE FROM policelog_sample WHERE ctid IN (
+            SELECT ctid FROM policelog_sample ORDER BY random() LIMIT state.sampled - kept);
+    END IF;
+    INSERT INTO policelog_sample SELECT * FROM new_rows ORDER BY random() LIMIT floor(rate * added + random())::bigint;
+    GET DIAGNOSTICS taken = ROW_COUNT;
+    UPDATE policelog_sample_state SET population = population + added, sampled = kept + taken;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_sample_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    removed bigint;
+BEGIN
+    DELETE FROM policelog_sample s USING old_rows o WHERE s.id = o.id;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    UPDATE policelog_sample_state SET population = population - (SELECT COUNT(*) FROM old_rows), sampled = sampled - removed;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_sample_update() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    WITH replaced AS (DELETE FROM policelog_sample s USING old_rows o WHERE s.id = o.id RETURNING s.id)
+    INSERT INTO policelog_sample SELECT n.* FROM new_rows n WHERE n.id IN (SELECT id FROM replaced);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION policelog_sample_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE policelog_sample;
+    UPDATE policelog_sample_state SET population = 0, sampled = 0;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER policelog_sample_insert AFTER INSERT ON "Policelog"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_sample_insert();
+CREATE OR REPLACE TRIGGER policelog_sample_update AFTER UPDATE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_sample_update();
+CREATE OR REPLACE TRIGGER policelog_sample_delete AFTER DELETE ON "Policelog"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION policelog_sample_delete();
+CREATE OR REPLACE TRIGGER policelog_sample_truncate AFTER TRUNCATE ON "Policelog"
+    FOR EACH STATEMENT EXECUTE FUNCTION policelog_sample_truncate();
+"""
+
+REBUILD_SQL = """
+LOCK TABLE "Policelog" IN SHARE MODE;
+TRUNCATE policelog_sample;
+INSERT INTO policelog_sample SELECT * FROM "Policelog" ORDER BY random() LIMIT %(target)s;
+INSERT INTO policelog_sample_state (population, sampled, target)
+    SELECT (SELECT COUNT(*) FROM "Policelog"), (SELECT COUNT(*) FROM policelog_sample), %(target)s
+    ON CONFLICT (id) DO UPDATE SET population = EXCLUDED.population, sampled = EXCLUDED.sampled, target = EXCLUDED.target;
+"""
+
+READY_QUERY = """SELECT COUNT(*) = 4 FROM pg_trigger
+    WHERE tgrelid = to_regclass('"Policelog"') AND tgname LIKE 'policelog_sample_%';"""
+
+STATE_QUERY = "SELECT population, sampled FROM policelog_sample_state;"
+
+# Planner row estimate of "Policelog" (summed over its partitions, the partitioned parent holds no rows), to size
+# a TABLESAMPLE
+ESTIMATED_ROWS_QUERY = """SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM pg_class c
+    WHERE c.relkind = 'r' AND (c.oid = to_regclass('"Policelog"')
+    OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass('"Policelog"')));"""
+
+
+# Take the sampled rows of `source` out of the sample, e.g. a partition that is about to be detached
+def remove_rows_sql(source):
+    return f"""WITH removed AS (DELETE FROM policelog_sample s USING {source} r WHERE s.id = r.id RETURNING 1)
+        UPDATE policelog_sample_state SET population = population - (SELECT COUNT(*) FROM {source}),
+            sampled = sampled - (SELECT COUNT(*) FROM removed);"""
+
+
+def _has_id(cursor):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'Policelog' AND column_name = 'id';"
+    )
+    return cursor.fetchone() is not None
+
+
+# Create the sample table and triggers and draw the sample from the current table in one transaction.
+# The triggers follow rows by id, so the schema has to be migrated first (python schema.py migrate).
+def install(conn, target=SAMPLE_SIZE):
+    with conn:
+        with conn.cursor() as cursor:
+            if not _has_id(cursor):
+                raise ValueError('"Policelog" has no id column yet; run "python schema.py migrate" first')
+            cursor.execute("DROP TABLE IF EXISTS policelog_sample;")    # its columns must match the current schema
+            cursor.execute(TABLES_SQL)
+            cursor.execute(TRIGGERS_SQL)
+            cursor.execute(REBUILD_SQL, {"target": target})
+
+
+# Draw a fresh sample (e.g. after bulk edits made with the triggers disabled, or to change its size)
+def rebuild(conn, target=SAMPLE_SIZE):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL, {"target": target})
+
+
+def uninstall(conn):
+    with conn:
+        with conn.cursor() as cursor:
+            for trigger in ["insert", "update", "delete", "truncate"]:
+                cursor.execute(f'DROP TRIGGER IF EXISTS policelog_sample_{trigger} ON "Policelog";')
+            cursor.execute("DROP TABLE IF EXISTS policelog_sample, policelog_sample_state;")
+
+
+# Where approximate answers come from: the maintained sample when it is installed, else a block-level
+# TABLESAMPLE sized to about SAMPLE_SIZE rows (REPEATABLE, so reruns see the same sample until the data changes).
+# "fraction" is the share of the rows that is sampled. Pages hold different numbers of rows, so for TABLESAMPLE it
+# is the rows actually drawn over the planner's row estimate, which then also stands in for the exact total; whole
+# pages are drawn, so its intervals assume rows are not clustered by the charted values.
+def sample_source(cursor, seed=0):
+    cursor.execute(READY_QUERY)
+    if cursor.fetchone()[0]:
+        cursor.execute(STATE_QUERY)
+        population, sampled = cursor.fetchone()
+        return {
+            "method": "sample", "table": "policelog_sample", "population": population, "sampled": sampled,
+            "fraction": sampled / population if population else 1.0,
+        }
+    cursor.execute(ESTIMATED_ROWS_QUERY)
+    estimated = cursor.fetchone()[0]
+    percent = 100.0 if estimated <= SAMPLE_SIZE else round(100.0 * SAMPLE_SIZE / estimated, 4)
+    table = f'(SELECT * FROM "Policelog" TABLESAMPLE SYSTEM ({percent}) REPEATABLE ({int(seed)}))'
+    cursor.execute(f"SELECT COUNT(*) FROM {table} AS drawn;")
+    sampled = cursor.fetchone()[0]
+    population = sampled if percent == 100.0 else max(estimated, sampled)
+    return {
+        "method": "tablesample", "table": table, "population": population, "sampled": sampled,
+        "fraction": sampled / population if population else 1.0,
+    }
+
+
+# Run a query over "Policelog" on the sample instead (apply in_date_range() first, so its range is kept)
+def on_sample(query, source):
+    return with_source(query, source["table"])
+
+
+# Estimated number of rows behind `hits` sampled rows, and the half-width of its interval
+def scale_count(hits, fraction):
+    if fraction >= 1:
+        return hits, 0
+    margin = Z * math.sqrt(max(hits, 1) * (1 - fraction)) / fraction
+    return round(hits / fraction), round(margin)
+
+
+# Wilson score interval for the share hits / n, narrowed by the finite population correction
+def rate_interval(hits, n, fraction):
+    if n == 0:
+        return 0.0, 0.0
+    p = hits / n
+    z = Z * math.sqrt(max(1 - fraction, 0))
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+
+# Chart counts and metric totals estimated from the sample's DASHBOARD_AGGREGATE_QUERY result, plus margins in the
+# same shape. With the whole maintained sample (no date filter), the total number of stops is known exactly.
+def estimate_aggregates(sample_aggregates, source, filtered=False):
+    counts, totals = split_aggregates(sample_aggregates)
+    fraction = source["fraction"]
+    margins = {"counts": {}, "totals": {}}
+    for column in CHART_COLUMNS:
+        scaled = [scale_count(hits, fraction) for hits in counts[column]]
+        index = counts[column].index
+        counts[column] = pd.Series([value for value, _ in scaled], index=index, dtype="int64", name="count")
+        margins["counts"][column] = pd.Series([margin for _, margin in scaled], index=index, dtype="int64")
+    for key, hits in totals.items():
+        totals[key], margins["totals"][key] = scale_count(hits, fraction)
+    if source["method"] == "sample" and not filtered:
+        totals["total_stops"], margins["totals"]["total_stops"] = source["population"], 0
+    return counts, totals, margins
+
+
+def approximate_aggregates_query(source):
+    return on_sample(DASHBOARD_AGGREGATE_QUERY, source)
+
+
+# Rate-style canned queries answered from the sample: grouping columns, the flag counted, the original result's
+# count and rate column names, and how many of the highest rates the original returns (None for all)
+RATE_QUERIES = {
+    "Arrest rate by country and violation": (
+        ["country_name", "violation"], "is_arrested", "total_arrests", "arrest_rate_percent", None,
+    ),
+    "Race and gender combination having the highest search rate": (
+        ["driver_race", "driver_gender"], "search_conducted", "total_searches", "search_rate_percent", 1,
+    ),
+    "Countries report the highest rate of drug-related stop": (
+        ["country_name"], "drugs_related_stop", "drug_related_stops", "drug_related_percentage", 1,
+    ),
+}
+
+
+def rate_sample_query(title):
+    groups, flag, _, _, _ = RATE_QUERIES[title]
+    columns = ", ".join(groups)
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in groups)
+    return f"""SELECT {columns}, COUNT(*) AS sample_stops, COUNT(*) FILTER (WHERE {flag}) AS sample_hits
+    FROM "Policelog" WHERE {not_null}
+    GROUP BY {columns};"""
+
+
+# The original query's columns estimated from the grouped sample counts, with the rate's 95% interval and the
+# number of sampled stops behind each row; every group is kept with all_groups, whatever the original's LIMIT
+def estimate_rates(title, sample_counts, fraction, all_groups=False):
+    groups, _, count_column, rate_column, limit = RATE_QUERIES[title]
+    rows = []
+    for record in sample_counts.to_dict("records"):
+        n, hits = int(record["sample_stops"]), int(record["sample_hits"])
+        low, high = rate_interval(hits, n, fraction)
+        row = {column: record[column] for column in groups}
+        row.update({
+            "total_stops": scale_count(n, fraction)[0],
+            count_column: scale_count(hits, fraction)[0],
+            rate_column: round(100.0 * hits / n, 2) if n else 0.0,
+            f"{rate_column}_low": round(100.0 * low, 2),
+            f"{rate_column}_high": round(100.0 * high, 2),
+            "sampled_stops": n,
+        })
+        rows.append(row)
+    columns = groups + ["total_stops", count_column, rate_column, f"{rate_column}_low", f"{rate_column}_high", "sampled_stops"]
+    result = pd.DataFrame(rows, columns=columns).sort_values(rate_column, ascending=False, kind="stable")
+    return (result if limit is None or all_groups else result.head(limit)).reset_index(drop=True)
+
+
+def _fetch(conn, query):
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        return pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+
+
+# Compare the approximate chart counts and rates with the exact ones and report how many fall inside their interval
+def check(conn):
+    with conn.cursor() as cursor:
+        source = sample_source(cursor)
+    print(f"{source['method']}: {source['sampled']:,} of {source['population']:,} rows ({100 * source['fraction']:.2f}%)")
+    exact_counts, exact_totals = split_aggregates(_fetch(conn, DASHBOARD_AGGREGATE_QUERY))
+    counts, totals, margins = estimate_aggregates(_fetch(conn, approximate_aggregates_query(source)), source)
+    covered = total = 0
+    for column in CHART_COLUMNS:
+        for value, exact in exact_counts[column].items():
+            estimate = counts[column].get(value, 0)
+            margin = margins["counts"][column].get(value, 0)
+            covered += abs(estimate - exact) <= margin
+            total += 1
+    for key, exact in exact_totals.items():
+        print(f"{key:<20} exact {exact:>12,}  approximate {totals[key]:>12,} ± {margins['totals'][key]:,}")
+    print(f"chart counts inside their interval: {covered} of {total}")
+    for title, (groups, _, _, rate_column, _) in RATE_QUERIES.items():
+        exact = _fetch(conn, re.sub(r"\s+limit\s+1\s*;", ";", query_map[title], flags=re.IGNORECASE))
+        sample_counts = _fetch(conn, on_sample(rate_sample_query(title), source))
+        estimated = estimate_rates(title, sample_counts, source["fraction"], all_groups=True)
+        merged = exact.merge(estimated, on=groups, suffixes=("", "_approximate"))
+        inside = ((merged[rate_column].astype(float) >= merged[f"{rate_column}_low"] - 0.005)
+                  & (merged[rate_column].astype(float) <= merged[f"{rate_column}_high"] + 0.005))
+        print(f"{title}: top group exact {exact.iloc[0][groups].tolist() if len(exact) else None}, "
+              f"approximate {estimated.iloc[0][groups].tolist() if len(estimated) else None}; "
+              f"{int(inside.sum())} of {len(merged)} compared rates inside their interval")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the maintained random sample of "Policelog" behind approximate mode')
+    parser.add_argument("command", choices=["install", "rebuild", "check", "uninstall"])
+    parser.add_argument("--size", type=int, default=SAMPLE_SIZE, help="rows kept in the sample (install / rebuild)")
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        if args.command == "install":
+            install(connection, args.size)
+        elif args.command == "rebuild":
+            rebuild(connection, args.size)
+        elif args.command == "uninstall":
+            uninstall(connection)
+        else:
+            check(connection)
+        print(f"Sample {args.command} done")
+    finally:
+        connection.close()
@@ -0,0 +1,287 @@
+import argparse
+import json
+
+import psycopg2
+
+from cache import VERSION_SETUP_SQL
+from db import connect
+from ingest import CREATE_TABLE_SQL
+from partitions import FUNCTIONS_SQL
+from rollups import READY_QUERY, TRIGGERS_SQL
+from sample import READY_QUERY as SAMPLE_READY_QUERY, TRIGGERS_SQL as SAMPLE_TRIGGERS_SQL
+from hitters import READY_QUERY as HITTERS_READY_QUERY, TRIGGERS_SQL as HITTERS_TRIGGERS_SQL
+from live import READY_QUERY as LIVE_READY_QUERY, TRIGGERS_SQL as LIVE_TRIGGERS_SQL
+from preview import build_page_query
+from aggregations import DASHBOARD_AGGREGATE_QUERY
+from queries import query_map
+
+# Curated indexes for the canned queries: B-trees for the filtered / grouped columns, partial indexes for the
+# rare flags the vehicle queries filter on, and a BRIN on timestamp (rows arrive roughly in time order, so a
+# few pages of summaries cover the whole table). (vehicle_number, timestamp) is ingest.py's default upsert key.
+INDEXES = {
+    "policelog_timestamp_brin": 'CREATE INDEX IF NOT EXISTS policelog_timestamp_brin ON "Policelog" USING brin (timestamp)',
+    "policelog_timestamp": 'CREATE INDEX IF NOT EXISTS policelog_timestamp ON "Policelog" (timestamp)',
+    "policelog_vehicle_number": 'CREATE INDEX IF NOT EXISTS policelog_vehicle_number ON "Policelog" (vehicle_number)',
+    "policelog_vehicle_timestamp": (
+        'CREATE INDEX IF NOT EXISTS policelog_vehicle_timestamp ON "Policelog" (vehicle_number, timestamp)'
+    ),
+    "policelog_drugs_vehicle": (
+        'CREATE INDEX IF NOT EXISTS policelog_drugs_vehicle ON "Policelog" (vehicle_number) WHERE drugs_related_stop'
+    ),
+    "policelog_searched_vehicle": (
+        'CREATE INDEX IF NOT EXISTS policelog_searched_vehicle ON "Policelog" (vehicle_number) WHERE search_conducted'
+    ),
+    "policelog_searched_country": (
+        'CREATE INDEX IF NOT EXISTS policelog_searched_country ON "Policelog" (country_name) WHERE search_conducted'
+    ),
+    "policelog_driver_age": 'CREATE INDEX IF NOT EXISTS policelog_driver_age ON "Policelog" (driver_age) INCLUDE (violation)',
+    "policelog_country_violation": (
+        'CREATE INDEX IF NOT EXISTS policelog_country_violation ON "Policelog" (country_name, violation) INCLUDE (is_arrested)'
+    ),
+}
+
+_CREATE_INDEXES_SQL = ";\n".join(INDEXES.values()) + ';\nANALYZE "Policelog";'
+
+# Rebuild "Policelog" as a table range-partitioned by month on timestamp. The partition key has to be part of
+# every unique constraint, and rows without a timestamp can only live in the default partition, so the id key
+# becomes UNIQUE (id, timestamp) instead of a primary key.
+PARTITION_SQL = f"""
+ALTER TABLE "Policelog" RENAME TO policelog_unpartitioned;
+CREATE TABLE "Policelog" (LIKE policelog_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp);
+ALTER TABLE "Policelog" ALTER COLUMN id ADD GENERATED ALWAYS AS IDENTITY;
+CREATE TABLE policelog_default PARTITION OF "Policelog" DEFAULT;
+{FUNCTIONS_SQL}
+SELECT policelog_ensure_partitions(array_agg(DISTINCT date_trunc('month', timestamp))) FROM policelog_unpartitioned;
+INSERT INTO "Policelog" OVERRIDING SYSTEM VALUE SELECT * FROM policelog_unpartitioned;
+SELECT setval(pg_get_serial_sequence('"Policelog"', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM "Policelog";
+DROP TABLE policelog_unpartitioned;
+ALTER TABLE "Policelog" ADD CONSTRAINT policelog_id_timestamp_key UNIQUE (id, timestamp);
+{_CREATE_INDEXES_SQL}
+"""
+
+
+# Triggers and the table comment stay behind on the old table, so they are put back on the partitioned one
+def _partition_by_month(cursor):
+    cursor.execute(READY_QUERY)
+    rollups_installed = cursor.fetchone()[0]
+    cursor.execute(SAMPLE_READY_QUERY)
+    sample_installed = cursor.fetchone()[0]
+    cursor.execute(HITTERS_READY_QUERY)
+    hitters_installed = cursor.fetchone()[0]
+    cursor.execute(LIVE_READY_QUERY)
+    live_installed = cursor.fetchone()[0]
+    cursor.execute("""SELECT to_regclass('policelog_version') IS NOT NULL, obj_description('"Policelog"'::regclass, 'pg_class');""")
+    versioned, comment = cursor.fetchone()
+    cursor.execute(PARTITION_SQL)
+    if comment is not None:
+        cursor.execute('COMMENT ON TABLE "Policelog" IS %s;', (comment,))
+    if versioned:
+        cursor.execute(VERSION_SETUP_SQL)
+    if rollups_installed:
+        cursor.execute(TRIGGERS_SQL)
+    if sample_installed:    # ids are kept, so the sampled rows still match
+        cursor.execute(SAMPLE_TRIGGERS_SQL)
+    if hitters_installed:    # the summaries count vehicles, not rows, so they carry over unchanged
+        cursor.execute(HITTERS_TRIGGERS_SQL)
+    if live_installed:    # after the data version, which the notify payloads carry
+        cursor.execute(LIVE_TRIGGERS_SQL)
+
+
+# Ordered schema migrations; each runs once in its own transaction and is recorded in policelog_schema_migrations.
+# A migration is either SQL or a function of the cursor.
+MIGRATIONS = [
+    ("create_table", CREATE_TABLE_SQL),
+    # to_sql() leaves dates and times as text and ages as floats
+    ("typed_columns", """ALTER TABLE "Policelog"
+    ALTER COLUMN stop_date TYPE date USING NULLIF(stop_date::text, '')::date,
+    ALTER COLUMN stop_time TYPE time USING NULLIF(stop_time::text, '')::time,
+    ALTER COLUMN driver_age_raw TYPE smallint USING round(driver_age_raw)::smallint,
+    ALTER COLUMN driver_age TYPE smallint USING round(driver_age)::smallint;"""),
+    ("primary_key", 'ALTER TABLE "Policelog" ADD COLUMN IF NOT EXISTS id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY;'),
+    ("indexes", _CREATE_INDEXES_SQL),
+    ("partition_by_month", _partition_by_month),
+    # policelog_ensure_partitions of the months that have rows, on tables partitioned before it existed
+    ("partition_functions", FUNCTIONS_SQL),
+    # upserts look rows up by their key; without it every chunk joins the whole table
+    ("upsert_key_index", INDEXES["policelog_vehicle_timestamp"] + ";"),
+]
+
+MIGRATIONS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS policelog_schema_migrations (
+    name text PRIMARY KEY,
+    applied_at timestamptz NOT NULL DEFAULT now()
+);"""
+
+
+def applied_migrations(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(MIGRATIONS_TABLE_SQL)
+        cursor.execute("SELECT name FROM policelog_schema_migrations;")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(conn):
+    applied = applied_migrations(conn)
+    return [name for name, _ in MIGRATIONS if name not in applied]
+
+
+# Apply every pending migration in order. The rewrite changes column types, so the data version used by the
+# result cache is bumped as well.
+def migrate(conn, report=print):
+    done = []
+    for name, statement in MIGRATIONS:
+        if name not in applied_migrations(conn):
+            with conn:
+                with conn.cursor() as cursor:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                    cursor.execute("INSERT INTO policelog_schema_migrations (name) VALUES (%s);", (name,))
+            report(f"applied {name}")
+            done.append(name)
+    if done:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('policelog_version') IS NOT NULL;")
+                if cursor.fetchone()[0]:
+                    cursor.execute("UPDATE policelog_version SET version = version + 1, changed_at = now();")
+    else:
+        report("schema is up to date")
+    return done
+
+
+def existing_indexes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'Policelog';")
+        return {row[0] for row in cursor.fetchall()}
+
+
+# Queries the advisor replays: every canned query, the first overview page and the chart aggregates
+def advisor_queries():
+    page_query, page_params = build_page_query()
+    return [("Overview page", page_query, page_params), ("Chart aggregates", DASHBOARD_AGGREGATE_QUERY, None)] + [
+        (title, query, None) for title, query in query_map.items()
+    ]
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+# Once "Policelog" is partitioned, plans name the indexes of the monthly partitions; map each one to the index
+# on "Policelog" it was created from, so the advice compares the curated names
+def _parent_indexes(cursor):
+    cursor.execute(
+        "SELECT c.relname, r.relname FROM pg_class AS c JOIN pg_class AS r ON r.oid = pg_partition_root(c.oid) "
+        "WHERE c.relkind = 'i' AND c.relispartition;"
+    )
+    return dict(cursor.fetchall())
+
+
+def _explain(cursor, query, params, analyze, parents):
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    statement = cursor.mogrify(query, params).decode().strip().rstrip(";")
+    cursor.execute(f"EXPLAIN ({options}) {statement}")
+    plan = cursor.fetchone()[0][0]
+    nodes = list(_plan_nodes(plan["Plan"]))
+    return {
+        "cost": plan["Plan"]["Total Cost"],
+        "ms": plan.get("Execution Time"),
+        "indexes": sorted({parents.get(node["Index Name"], node["Index Name"]) for node in nodes if "Index Name" in node}),
+        "seq_scans": sum(node["Node Type"] == "Seq Scan" for node in nodes),
+    }
+
+
+# Replay the queries under EXPLAIN twice: as planned, and with index scans disabled, which is what they would
+# cost without any index. With try_missing, the curated indexes not yet present are built inside the
+# transaction first, so the plans show what they would gain; everything is rolled back afterwards.
+def advise(conn, analyze=False, try_missing=False, report=print):
+    present = existing_indexes(conn)
+    missing = [name for name in INDEXES if name not in present]
+    results = []
+    try:
+        with conn.cursor() as cursor:
+            if try_missing:
+                for name in missing:
+                    report(f"building {name} (rolled back afterwards)")
+                    cursor.execute("SAVEPOINT try_index;")
+                    try:
+                        cursor.execute(INDEXES[name])
+                    except psycopg2.Error as e:    # e.g. the id column before the primary_key migration
+                        cursor.execute("ROLLBACK TO SAVEPOINT try_index;")
+                        report(f"cannot build {name}: {str(e).strip()}")
+            parents = _parent_indexes(cursor)
+            for title, query, params in advisor_queries():
+                cursor.execute("SET LOCAL enable_indexscan = off; SET LOCAL enable_indexonlyscan = off; SET LOCAL enable_bitmapscan = off;")
+                without = _explain(cursor, query, params, analyze, parents)
+                cursor.execute("RESET enable_indexscan; RESET enable_indexonlyscan; RESET enable_bitmapscan;")
+                planned = _explain(cursor, query, params, analyze, parents)
+                results.append({
+                    "query": title,
+                    "cost_without_indexes": without["cost"],
+                    "cost": planned["cost"],
+                    "gain": round(1 - planned["cost"] / without["cost"], 3) if without["cost"] else 0.0,
+                    "ms_without_indexes": without["ms"],
+                    "ms": planned["ms"],
+                    "indexes": planned["indexes"],
+                    "uses_missing": [name for name in planned["indexes"] if name in missing],
+                    "seq_scans": planned["seq_scans"],
+                })
+    finally:
+        conn.rollback()
+    used = {name for result in results for name in result["indexes"]}
+    return {
+        "indexes_present": sorted(present),
+        "curated_missing": missing,
+        "unused_curated": sorted(name for name in INDEXES if name in present and name not in used),
+        "queries": results,
+    }
+
+
+def print_advice(advice, report=print):
+    report(f"{'cost w/o idx':>13} {'cost':>11} {'gain':>6}  query / indexes used")
+    for result in sorted(advice["queries"], key=lambda result: -result["gain"]):
+        indexes = ", ".join(
+            name + (" (missing)" if name in result["uses_missing"] else "") for name in result["indexes"]
+        ) or f"none ({result['seq_scans']} seq scan{'s' if result['seq_scans'] != 1 else ''})"
+        timing = ""
+        if result["ms"] is not None:
+            timing = f"  [{result['ms_without_indexes']:.1f} ms -> {result['ms']:.1f} ms]"
+        report(f"{result['cost_without_indexes']:13.0f} {result['cost']:11.0f} {result['gain']:6.0%}  {result['query']}{timing}")
+        report(f"{'':33}{indexes}")
+    if advice["curated_missing"]:
+        report(f"curated indexes not created yet: {', '.join(advice['curated_missing'])}")
+    if advice["unused_curated"]:
+        report(f"curated indexes no replayed query uses: {', '.join(advice['unused_curated'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the "Policelog" schema and advise on its indexes')
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="list applied and pending migrations")
+    commands.add_parser("migrate", help="apply pending migrations (typed columns, primary key, indexes)")
+    advise_parser = commands.add_parser("advise", help="replay the canned queries under EXPLAIN and report index use")
+    advise_parser.add_argument("--analyze", action="store_true", help="run the queries (EXPLAIN ANALYZE, BUFFERS) for real timings")
+    advise_parser.add_argument("--try-missing", action="store_true",
+                               help="build missing curated indexes inside a rolled-back transaction to show their gain")
+    advise_parser.add_argument("--json", action="store_true", help="print the advice as JSON")
+    args = parser.parse_args()
+
+    connection = connect(autocommit=False)
+    try:
+        if args.command == "status":
+            pending = pending_migrations(connection)
+            for name, _ in MIGRATIONS:
+                print(f"{'pending' if name in pending else 'applied':8} {name}")
+        elif args.command == "migrate":
+            migrate(connection)
+        else:
+            advice = advise(connection, args.analyze, args.try_missing)
+            if args.json:
+                print(json.dumps(advice, indent=2))
+            else:
+                print_advice(advice)
+    finally:
+        connection.close()
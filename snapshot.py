@@ -0,0 +1,255 @@
+import argparse
+import io
+import json
+import numbers
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+from aggregations import DASHBOARD_AGGREGATE_QUERY
+from cache import DATA_VERSION_QUERY
+from db import CATEGORY_COLUMNS, connect
+from queries import query_map, in_date_range
+
+try:
+    import duckdb
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv, ipc
+except ImportError:    # pyarrow and duckdb are optional, the dashboard then only queries Postgres
+    duckdb = None
+
+# Snapshots of "Policelog" are written to SNAPSHOT_DIRECTORY/<export time>/ as one Arrow IPC file per year of
+# stop timestamp (year=none.arrow holds the stops without one); manifest.json names the current snapshot. The
+# newest KEEP_SNAPSHOTS are kept, so readers still mapping the previous files are not cut off.
+SNAPSHOT_DIRECTORY = "snapshot"
+MANIFEST = "manifest.json"
+KEEP_SNAPSHOTS = 2
+
+
+# Arrow types of the Postgres column types; anything else is kept as text
+def _arrow_types():
+    return {
+        16: pa.bool_(),
+        20: pa.int64(), 21: pa.int16(), 23: pa.int32(),
+        700: pa.float32(), 701: pa.float64(),
+        1082: pa.date32(), 1083: pa.time64("us"), 1114: pa.timestamp("us"),
+    }
+
+
+# Read one query through COPY into an Arrow table typed from the query's columns. In Postgres' CSV a NULL is
+# an empty unquoted field and an empty string is quoted, which keeps the two apart.
+def _read_table(cursor, query, description):
+    types = _arrow_types()
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+    buffer.seek(0)
+    options = pa_csv.ConvertOptions(
+        column_types={desc.name: types.get(desc.type_code, pa.string()) for desc in description},
+        true_values=["t"], false_values=["f"], null_values=[""],
+        strings_can_be_null=True, quoted_strings_can_be_null=False,
+    )
+    table = pa_csv.read_csv(buffer, convert_options=options)
+    for name in CATEGORY_COLUMNS & set(table.column_names):
+        table = table.set_column(table.column_names.index(name), name, table.column(name).dictionary_encode())
+    return table
+
+
+def read_manifest(directory=SNAPSHOT_DIRECTORY):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return None
+
+
+def _prune(directory, current):
+    snapshots = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    for name in snapshots[:-KEEP_SNAPSHOTS]:
+        if name != current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)    # e.g. still mapped on Windows
+
+
+# Export "Policelog" year by year inside one REPEATABLE READ transaction, so every file is from the same moment
+# and matches the data version recorded in the manifest. Each year is a range on the partition key, so only its
+# monthly partitions are read. The snapshot becomes current when the manifest is replaced.
+def export(conn, directory=SNAPSHOT_DIRECTORY, report=print):
+    if duckdb is None:
+        raise RuntimeError("Snapshots need pyarrow and duckdb")
+    started = time.perf_counter()
+    name = datetime.now().strftime("%Y%m%dT%H%M%S")
+    target = os.path.join(directory, name)
+    os.makedirs(target, exist_ok=True)
+    years = {}
+    with conn.cursor() as cursor:
+        cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+        try:
+            cursor.execute("SELECT to_regclass('policelog_version') IS NOT NULL;")
+            version = None
+            if cursor.fetchone()[0]:
+                cursor.execute(DATA_VERSION_QUERY)
+                version = cursor.fetchone()[0]
+            cursor.execute('SELECT * FROM "Policelog" LIMIT 0;')
+            description = cursor.description
+            cursor.execute('SELECT EXTRACT(YEAR FROM MIN(timestamp))::int, EXTRACT(YEAR FROM MAX(timestamp))::int FROM "Policelog";')
+            first, last = cursor.fetchone()
+            for year in (list(range(first, last + 1)) if first is not None else []) + [None]:
+                if year is None:
+                    condition = "timestamp IS NULL"
+                else:
+                    condition = f"timestamp >= '{year}-01-01'::timestamp AND timestamp < '{year + 1}-01-01'::timestamp"
+                table = _read_table(cursor, f'SELECT * FROM "Policelog" WHERE {condition}', description)
+                if table.num_rows == 0:
+                    continue
+                key = "none" if year is None else str(year)
+                file_name = f"year={key}.arrow"
+                with pa.OSFile(os.path.join(target, file_name), "wb") as sink:
+                    with ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                years[key] = {"file": file_name, "rows": table.num_rows}
+                report(f"{file_name}: {table.num_rows:,} rows")
+        finally:
+            cursor.execute("COMMIT;")
+
+    manifest = {
+        "snapshot": name,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "data_version": version,
+        "rows": sum(entry["rows"] for entry in years.values()),
+        "years": years,
+    }
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as staged:
+        json.dump(manifest, staged, indent=2)
+    os.replace(path + ".tmp", path)
+    _prune(directory, name)
+    report(f"Snapshot {name}: {manifest['rows']:,} rows in {time.perf_counter() - started:.1f}s")
+    return manifest
+
+
+def _overlaps(year, start, end):
+    if year is None:    # stops without a timestamp fall outside every date range
+        return start is None and end is None
+    return (start is None or start < date(year + 1, 1, 1)) and (end is None or end > date(year, 1, 1))
+
+
+# Runs the dashboard's SQL over the current snapshot with DuckDB instead of Postgres. The year files are
+# memory-mapped and read as Arrow tables without copying, and DuckDB scans those buffers in place with its
+# vectorized, multi-threaded engine. refresh() switches to a newer snapshot once the export job has written one.
+class SnapshotEngine:
+    def __init__(self, directory=SNAPSHOT_DIRECTORY):
+        if duckdb is None:
+            raise RuntimeError("The snapshot engine needs pyarrow and duckdb")
+        self.directory = directory
+        self.manifest = None
+        self._tables = {}    # year (None for stops without a timestamp) -> Arrow table
+        self._database = duckdb.connect()
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "errors": 0, "total_ms": 0.0}
+        self.refresh()
+
+    def refresh(self):
+        manifest = read_manifest(self.directory)
+        if manifest is None or (self.manifest is not None and manifest["snapshot"] == self.manifest["snapshot"]):
+            return
+        tables = {}
+        for key, entry in manifest["years"].items():
+            path = os.path.join(self.directory, manifest["snapshot"], entry["file"])
+            tables[None if key == "none" else int(key)] = ipc.open_file(pa.memory_map(path)).read_all()
+        with self._lock:
+            self.manifest, self._tables = manifest, tables
+
+    # Result of a query over "Policelog" restricted to stops in [start, end) like in_date_range, scanning only the
+    # years that overlap the range. Column names come back lower case, as Postgres folds the unquoted aliases.
+    def query(self, query, start=None, end=None):
+        with self._lock:
+            if not self._tables:
+                raise RuntimeError("No snapshot yet; run python snapshot.py export")
+            tables = [table for year, table in self._tables.items() if _overlaps(year, start, end)]
+            schema = next(iter(self._tables.values())).schema
+            cursor = self._database.cursor()    # one connection per query, so sessions can query concurrently
+        started = time.perf_counter()
+        try:
+            cursor.register("Policelog", pa.concat_tables(tables) if tables else schema.empty_table())
+            cursor.execute(in_date_range(query, start, end))
+            hugeints = [desc[0] for desc in cursor.description if str(desc[1]) == "HUGEINT"]
+            frame = cursor.df()
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            cursor.close()
+        for column in hugeints:    # DuckDB sums integers into 128 bits, which pandas gets as floats
+            frame[column] = frame[column].astype("Int64")
+        frame.columns = [column.lower() for column in frame.columns]
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["total_ms"] += (time.perf_counter() - started) * 1000
+        return frame
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            manifest = self.manifest or {}
+        stats["avg_ms"] = round(stats.pop("total_ms") / stats["queries"], 1) if stats["queries"] else None
+        for key in ["snapshot", "created_at", "data_version", "rows"]:
+            stats[key] = manifest.get(key)
+        stats["years"] = sorted(manifest.get("years", {}))
+        return stats
+
+
+# Rows as sorted text, numbers rounded, so Postgres numerics and DuckDB doubles compare equal
+def _comparable(frame):
+    def text(value):
+        if pd.isna(value):
+            return ""
+        if pd.api.types.is_bool(value):
+            return str(bool(value))
+        return f"{float(value):.2f}" if isinstance(value, numbers.Number) else str(value)
+    return sorted(tuple(text(value) for value in row) for row in frame.itertuples(index=False))
+
+
+# Compare every canned query and the dashboard aggregation on the snapshot with Postgres. They only agree while
+# nothing was written since the export; ties under a LIMIT may also pick different rows.
+def check(conn, engine):
+    mismatches = []
+    queries = dict(query_map)
+    queries["Dashboard aggregates"] = DASHBOARD_AGGREGATE_QUERY
+    for title, query in queries.items():
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            live = pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+        started = time.perf_counter()
+        snapshot = engine.query(query)
+        seconds = time.perf_counter() - started
+        same = list(live.columns) == list(snapshot.columns) and _comparable(live) == _comparable(snapshot)
+        if not same:
+            mismatches.append(title)
+        print(f"{'ok      ' if same else 'MISMATCH'}  {seconds * 1000:7.1f} ms  {title}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export "Policelog" to a columnar snapshot and query it offline')
+    parser.add_argument("command", choices=["export", "info", "check", "query"])
+    parser.add_argument("sql", nargs="?", help='query over "Policelog" for the query command')
+    parser.add_argument("--directory", default=SNAPSHOT_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(read_manifest(args.directory), indent=2))
+    elif args.command == "query":
+        print(SnapshotEngine(args.directory).query(args.sql).to_string(index=False))
+    else:
+        connection = connect()
+        try:
+            if args.command == "export":
+                export(connection, args.directory)
+            elif check(connection, SnapshotEngine(args.directory)):
+                raise SystemExit(1)
+        finally:
+            connection.close()
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+import cache
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT *\n    FROM \"Policelog\";\n", 'SELECT * FROM "Policelog"'),
+    ("  SELECT 1 ;  ", "SELECT 1"),
+    ("SELECT * FROM t WHERE a = 'two  spaces'\n", "SELECT * FROM t WHERE a = 'two  spaces'"),
+    ("SELECT \"odd  name\" ,  'it''s  here'", "SELECT \"odd  name\" , 'it''s  here'"),
+])
+def test_normalize_query(query, expected):
+    assert cache.normalize_query(query) == expected
+
+
+def test_normalize_query_keeps_literals_apart():
+    assert cache.normalize_query("SELECT 'a  b'") != cache.normalize_query("SELECT 'a b'")
+
+
+def _frame(rows=1):
+    return pd.DataFrame({"value": range(rows)})
+
+
+def test_hits_and_misses():
+    results = cache.ResultCache()
+    key = results.key("SELECT 1;", version=1)
+    assert results.get(key) is None
+    results.put(key, _frame())
+    assert results.get(results.key("SELECT   1", version=1)) is not None
+    stats = results.metrics()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_evicts_least_recently_used_entries():
+    results = cache.ResultCache(max_entries=2)
+    keys = [results.key(f"SELECT {n}", version=1) for n in range(3)]
+    results.put(keys[0], _frame())
+    results.put(keys[1], _frame())
+    results.get(keys[0])    # now the most recently used
+    results.put(keys[2], _frame())
+    assert results.get(keys[1]) is None
+    assert results.get(keys[0]) is not None and results.get(keys[2]) is not None
+    assert results.metrics()["evictions"] == 1
+
+
+def test_evicts_by_size_and_skips_results_bigger_than_the_cache():
+    size = cache._frame_size(_frame(100))
+    results = cache.ResultCache(max_bytes=size * 2)
+    results.put(results.key("SELECT big"), _frame(1000))
+    assert results.metrics()["entries"] == 0
+    for n in range(3):
+        results.put(results.key(f"SELECT {n}"), _frame(100))
+    assert results.metrics()["entries"] == 2
+    assert results.metrics()["bytes"] <= size * 2
+
+
+def test_expires_entries_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    results = cache.ResultCache(ttl=10)
+    key = results.key("SELECT 1")
+    results.put(key, _frame())
+    now[0] += 11
+    assert results.get(key) is None
+    assert results.metrics()["expired"] == 1
+
+
+def test_newer_data_version_invalidates_older_entries():
+    results = cache.ResultCache()
+    old, new = results.key("SELECT 1", version=1), results.key("SELECT 1", version=2)
+    results.put(old, _frame())
+    assert results.get(new) is None
+    assert results.metrics()["invalidations"] == 1
+    results.put(new, _frame())
+    assert results.get(old) is None    # a reader still on the old version flushes nothing
+    assert results.get(new) is not None
+
+
+def test_does_not_store_results_of_an_older_version():
+    results = cache.ResultCache()
+    results.get(results.key("SELECT 1", version=5))
+    results.put(results.key("SELECT 2", version=4), _frame())
+    assert results.metrics()["entries"] == 0
+    assert results.metrics()["data_version"] == 5
@@ -0,0 +1,51 @@
+import psycopg2
+import pytest
+
+import db
+
+# Text values that must come back exactly as stored, next to a real NULL
+TEXT_VALUES = ["", "NA", "N/A", "null", "None", "text"]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    try:
+        db.connect().close()
+    except psycopg2.Error as e:
+        pytest.skip(f"Postgres unavailable: {e}")
+    pool = db.ConnectionPool()
+    yield pool
+    pool.closeall()
+
+
+def _round_trip(pool, values):
+    query = f"SELECT label, n FROM (VALUES {', '.join(['(%s::text, %s)'] * len(values))}) AS t(label, n) ORDER BY n"
+    params = [item for n, value in enumerate(values) for item in (value, n)]
+    return list(db.fetch_frame(pool, query, params)["label"])
+
+
+def _assert_same(fetched, values):
+    assert len(fetched) == len(values)
+    for got, expected in zip(fetched, values):
+        if expected is None:
+            assert got is None or got != got    # None or NaN
+        else:
+            assert got == expected
+
+
+@pytest.mark.skipif(db.pa is None, reason="pyarrow is not installed")
+def test_empty_string_and_null_round_trip_with_arrow(pool):
+    values = TEXT_VALUES + [None]
+    _assert_same(_round_trip(pool, values), values)
+
+
+def test_empty_string_and_null_round_trip_with_pandas(pool, monkeypatch):
+    monkeypatch.setattr(db, "pa", None)
+    values = TEXT_VALUES + [None]
+    _assert_same(_round_trip(pool, values), values)
+
+
+@pytest.mark.skipif(db.pa is None, reason="pyarrow is not installed")
+def test_text_equal_to_null_marker_round_trip_with_arrow(pool):
+    values = [db.NULL_MARKER, None]
+    _assert_same(_round_trip(pool, values), values)
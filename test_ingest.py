@@ -0,0 +1,62 @@
+import io
+
+import pandas as pd
+
+import ingest
+
+CSV = """stop_date,stop_time,country_name,driver_age,violation,vehicle_number
+2024-05-01,10:00,India,30,Speeding,AB1
+2024-05-01,10:00,USA,40,,
+2024-05-01,10:00,USA,50,DUI,
+2024-05-01,10:00,Canada,41,DUI,AB1
+2024-05-02,7:05,,,,CD2
+not a date,10:00,India,33,Speeding,EF3
+"""
+
+
+def _chunk():
+    return pd.read_csv(io.StringIO(CSV))
+
+
+def test_clean_chunk_fills_and_builds_timestamps():
+    cleaned = ingest.clean_chunk(_chunk(), age_fill=37.5)
+    assert list(cleaned["timestamp"][:5]) == [pd.Timestamp("2024-05-01 10:00:00")] * 4 + [pd.Timestamp("2024-05-02 07:05:00")]
+    assert pd.isna(cleaned["timestamp"].iloc[5])
+    assert list(cleaned["stop_time"][:5]) == ["10:00:00"] * 4 + ["07:05:00"]
+    assert cleaned["driver_age"].iloc[4] == 37.5
+    assert cleaned["country_name"].iloc[4] == "unknown"
+    assert list(cleaned["vehicle_number"]) == ["AB1", "unknown", "unknown", "AB1", "CD2", "EF3"]
+
+
+def test_age_median_streams_the_whole_file(tmp_path):
+    path = tmp_path / "stops.csv"
+    path.write_text(CSV)
+    assert ingest.age_median(str(path), chunksize=2) == 40
+    path.write_text("driver_age\n1\n2\n3\n4\n")
+    assert ingest.age_median(str(path), chunksize=3) == 2.5
+
+
+def test_deduplicate_keeps_the_last_row_of_a_key():
+    chunk = ingest.clean_chunk(_chunk())
+    rows, collapsed, rejected = ingest.deduplicate(chunk, ingest.DEFAULT_KEY)
+    assert collapsed == 2    # AB1, and the two filled "unknown" vehicles without the file's missing mask
+    assert rejected == 1    # the row without a timestamp
+    assert list(rows["country_name"]) == ["USA", "Canada", "unknown"]
+
+
+def test_deduplicate_rejects_keys_missing_before_cleaning():
+    raw = _chunk()
+    missing = raw[["vehicle_number"]].isna().any(axis=1)
+    chunk = ingest.clean_chunk(raw)
+    rows, collapsed, rejected = ingest.deduplicate(chunk, ingest.DEFAULT_KEY, missing)
+    assert (collapsed, rejected) == (1, 3)
+    assert list(rows["vehicle_number"]) == ["AB1", "CD2"]
+    assert rows["country_name"].iloc[0] == "Canada"
+
+
+def test_coerce_integers_rounds_for_integer_columns():
+    chunk = pd.DataFrame({"driver_age": [37.5, 40.0, None], "violation": ["a", "b", "c"]})
+    coerced = ingest.coerce_integers(chunk, ["driver_age", "missing_column"])
+    assert str(coerced["driver_age"].dtype) == "Int64"
+    assert list(coerced["driver_age"][:2]) == [38, 40]
+    assert pd.isna(coerced["driver_age"].iloc[2])
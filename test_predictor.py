@@ -0,0 +1,90 @@
+from collections import Counter
+
+import predictor
+
+STOPS = [
+    {"driver_gender": "M", "driver_age": 30, "search_conducted": False, "stop_duration": "0-15 Min",
+     "drugs_related_stop": False, "stop_outcome": "Citation", "violation": "Speeding"},
+    {"driver_gender": "M", "driver_age": 30, "search_conducted": False, "stop_duration": "0-15 Min",
+     "drugs_related_stop": False, "stop_outcome": "Citation", "violation": "Speeding"},
+    {"driver_gender": "M", "driver_age": 45, "search_conducted": False, "stop_duration": "0-15 Min",
+     "drugs_related_stop": False, "stop_outcome": "Warning", "violation": "Seatbelt"},
+    {"driver_gender": "F", "driver_age": 22, "search_conducted": True, "stop_duration": "16-30 Min",
+     "drugs_related_stop": True, "stop_outcome": "Arrest", "violation": "DUI"},
+    {"driver_gender": "F", "driver_age": 60, "search_conducted": False, "stop_duration": "30+ Min",
+     "drugs_related_stop": True, "stop_outcome": "Warning", "violation": "DUI"},
+]
+
+
+# The rows PREDICTOR_INDEX_QUERY returns for these stops: one per grouping set and group, the columns outside
+# the set NULL and their GROUPING() bits set
+def _index_rows(stops):
+    grouped = predictor._GROUPED
+    rows = []
+    for level in predictor.BACKOFF_LEVELS:
+        for target in predictor.TARGETS:
+            columns = level + [target]
+            grouping_id = sum(1 << (len(grouped) - 1 - position)
+                              for position, column in enumerate(grouped) if column not in columns)
+            counts = Counter(tuple(stop[column] for column in columns) for stop in stops)
+            for values, total in counts.items():
+                row = dict(zip(columns, values))
+                rows.append(tuple(row.get(column) for column in grouped) + (grouping_id, total))
+    return grouped + ["grouping_id", "total"], rows
+
+
+def _index(stops=STOPS):
+    index = predictor.PredictorIndex()
+    index.load(*_index_rows(stops), version=7)
+    return index
+
+
+def test_grouped_columns_follow_grouping_bits():
+    assert predictor._grouped_columns(0) == predictor._GROUPED
+    assert predictor._grouped_columns(0b0111110) == ["driver_gender", "violation"]
+
+
+def test_exact_match():
+    prediction = _index().predict("M", 30, False, "0-15 Min", False)
+    assert prediction["stop_outcome"] == {
+        "value": "Citation", "count": 2, "matches": 2, "matched_on": predictor.PREDICTION_KEYS,
+    }
+    assert prediction["violation"]["value"] == "Speeding"
+
+
+def test_backs_off_to_coarser_keys():
+    index = _index()
+    without_age = index.predict("M", 31, False, "0-15 Min", False)["stop_outcome"]
+    assert without_age["matched_on"] == predictor.BACKOFF_LEVELS[1]
+    assert (without_age["value"], without_age["count"], without_age["matches"]) == ("Citation", 2, 3)
+    drugs_only = index.predict("M", 31, None, "16-30 Min", True)["violation"]
+    assert drugs_only["matched_on"] == ["drugs_related_stop"]
+    assert (drugs_only["value"], drugs_only["count"]) == ("DUI", 2)
+    anything = index.predict("X", 0, None, None, None)["stop_outcome"]
+    assert anything["matched_on"] == []
+    assert (anything["value"], anything["matches"]) == ("Citation", 5)    # tied with Warning, smallest wins
+
+
+def test_empty_index_predicts_the_default():
+    prediction = predictor.PredictorIndex().predict("M", 30, False, "0-15 Min", False)
+    assert prediction["stop_outcome"]["value"] == predictor.DEFAULT_PREDICTION["stop_outcome"]
+    assert prediction["stop_outcome"]["matched_on"] is None
+
+
+def test_new_logs_update_the_modes():
+    index = _index()
+    assert index.needs_refresh() is False and index.built_version == 7
+    index.add_many([dict(STOPS[2], driver_age=30)] * 3)
+    prediction = index.predict("M", 30, False, "0-15 Min", False)["stop_outcome"]
+    assert (prediction["value"], prediction["count"], prediction["matches"]) == ("Warning", 3, 5)
+    assert index.predict("X", 0, None, None, None)["stop_outcome"]["value"] == "Warning"
+
+
+def test_placeholders_are_not_counted():
+    unknown = dict(STOPS[0], stop_outcome="unknown", violation="unknown", stop_duration="unknown")
+    index = _index(STOPS + [unknown])
+    index.add_many([unknown] * 10)
+    assert index.values("stop_outcome") == ["Arrest", "Citation", "Warning"]
+    assert index.values("violation") == ["DUI", "Seatbelt", "Speeding"]
+    assert index.durations() == ["0-15 Min", "16-30 Min", "30+ Min"]
+    assert index.predict("M", 30, False, "unknown", False)["stop_outcome"]["value"] == "Citation"
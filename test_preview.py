@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from psycopg2 import sql
+
+import preview
+
+
+# Composed SQL as text without a connection (Identifier.as_string needs one to quote)
+def _text(query):
+    if isinstance(query, sql.Composed):
+        return "".join(_text(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join(f'"{name}"' for name in query.strings)
+    return query.string
+
+
+def test_first_page_fetches_one_extra_row():
+    query, params = preview.build_page_query(page_size=25)
+    assert _text(query) == (
+        'SELECT *, ctid::text AS "_row_key" FROM "Policelog"  ORDER BY "timestamp" ASC NULLS LAST, ctid LIMIT %s'
+    )
+    assert params == [26]
+
+
+def test_next_page_starts_after_the_last_key():
+    after = (datetime(2024, 5, 1, 10), "(3,7)")
+    query, params = preview.build_page_query("timestamp", descending=True, page_size=50, after=after)
+    text = _text(query)
+    assert 'WHERE ("timestamp" < %s OR ("timestamp" = %s AND ctid > %s::tid) OR "timestamp" IS NULL)' in text
+    assert text.endswith('ORDER BY "timestamp" DESC NULLS LAST, ctid LIMIT %s')
+    assert params == [after[0], after[0], "(3,7)", 51]
+
+
+def test_after_a_null_only_nulls_remain():
+    query, params = preview.build_page_query("driver_age", after=(None, 42), key_column="id")
+    assert '("driver_age" IS NULL AND id > %s)' in _text(query)
+    assert params == [42, 26]
+
+
+def test_filters_and_date_range_come_first():
+    query, params = preview.build_page_query(
+        "country_name", filters={"violation": "speed", "is_arrested": 1},
+        date_range=(datetime(2024, 1, 1), datetime(2024, 2, 1)), after=("India", 9), key_column="id",
+    )
+    text = _text(query)
+    assert 'WHERE timestamp >= %s AND timestamp < %s AND "violation" ILIKE %s AND "is_arrested" = %s AND (' in text
+    assert params == [datetime(2024, 1, 1), datetime(2024, 2, 1), "%speed%", True, "India", "India", 9, 26]
+
+
+@pytest.mark.parametrize("arguments", [
+    {"sort_column": "password"},
+    {"filters": {"id": 1}},
+    {"key_column": "oid"},
+])
+def test_rejects_unknown_columns(arguments):
+    with pytest.raises(ValueError):
+        preview.build_page_query(**arguments)
+
+
+def _page(rows):
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime([f"2024-05-01 10:{minute:02d}" for minute in range(rows)]),
+        "driver_age": pd.array([30 + n for n in range(rows - 1)] + [None], dtype="Int64"),
+        "count": np.arange(rows, dtype="int64"),
+        preview.ROW_KEY: [f"(0,{n})" for n in range(rows)],
+    })
+
+
+def test_split_page_returns_the_key_to_continue_after():
+    visible, next_key = preview.split_page(_page(4), "timestamp", 3)
+    assert len(visible) == 3 and preview.ROW_KEY not in visible.columns
+    assert next_key == (datetime(2024, 5, 1, 10, 2), "(0,2)")
+    assert type(next_key[0]) is datetime
+
+
+def test_split_page_converts_numpy_values_and_nulls():
+    assert preview.split_page(_page(3), "count", 1)[1] == (0, "(0,0)")
+    assert type(preview.split_page(_page(3), "count", 1)[1][0]) is int
+    assert preview.split_page(_page(3), "driver_age", 2)[1] == (31, "(0,1)")
+    page = _page(2).iloc[::-1].reset_index(drop=True)    # the NULL age first
+    assert preview.split_page(page, "driver_age", 1)[1] == (None, "(0,1)")
+
+
+def test_last_page_has_no_next_key():
+    visible, next_key = preview.split_page(_page(3), "timestamp", 3)
+    assert len(visible) == 3 and next_key is None
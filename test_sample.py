@@ -0,0 +1,61 @@
+import random
+
+import pandas as pd
+import pytest
+
+import sample
+
+
+def test_scale_count_on_the_whole_table_is_exact():
+    assert sample.scale_count(50, 1.0) == (50, 0)
+
+
+def test_scale_count_scales_by_the_fraction():
+    assert sample.scale_count(10, 0.1) == (100, 59)    # 1.96 * sqrt(10 * 0.9) / 0.1
+    value, margin = sample.scale_count(0, 0.5)
+    assert value == 0 and margin > 0    # nothing sampled is not proof of nothing there
+
+
+def test_rate_interval_bounds():
+    assert sample.rate_interval(0, 0, 0.1) == (0.0, 0.0)
+    assert sample.rate_interval(3, 10, 1.0) == pytest.approx((0.3, 0.3))
+    low, high = sample.rate_interval(3, 10, 0.01)
+    assert 0.0 <= low < 0.3 < high <= 1.0
+    assert sample.rate_interval(0, 10, 0.01)[0] == 0.0
+    assert sample.rate_interval(10, 10, 0.01)[1] == 1.0
+
+
+def test_rate_interval_narrows_with_more_of_the_table_sampled():
+    widths = [high - low for low, high in (sample.rate_interval(30, 100, fraction) for fraction in [0.01, 0.5, 0.9])]
+    assert widths[0] > widths[1] > widths[2] > 0
+
+
+# With a 1% sample of a large population, about 95% of the intervals should cover the true rate
+def test_rate_interval_coverage():
+    generator = random.Random(16)
+    rate, n, trials = 0.2, 400, 2000
+    covered = 0
+    for _ in range(trials):
+        hits = sum(generator.random() < rate for _ in range(n))
+        low, high = sample.rate_interval(hits, n, 0.01)
+        covered += low <= rate <= high
+    assert 0.93 <= covered / trials <= 0.97
+
+
+def test_estimate_rates_scales_counts_and_keeps_the_limit():
+    title = "Countries report the highest rate of drug-related stop"
+    counts = pd.DataFrame({"country_name": ["India", "USA"], "sample_stops": [200, 100], "sample_hits": [10, 20]})
+    top = sample.estimate_rates(title, counts, 0.1)
+    assert list(top["country_name"]) == ["USA"]
+    row = top.iloc[0]
+    assert (row["total_stops"], row["drug_related_stops"], row["drug_related_percentage"]) == (1000, 200, 20.0)
+    assert row["drug_related_percentage_low"] < 20.0 < row["drug_related_percentage_high"]
+    assert row["sampled_stops"] == 100
+    assert len(sample.estimate_rates(title, counts, 0.1, all_groups=True)) == 2
+
+
+def test_on_sample_swaps_the_table():
+    source = {"table": "policelog_sample"}
+    assert sample.on_sample('SELECT COUNT(*) FROM "Policelog" WHERE is_arrested;', source) == (
+        'SELECT COUNT(*) FROM policelog_sample AS "Policelog" WHERE is_arrested;'
+    )
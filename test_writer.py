@@ -0,0 +1,166 @@
+import json
+import os
+import time
+
+import psycopg2
+import pytest
+
+import writer
+
+STOP = {"stop_date": "2024-05-01", "stop_time": "10:00"}
+
+
+def _problem(record):
+    with pytest.raises(ValueError) as error:
+        writer.validate(record)
+    return str(error.value)
+
+
+def test_validate_fills_defaults():
+    row = writer.validate({**STOP, "driver_age": "30", "violation": "Speeding", "driver_gender": "f"})
+    assert row["timestamp"] == "2024-05-01 10:00:00"
+    assert row["stop_time"] == "10:00:00"
+    assert row["driver_gender"] == "F"
+    assert row["driver_age_raw"] == 30
+    assert row["violation_raw"] == "Speeding"
+    assert row["stop_outcome"] == "unknown"
+
+
+def test_validate_keeps_missing_raw_age_null():
+    assert writer.validate(STOP)["driver_age_raw"] is None
+
+
+@pytest.mark.parametrize("column", ["driver_age", "driver_age_raw"])
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "99999", "-1", "old"])
+def test_validate_rejects_bad_ages(column, value):
+    assert column in _problem({**STOP, column: value})
+
+
+def test_validate_rejects_unknown_fields_and_missing_date():
+    problem = _problem({"stop_time": "10:00", "colour": "red"})
+    assert "unknown field 'colour'" in problem
+    assert "stop_date: missing" in problem
+
+
+@pytest.mark.parametrize("gender", ["Male", "female", "X", "MF"])
+def test_validate_matches_gender_exactly(gender):
+    assert "driver_gender" in _problem({**STOP, "driver_gender": gender})
+
+
+def test_validate_checks_timestamp_against_stop_date_and_time():
+    assert writer.validate({**STOP, "timestamp": "2024-05-01T10:00:00"})["timestamp"] == "2024-05-01 10:00:00"
+    assert "does not match" in _problem({**STOP, "timestamp": "2024-05-02 10:00:00"})
+
+
+@pytest.mark.parametrize("value, expected", [("yes", True), ("F", False), (True, True), ("0", False)])
+def test_validate_parses_flags(value, expected):
+    assert writer.validate({**STOP, "is_arrested": value})["is_arrested"] is expected
+
+
+def test_validate_rejects_long_text():
+    assert "longer than" in _problem({**STOP, "country_name": "x" * (writer.MAX_TEXT_LENGTH + 1)})
+
+
+# A writer whose batches go to the outcomes listed in `results` (True written, False already written, or an
+# exception to raise) instead of Postgres
+@pytest.fixture
+def fake_writes(monkeypatch):
+    writes, results = [], []
+
+    def write(self, batch_id, rows):
+        writes.append((batch_id, rows))
+        result = results.pop(0) if results else True
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(writer.BatchWriter, "_write", write)
+    return writes, results
+
+
+def _journal(directory, batch_id, rows, torn=False):
+    with open(os.path.join(directory, f"{batch_id}.jsonl"), "w", encoding="utf-8") as journal:
+        journal.writelines(json.dumps(row) + "\n" for row in rows)
+        if torn:
+            journal.write('{"stop_date": "2024')
+
+
+def test_writes_batches_and_removes_their_journal(tmp_path, fake_writes):
+    writes, _ = fake_writes
+    batch_writer = writer.BatchWriter(journal_directory=str(tmp_path), flush_seconds=0.01)
+    try:
+        accepted, rejected = batch_writer.submit_many([STOP, {**STOP, "driver_gender": "X"}, STOP])
+        assert (accepted, len(rejected)) == (2, 1)
+        assert rejected[0][0] == 1
+        assert batch_writer.flush(10)
+    finally:
+        batch_writer.stop(10)
+    assert [len(rows) for _, rows in writes] == [2]
+    assert batch_writer.metrics()["written"] == 2
+    assert sorted(os.listdir(tmp_path)) == [writer.LOCK_FILE]
+
+
+def test_replays_journal_left_by_an_earlier_writer(tmp_path, fake_writes):
+    writes, results = fake_writes
+    rows = [writer.validate(STOP), writer.validate({**STOP, "stop_time": "11:00"})]
+    _journal(tmp_path, "20240501000000-a", rows, torn=True)
+    _journal(tmp_path, "20240501000001-b", rows[:1])
+    results.extend([True, False])    # the second batch's commit had gone through before the crash
+    batch_writer = writer.BatchWriter(journal_directory=str(tmp_path))
+    try:
+        assert batch_writer.flush(10)
+    finally:
+        batch_writer.stop(10)
+    assert writes == [("20240501000000-a", rows), ("20240501000001-b", rows[:1])]
+    stats = batch_writer.metrics()
+    assert (stats["written"], stats["batches"], stats["duplicate_batches"]) == (2, 1, 1)
+    assert sorted(os.listdir(tmp_path)) == [writer.LOCK_FILE]
+
+
+def test_sets_failed_batches_aside_and_goes_on(tmp_path, fake_writes):
+    writes, results = fake_writes
+    _journal(tmp_path, "20240501000000-bad", [writer.validate(STOP)])
+    _journal(tmp_path, "20240501000001-good", [writer.validate(STOP)])
+    results.extend([psycopg2.DataError("value out of range for type smallint"), True])
+    batch_writer = writer.BatchWriter(journal_directory=str(tmp_path))
+    try:
+        assert batch_writer.flush(10)
+    finally:
+        batch_writer.stop(10)
+    assert [batch_id for batch_id, _ in writes] == ["20240501000000-bad", "20240501000001-good"]
+    assert batch_writer.metrics()["failed_batches"] == 1
+    failed = tmp_path / writer.FAILED_DIRECTORY
+    assert sorted(os.listdir(failed)) == ["20240501000000-bad.error", "20240501000000-bad.jsonl"]
+    assert "out of range" in (failed / "20240501000000-bad.error").read_text()
+
+
+def test_keeps_batches_for_a_retry_after_a_lost_connection(tmp_path, fake_writes):
+    writes, results = fake_writes
+    # the first retry comes right after the failure, later ones every RETRY_SECONDS
+    results.extend([psycopg2.OperationalError("server closed the connection")] * 2)
+    batch_writer = writer.BatchWriter(journal_directory=str(tmp_path))
+    try:
+        batch_writer.submit(STOP)
+        batch_writer.flush(10)
+        deadline = time.monotonic() + 10
+        while batch_writer.metrics()["failed_writes"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = batch_writer.metrics()
+        assert (stats["failed_writes"], stats["waiting_retry"], stats["written"]) == (2, 1, 0)
+        assert os.path.exists(os.path.join(tmp_path, f"{writes[0][0]}.jsonl"))
+        assert batch_writer.flush(10)    # an explicit flush retries now
+    finally:
+        batch_writer.stop(10)
+    assert len(writes) == 3 and writes[0] == writes[1] == writes[2]
+    assert sorted(os.listdir(tmp_path)) == [writer.LOCK_FILE]
+
+
+@pytest.mark.skipif(writer.fcntl is None, reason="journal directories are only locked where fcntl exists")
+def test_journal_directory_belongs_to_one_writer(tmp_path, fake_writes):
+    batch_writer = writer.BatchWriter(journal_directory=str(tmp_path))
+    try:
+        with pytest.raises(writer.JournalBusy):
+            writer.BatchWriter(journal_directory=str(tmp_path))
+    finally:
+        batch_writer.stop(10)
+    writer.BatchWriter(journal_directory=str(tmp_path)).stop(10)
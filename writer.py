@@ -0,0 +1,500 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, time as clock_time
+
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from db import CONNECTION_ERRORS, connect
+from ingest import COLUMNS, CREATE_TABLE_SQL, FILL_VALUES, coerce_integers, copy_chunk, integer_columns, table_columns
+from partitions import ensure_partitions
+
+try:
+    import fcntl
+except ImportError:    # Windows: journal directories are not locked
+    fcntl = None
+
+# A batch is flushed once it holds FLUSH_ROWS logs or its oldest log has waited FLUSH_SECONDS; batches smaller
+# than COPY_MIN_ROWS go in as one multi-row INSERT, bigger ones through COPY
+FLUSH_ROWS = 5000
+FLUSH_SECONDS = 1.0
+COPY_MIN_ROWS = 100
+
+# Submitters wait once this many logs are buffered or waiting for a retry, and give up after SUBMIT_TIMEOUT
+MAX_PENDING = 200000
+SUBMIT_TIMEOUT = 30.0
+
+# How often journaled batches that failed to write are retried
+RETRY_SECONDS = 5.0
+
+# Every batch is journaled here as JSON lines before it is buffered, and the file is removed once the batch is
+# committed; files left behind (a failed write, a crash) are replayed by the next writer. The dashboard's writer
+# uses JOURNAL_DIRECTORY and python writer.py its own CLI_JOURNAL_DIRECTORY; a writer holds an exclusive lock on
+# its directory's LOCK_FILE while it runs, so no other writer replays files it is still appending to.
+JOURNAL_DIRECTORY = "journal"
+CLI_JOURNAL_DIRECTORY = os.path.join(JOURNAL_DIRECTORY, "cli")
+LOCK_FILE = "writer.lock"
+
+# Batches that fail for any reason other than a lost connection would fail again on every retry, so their journal
+# file is moved to this subdirectory with a .error file next to it; moving it back queues it again
+FAILED_DIRECTORY = "failed"
+
+# Ids of the batches already written, so replaying a batch whose commit was never acknowledged is a no-op
+BATCHES_SQL = """CREATE TABLE IF NOT EXISTS policelog_batches (
+    batch_id text PRIMARY KEY,
+    rows integer NOT NULL,
+    written_at timestamptz NOT NULL DEFAULT now()
+);"""
+
+FLAG_COLUMNS = ["search_conducted", "is_arrested", "drugs_related_stop"]
+TRUE_VALUES = {"true", "t", "yes", "y", "1"}
+FALSE_VALUES = {"false", "f", "no", "n", "0"}
+GENDERS = {"M", "F"}
+MAX_AGE = 120
+MAX_TEXT_LENGTH = 200
+UPLOAD_CHUNKSIZE = 10000
+
+
+def _missing(value):
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"not a yes/no value: {value!r}")
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+def _time(value):
+    if hasattr(value, "hour") and not isinstance(value, str):
+        return value.replace(microsecond=0)
+    try:
+        return clock_time.fromisoformat(str(value).strip()).replace(microsecond=0)
+    except ValueError:
+        raise ValueError(f"not a time: {value!r}") from None
+
+
+def _age(value):
+    age = float(value)
+    if math.isnan(age) or not 0 <= age <= MAX_AGE:
+        raise ValueError(f"out of range 0-{MAX_AGE}: {value!r}")
+    return int(round(age))
+
+
+def _timestamp(value):
+    return pd.Timestamp(value).to_pydatetime().replace(microsecond=0)
+
+
+def _text(value):
+    text = str(value).strip()
+    if len(text) > MAX_TEXT_LENGTH:
+        raise ValueError(f"longer than {MAX_TEXT_LENGTH} characters")
+    return text
+
+
+PARSERS = {column: _text for column in COLUMNS}
+PARSERS.update({"stop_date": _date, "stop_time": _time, "timestamp": _timestamp, "driver_age": _age, "driver_age_raw": _age})
+PARSERS.update({column: _flag for column in FLAG_COLUMNS})
+
+
+# Check one log against the "Policelog" columns and return it as a JSON-ready row with every column. Missing
+# text fields get the notebook's fill values, the timestamp is built from the stop date and time (a given one has
+# to agree with them), and the raw age / violation default to the cleaned ones. Raises ValueError listing every
+# problem.
+def validate(record):
+    problems = [f"unknown field {field!r}" for field in record if field not in COLUMNS]
+    row = dict.fromkeys(COLUMNS)
+    for column, parse in PARSERS.items():
+        value = record.get(column)
+        if _missing(value):
+            continue
+        try:
+            row[column] = parse(value)
+        except (TypeError, ValueError, OverflowError) as e:    # OverflowError: e.g. "inf" for a number
+            problems.append(f"{column}: {e}")
+
+    problems.extend(f"{column}: missing" for column in ["stop_date", "stop_time"] if _missing(record.get(column)))
+    if row["driver_gender"] is not None:
+        row["driver_gender"] = row["driver_gender"].upper()
+        if row["driver_gender"] not in GENDERS:
+            problems.append(f"driver_gender: expected one of {sorted(GENDERS)}, got {record['driver_gender']!r}")
+    if row["stop_date"] is not None and row["stop_time"] is not None:
+        stopped_at = datetime.combine(row["stop_date"], row["stop_time"])
+        if row["timestamp"] is not None and row["timestamp"] != stopped_at:
+            problems.append(f"timestamp: {row['timestamp']} does not match stop_date and stop_time ({stopped_at})")
+        row["timestamp"] = stopped_at
+    if problems:
+        raise ValueError("; ".join(problems))
+
+    if row["driver_age_raw"] is None:
+        row["driver_age_raw"] = row["driver_age"]
+    if row["violation_raw"] is None:
+        row["violation_raw"] = row["violation"]
+    for column, value in FILL_VALUES.items():
+        if row[column] is None:
+            row[column] = value
+    row["stop_date"] = row["stop_date"].isoformat()
+    row["stop_time"] = row["stop_time"].strftime("%H:%M:%S")
+    row["timestamp"] = row["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+    return row
+
+
+# Logs from an uploaded or local JSONL / CSV file, one dict per log; CSV values stay text for validate()
+def read_records(source, name=None):
+    name = (name or getattr(source, "name", None) or str(source)).lower()
+    if name.endswith(".csv"):
+        for chunk in pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=UPLOAD_CHUNKSIZE):
+            yield from chunk.to_dict("records")
+        return
+    lines = open(source, "rb") if isinstance(source, str) else source
+    try:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if isinstance(source, str):
+            lines.close()
+
+
+class BufferFull(Exception):
+    pass
+
+
+class JournalBusy(Exception):
+    pass
+
+
+# Buffers validated logs in memory and writes them to "Policelog" in batches from a background thread, so
+# submitters (the dashboard's form and uploads) return as soon as their logs are journaled. Every batch has its
+# own journal file: it is deleted when the batch commits, replayed later when the connection was lost, and moved
+# to the failed/ subdirectory when the write fails otherwise. A journal directory belongs to one writer at a time,
+# since a new writer replays every file it finds there; JournalBusy is raised while another writer holds it.
+# on_written, if given, is called from the writer thread with the rows of every batch once it has committed.
+class BatchWriter:
+    def __init__(self, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS, max_pending=MAX_PENDING,
+                 journal_directory=JOURNAL_DIRECTORY, sync=True, on_written=None, **config):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.journal_directory = journal_directory
+        self.sync = sync    # fsync the journal before a submit returns
+        self.on_written = on_written
+        self.config = config
+        os.makedirs(journal_directory, exist_ok=True)
+        self._lock_file = open(os.path.join(journal_directory, LOCK_FILE), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise JournalBusy(f"journal directory {journal_directory!r} is in use by another writer") from None
+        self._buffer = []
+        self._buffered_at = None    # when the oldest buffered log arrived
+        self._journal = None    # (batch id, open journal file) of the batch being buffered
+        self._retries = {}    # batch id -> rows, for journaled batches waiting to be (re)written
+        for name in sorted(os.listdir(journal_directory)):
+            if name.endswith(".jsonl"):
+                self._retries[name[:-len(".jsonl")]] = None    # left by an earlier writer, size unknown until read
+        self._writing = 0
+        self._flush_requested = 0    # flush() calls are numbered; the thread records the last one it served
+        self._flushed = 0
+        self._conn = None
+        self._columns = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._stats = {
+            "submitted": 0, "rejected": 0, "written": 0, "batches": 0, "duplicate_batches": 0,
+            "failed_writes": 0, "failed_batches": 0, "write_seconds": 0.0, "last_batch_rows": 0, "last_batch_ms": 0.0, "last_error": None,
+        }
+        self._thread = threading.Thread(target=self._run, name="policelog-writer", daemon=True)
+        self._thread.start()
+
+    def _journal_path(self, batch_id):
+        return os.path.join(self.journal_directory, f"{batch_id}.jsonl")
+
+    def _pending(self):
+        return len(self._buffer) + sum(rows or 0 for rows in self._retries.values()) + self._writing
+
+    # Validate and queue logs; returns (accepted, rejected) where rejected lists (position, log, problem)
+    def submit_many(self, records, timeout=SUBMIT_TIMEOUT):
+        rows, rejected = [], []
+        for position, record in enumerate(records):
+            try:
+                rows.append(validate(record))
+            except ValueError as e:
+                rejected.append((position, record, str(e)))
+        lines = "".join(json.dumps(row) + "\n" for row in rows)
+        with self._changed:
+            self._stats["submitted"] += len(rows)
+            self._stats["rejected"] += len(rejected)
+            if not rows:
+                return 0, rejected
+            deadline = time.monotonic() + timeout
+            while self._pending() and self._pending() + len(rows) > self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._thread.is_alive():
+                    raise BufferFull(f"{self._pending()} logs are waiting to be written (limit {self.max_pending})")
+                self._changed.notify_all()    # flush now rather than at the next time threshold
+                self._changed.wait(remaining)
+            if self._journal is None:
+                batch_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:12]}"
+                self._journal = (batch_id, open(self._journal_path(batch_id), "a", encoding="utf-8"))
+            journal = self._journal[1]
+            journal.write(lines)
+            journal.flush()
+            if self.sync:
+                os.fsync(journal.fileno())
+            if not self._buffer:
+                self._buffered_at = time.monotonic()
+                self._changed.notify_all()    # the thread sleeps longer while the buffer is empty
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.flush_rows:
+                self._changed.notify_all()
+        return len(rows), rejected
+
+    def submit(self, record, timeout=SUBMIT_TIMEOUT):
+        accepted, rejected = self.submit_many([record], timeout)
+        if rejected:
+            raise ValueError(rejected[0][2])
+
+    # Hand the buffered logs over as one batch; called with the lock held
+    def _take_batch(self):
+        batch_id, journal = self._journal
+        journal.close()
+        rows, self._buffer, self._journal, self._buffered_at = self._buffer, [], None, None
+        self._writing += len(rows)
+        return batch_id, rows
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = connect(autocommit=False, **self.config)
+            self._columns = None
+        if self._columns is None:    # re-read after a reconnect, in case the schema was migrated in between
+            with self._conn:
+                with self._conn.cursor() as cursor:
+                    cursor.execute(CREATE_TABLE_SQL)
+                    cursor.execute(BATCHES_SQL)
+                    columns = [column for column in table_columns(cursor) if column in COLUMNS]
+                    self._columns = columns, integer_columns(cursor)
+        return self._conn
+
+    # Write one batch in a single transaction; returns False when the batch id shows it was already written
+    def _write(self, batch_id, rows):
+        conn = self._connection()
+        columns, integers = self._columns
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO policelog_batches (batch_id, rows) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                    (batch_id, len(rows)),
+                )
+                if cursor.rowcount == 0:
+                    return False
+                ensure_partitions(cursor, {datetime.fromisoformat(row["timestamp"][:7] + "-01") for row in rows})
+                if len(rows) >= COPY_MIN_ROWS:
+                    frame = pd.DataFrame.from_records(rows, columns=COLUMNS).reindex(columns=columns)
+                    copy_chunk(cursor, "Policelog", coerce_integers(frame, integers), columns)
+                else:    # validated ages are already whole numbers, which an integer or float column both take
+                    statement = sql.SQL('INSERT INTO "Policelog" ({}) VALUES %s').format(
+                        sql.SQL(", ").join(map(sql.Identifier, columns))
+                    )
+                    values = [[row[column] for column in columns] for row in rows]
+                    execute_values(cursor, statement.as_string(cursor), values, page_size=COPY_MIN_ROWS)
+        return True
+
+    # Move the journal file of a batch that cannot be written aside, with the error next to it
+    def _set_aside(self, batch_id, error):
+        failed = os.path.join(self.journal_directory, FAILED_DIRECTORY)
+        os.makedirs(failed, exist_ok=True)
+        with open(os.path.join(failed, f"{batch_id}.error"), "w", encoding="utf-8") as log:
+            log.write(f"{datetime.now().isoformat(timespec='seconds')} {type(error).__name__}: {str(error).strip()}\n")
+        os.replace(self._journal_path(batch_id), os.path.join(failed, f"{batch_id}.jsonl"))
+
+    # Write one batch; returns False when it is left in the journal for a retry after a lost connection
+    def _flush(self, batch_id, rows):
+        started = time.perf_counter()
+        try:
+            written = self._write(batch_id, rows)
+        except Exception as e:
+            retry = isinstance(e, CONNECTION_ERRORS)
+            if retry and self._conn is not None:
+                self._conn.close()
+            self._columns = None
+            if not retry:
+                try:
+                    self._set_aside(batch_id, e)
+                except OSError:    # left in the journal then, like a lost connection
+                    retry = True
+            with self._changed:
+                self._writing -= len(rows)
+                if retry:
+                    self._retries[batch_id] = len(rows)
+                    self._stats["failed_writes"] += 1
+                    self._stats["last_error"] = str(e).strip()
+                else:
+                    self._stats["failed_batches"] += 1
+                    self._stats["last_error"] = f"batch {batch_id} moved to {FAILED_DIRECTORY}/: {str(e).strip()}"
+                self._changed.notify_all()
+            return not retry
+        os.remove(self._journal_path(batch_id))
+        elapsed = time.perf_counter() - started
+        with self._changed:
+            self._writing -= len(rows)
+            if written:
+                self._stats["written"] += len(rows)
+                self._stats["batches"] += 1
+            else:
+                self._stats["duplicate_batches"] += 1
+            self._stats["write_seconds"] += elapsed
+            self._stats["last_batch_rows"] = len(rows)
+            self._stats["last_batch_ms"] = round(elapsed * 1000, 1)
+            self._changed.notify_all()
+        if written and self.on_written is not None:
+            try:
+                self.on_written(rows)
+            except Exception as e:    # the batch is committed either way
+                with self._changed:
+                    self._stats["last_error"] = f"on_written: {e}"
+        return True
+
+    def _read_journal(self, batch_id):
+        rows = []
+        with open(self._journal_path(batch_id), encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:    # torn last line of a crashed writer; that submit never returned
+                    pass
+        return rows
+
+    # Rewrite journaled batches, oldest first; stops at the first lost connection so a down database is not hammered
+    def _replay(self):
+        with self._changed:
+            batch_ids = sorted(self._retries)
+        for batch_id in batch_ids:
+            rows = self._read_journal(batch_id)
+            with self._changed:
+                del self._retries[batch_id]
+                self._writing += len(rows)
+            if not rows:
+                os.remove(self._journal_path(batch_id))
+            elif not self._flush(batch_id, rows):
+                return
+
+    def _due(self, last_retry):
+        if self._stop.is_set() or self._flush_requested > self._flushed or len(self._buffer) >= self.flush_rows:
+            return True
+        if self._buffer and time.monotonic() - self._buffered_at >= self.flush_seconds:
+            return True
+        return bool(self._retries) and time.monotonic() - last_retry >= RETRY_SECONDS
+
+    def _run(self):
+        last_retry = 0.0
+        while True:
+            with self._changed:
+                while not self._due(last_retry):
+                    if self._buffer:
+                        self._changed.wait(max(self._buffered_at + self.flush_seconds - time.monotonic(), 0.01))
+                    else:
+                        self._changed.wait(RETRY_SECONDS)
+                requested = self._flush_requested
+                batch = self._take_batch() if self._buffer else None
+                stopping = self._stop.is_set()
+            if self._retries and (requested > self._flushed or stopping or time.monotonic() - last_retry >= RETRY_SECONDS):
+                last_retry = time.monotonic()
+                self._replay()
+            if batch is not None:
+                self._flush(*batch)
+            with self._changed:
+                self._flushed = requested
+                self._changed.notify_all()
+                if stopping and not self._buffer:
+                    break
+        if self._conn is not None:
+            self._conn.close()
+
+    # Write out everything buffered and retry the journaled batches now; True when nothing is left unwritten
+    def flush(self, timeout=None):
+        with self._changed:
+            self._flush_requested += 1
+            request = self._flush_requested
+            self._changed.notify_all()
+            self._changed.wait_for(lambda: self._flushed >= request or not self._thread.is_alive(), timeout)
+            return not self._buffer and not self._writing and not self._retries
+
+    def metrics(self):
+        with self._changed:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+            stats["waiting_retry"] = len(self._retries)
+            stats["pending"] = self._pending()
+        stats["rows_per_sec"] = round(stats["written"] / stats["write_seconds"]) if stats["write_seconds"] else 0
+        stats["write_seconds"] = round(stats["write_seconds"], 2)
+        stats["running"] = self._thread.is_alive()
+        return stats
+
+    # Flush what is buffered and stop the background thread; unwritten batches stay in the journal
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._lock_file.close()    # releases the journal directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write police logs from JSONL or CSV files into "Policelog" in batches')
+    parser.add_argument("files", nargs="*", help=".jsonl or .csv files of logs; without files, only replay the journal")
+    parser.add_argument("--flush-rows", type=int, default=FLUSH_ROWS, help="logs per batch")
+    parser.add_argument("--journal", default=CLI_JOURNAL_DIRECTORY,
+                        help=f"journal directory (default: {CLI_JOURNAL_DIRECTORY}, apart from the dashboard's {JOURNAL_DIRECTORY})")
+    parser.add_argument("--no-sync", action="store_true", help="do not fsync the journal after every submit")
+    args = parser.parse_args()
+
+    try:
+        writer = BatchWriter(flush_rows=args.flush_rows, journal_directory=args.journal, sync=not args.no_sync)
+    except JournalBusy as e:
+        raise SystemExit(f"{e}; pass another --journal")
+    started = time.perf_counter()
+    for path in args.files:
+        records = read_records(path)
+        while True:
+            chunk = [record for _, record in zip(range(UPLOAD_CHUNKSIZE), records)]
+            if not chunk:
+                break
+            accepted, rejected = writer.submit_many(chunk)
+            for position, record, problem in rejected[:5]:
+                print(f"{path}: rejected {record!r}: {problem}")
+    writer.flush()
+    writer.stop()
+    stats = writer.metrics()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{stats['written']} logs written in {stats['batches']} batches, {stats['rejected']} rejected, "
+        f"{stats['waiting_retry']} batches left in the journal; {elapsed:.2f}s ({stats['written'] / elapsed:,.0f} logs/sec)"
+    )
+    if stats["failed_batches"]:
+        print(f"{stats['failed_batches']} batches could not be written and were moved to "
+              f"{os.path.join(args.journal, FAILED_DIRECTORY)}: {stats['last_error']}")